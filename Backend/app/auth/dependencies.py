@@ -1,16 +1,17 @@
 # app/auth/dependencies.py
 
+import asyncio
+from typing import Optional
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from jose import JWTError, jwt # Asegúrate de importar 'jwt' y 'JWTError' de 'jose'
+from jose import JWTError # Errores de 'jose' (token inválido, expirado, etc.)
 
 # Importa tu modelo de Usuario y tu función de base de datos
 from app.models.entities import Usuario 
 from app.database import get_db
-
-# Importa las constantes de seguridad (SECRET_KEY, ALGORITHM)
-from app.core.security import SECRET_KEY, ALGORITHM 
+from app.auth.principal_cache import UsuarioAutenticado, principal_cache
 
 # Esto define el esquema de seguridad OAuth2 con la URL donde el cliente puede obtener un token
 # Asegúrate de que 'api/login' sea la URL de tu endpoint de login que devuelve el token.
@@ -18,36 +19,53 @@ from app.core.security import SECRET_KEY, ALGORITHM
 # así que la URL completa sería "/api/login".
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login") 
 
+
+def _cargar_usuario(db: Session, user_id: Optional[int], username: str) -> Optional[UsuarioAutenticado]:
+    # Los tokens emitidos antes del claim 'uid' solo traen el username
+    query = db.query(Usuario)
+    user = query.filter(Usuario.id == user_id).first() if user_id is not None else query.filter(Usuario.username == username).first()
+    return UsuarioAutenticado.desde_usuario(user) if user else None
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
-) -> Usuario: # Añadir el tipo de retorno para claridad
+) -> UsuarioAutenticado: # Añadir el tipo de retorno para claridad
     """
     Dependencia para obtener el usuario autenticado a partir de un token JWT.
-    Decodifica y valida el token.
+    Los claims del token y el usuario se cachean (app.auth.principal_cache): con la caché caliente
+    no se decodifica el token ni se consulta 'usuario'. En un fallo de caché la consulta se hace
+    fuera del loop de eventos.
     """
+    return await autenticar_token(token, db)
+
+
+async def autenticar_token(token: str, db: Session) -> UsuarioAutenticado:
+    """Valida el token JWT y retorna el usuario; lanza HTTPException 401 si no es válido (también para WebSockets)."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudieron validar las credenciales",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        # --- Lógica REAL de decodificación de JWT ---
-        # Decodificamos el token usando la SECRET_KEY y el ALGORITHM
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        
-        # Obtenemos el 'sub' (subject) del payload, que es el username del usuario
-        username: str = payload.get("sub") 
-        
-        if username is None:
-            raise credentials_exception # Si el 'sub' no está presente, las credenciales son inválidas
-        
-        # Buscamos al usuario en la base de datos por el username del token
-        user = db.query(Usuario).filter(Usuario.username == username).first()
-        if user is None:
-            raise credentials_exception # Si el usuario no existe en la DB, las credenciales son inválidas
-            
+        payload = principal_cache.claims(token)
     except JWTError: # Captura cualquier error relacionado con el JWT (token inválido, expirado, etc.)
         raise credentials_exception
-        
-    return user
\ No newline at end of file
+
+    # El 'sub' (subject) es el username; 'uid' es el id del usuario
+    username: str = payload.get("sub")
+    if username is None:
+        raise credentials_exception # Si el 'sub' no está presente, las credenciales son inválidas
+    user_id: Optional[int] = payload.get("uid")
+
+    user = principal_cache.get(user_id) if user_id is not None else None
+    if user is None:
+        user = await asyncio.to_thread(_cargar_usuario, db, user_id, username)
+        if user is None:
+            raise credentials_exception # Si el usuario no existe en la DB, las credenciales son inválidas
+        principal_cache.put(user)
+
+    if user.username != username:
+        raise credentials_exception # El usuario cambió de username: los tokens anteriores dejan de valer
+
+    return user
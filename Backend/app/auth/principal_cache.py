@@ -0,0 +1,71 @@
+# app/auth/principal_cache.py
+
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from jose import ExpiredSignatureError, jwt
+
+from app.core.security import ALGORITHM, SECRET_KEY
+from app.models.entities import Usuario
+from app.services.ttl_cache import TTLCache
+
+
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300")) # 5 minutos
+
+
+@dataclass(frozen=True)
+class UsuarioAutenticado:
+    """Datos del usuario autenticado que usan los endpoints; se cachean en lugar de la entidad ORM."""
+    id: int
+    username: str
+    first_name: str
+    last_name: str
+    email: str
+    created_at: Optional[datetime]
+
+    @classmethod
+    def desde_usuario(cls, usuario: Usuario) -> "UsuarioAutenticado":
+        return cls(usuario.id, usuario.username, usuario.first_name, usuario.last_name, usuario.email, usuario.created_at)
+
+
+class PrincipalCache:
+    """
+    Cachés de autenticación: los claims ya verificados de cada token (decodificar y verificar la
+    firma una sola vez por token) y el usuario autenticado por id, con TTL y tamaño acotado.
+    update_user invalida la entrada del usuario.
+    """
+    def __init__(self, max_entries: int = AUTH_CACHE_MAX_ENTRIES, ttl_seconds: float = AUTH_CACHE_TTL_SECONDS):
+        self._claims = TTLCache(max_entries, ttl_seconds)
+        self._usuarios = TTLCache(max_entries, ttl_seconds)
+
+    def claims(self, token: str) -> dict:
+        """Claims del token; lanza JWTError si el token es inválido o ya expiró."""
+        claims = self._claims.get(token)
+        if claims is None:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            self._claims.put(token, claims)
+        elif claims.get("exp") is not None and claims["exp"] < time.time():
+            # La entrada puede sobrevivir al vencimiento del token
+            self._claims.invalidate(token)
+            raise ExpiredSignatureError("Signature has expired.")
+        return claims
+
+    def get(self, user_id: int) -> Optional[UsuarioAutenticado]:
+        return self._usuarios.get(user_id)
+
+    def put(self, usuario: UsuarioAutenticado):
+        self._usuarios.put(usuario.id, usuario)
+
+    def invalidar(self, user_id: int):
+        self._usuarios.invalidate(user_id)
+
+    def metricas(self) -> dict:
+        return {"tokens": self._claims.metricas(), "usuarios": self._usuarios.metricas()}
+
+
+# Instancia global de la caché
+principal_cache = PrincipalCache()
@@ -1,22 +1,36 @@
 # app/auth/routes.py
+import asyncio
+import uuid
 from fastapi import APIRouter, Depends, HTTPException, status # Importamos 'status' para códigos HTTP más claros
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 # Asegúrate de que 'app.models.models' contenga tus modelos Pydantic (UserRegister, UserLogin, UserUpdate)
-from app.models.models import UserRegister, UserLogin, UserUpdate, UserResponse
-from app.models.entities import Usuario # Importamos el modelo Usuario de entities
+from app.models.models import UserRegister, UserLogin, UserUpdate, UserResponse, RefreshTokenRequest
+from app.models.entities import Usuario, RefreshToken # Importamos el modelo Usuario de entities
 from app.database import get_db
-from app.auth.utils import hash_password, verify_password # Funciones para hashing de contraseñas
-from app.core.security import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES 
-from datetime import timedelta
+from app.auth.utils import hash_password_async, verify_password_async # Hashing de contraseñas en un pool acotado
+from app.core.security import (
+    create_access_token, create_refresh_token, hash_refresh_token,
+    ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
+)
+from datetime import datetime, timedelta, timezone
 from app.auth.dependencies import get_current_user
+from app.auth.principal_cache import UsuarioAutenticado, principal_cache
 router = APIRouter()
 
 @router.post("/register", status_code=status.HTTP_201_CREATED) # Código de estado 201 para creación exitosa
-def register(user_data: UserRegister, db: Session = Depends(get_db)):
+async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     """
     Registra un nuevo usuario en la base de datos.
-    Hashea la contraseña antes de guardarla.
+    Hashea la contraseña antes de guardarla (en el pool acotado de bcrypt); las consultas
+    se hacen fuera del loop de eventos.
     """
+    await asyncio.to_thread(_verificar_disponible, db, user_data)
+    password = await hash_password_async(user_data.password)
+    return await asyncio.to_thread(_crear_usuario, db, user_data, password)
+
+
+def _verificar_disponible(db: Session, user_data: UserRegister):
     # Verificamos si el nombre de usuario o el correo electrónico ya existen
     existing_user_by_username = db.query(Usuario).filter(Usuario.username == user_data.username).first()
     if existing_user_by_username:
@@ -32,11 +46,13 @@ def register(user_data: UserRegister, db: Session = Depends(get_db)):
             detail="El correo electrónico ya está registrado."
         )
 
+
+def _crear_usuario(db: Session, user_data: UserRegister, password: str) -> dict:
     try:
         # Creamos una nueva instancia de Usuario con los datos del Pydantic UserRegister
         new_user = Usuario(
             username=user_data.username,
-            password=hash_password(user_data.password), # Hasheamos la contraseña
+            password=password, # Contraseña ya hasheada
             first_name=user_data.first_name,
             last_name=user_data.last_name,
             email=user_data.email
@@ -57,38 +73,56 @@ def register(user_data: UserRegister, db: Session = Depends(get_db)):
 
 
 
+def _emitir_tokens(db: Session, user_id: int, username: str, familia: uuid.UUID) -> dict:
+    """Token de acceso JWT y un token de refresco nuevo de la familia (se guarda solo su hash)."""
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # El 'sub' (subject) del token es comúnmente el username.
+    # 'uid' lleva el id del usuario: los endpoints lo usan sin consultar la tabla 'usuario'.
+    access_token = create_access_token(
+        data={"sub": username, "uid": user_id}, expires_delta=access_token_expires
+    )
+    refresh_token, refresh_hash = create_refresh_token()
+    db.add(RefreshToken(
+        user_id=user_id,
+        token_hash=refresh_hash,
+        familia=familia,
+        expires_at=datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    db.commit()
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": int(access_token_expires.total_seconds()),
+    }
+
+
 @router.post("/login")
-def login(credentials: UserLogin, db: Session = Depends(get_db)):
+async def login(credentials: UserLogin, db: Session = Depends(get_db)):
     """
     Autentica a un usuario.
-    Verifica las credenciales, genera un token JWT y devuelve información del usuario y el token.
+    Verifica las credenciales, genera un token JWT y un token de refresco y devuelve información del usuario y los tokens.
     """
     # 1. Buscar al usuario por su nombre de usuario
-    user = db.query(Usuario).filter(Usuario.username == credentials.username).first()
+    user = await asyncio.to_thread(lambda: db.query(Usuario).filter(Usuario.username == credentials.username).first())
     print(f"Se recibió una solicitud de login para: {credentials.username}")
 
     # 2. Verificar si el usuario existe y si la contraseña es correcta
-    if not user or not verify_password(credentials.password, user.password):
+    if not user or not await verify_password_async(credentials.password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Nombre de usuario o contraseña incorrectos."
         )
     
-    # 3. Si las credenciales son válidas, generar el token JWT
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    # El 'sub' (subject) del token es comúnmente el username.
-    # Es una buena práctica almacenar un identificador único y no sensible en el token.
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
+    # 3. Si las credenciales son válidas, generar los tokens; cada login abre una familia de refresco nueva
+    tokens = await asyncio.to_thread(_emitir_tokens, db, user.id, user.username, uuid.uuid4())
 
     # 4. Devolver el token y la información del usuario al frontend
     # Esto permite al frontend almacenar el token y usar la información del usuario
     # para renderizar la HomePage u otras secciones personalizadas.
     return {
         "message": "Inicio de sesión exitoso.",
-        "access_token": access_token,
-        "token_type": "bearer",
+        **tokens,
         "user": { # Información del usuario que el frontend puede usar
             "id": user.id,
             "username": user.username,
@@ -103,6 +137,58 @@ def login(credentials: UserLogin, db: Session = Depends(get_db)):
 
 
 
+def _rotar_refresh_token(db: Session, refresh_token: str) -> dict:
+    token_hash = hash_refresh_token(refresh_token)
+    # Revoca el token y lee su dueño en una sola sentencia: dos usos simultáneos no pueden rotarlo dos veces
+    fila = db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == token_hash,
+            RefreshToken.revocado == False,
+            RefreshToken.expires_at > func.now(),
+        )
+        .values(revocado=True)
+        .returning(RefreshToken.user_id, RefreshToken.familia)
+    ).first()
+    if fila is None:
+        # Un token ya revocado que vuelve a usarse indica robo: se revoca toda su familia
+        familia = db.query(RefreshToken.familia).filter(RefreshToken.token_hash == token_hash).scalar()
+        if familia is not None:
+            db.execute(update(RefreshToken).where(RefreshToken.familia == familia).values(revocado=True))
+        db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token de refresco inválido o expirado.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    principal = principal_cache.get(fila.user_id)
+    username = principal.username if principal else db.query(Usuario.username).filter(Usuario.id == fila.user_id).scalar()
+    return _emitir_tokens(db, fila.user_id, username, fila.familia)
+
+
+@router.post("/refresh")
+async def refresh(request: RefreshTokenRequest, db: Session = Depends(get_db)):
+    """
+    Renueva el token de acceso con el token de refresco, sin contraseña (sin bcrypt).
+    El token de refresco usado queda revocado y se entrega uno nuevo (rotación).
+    """
+    return await asyncio.to_thread(_rotar_refresh_token, db, request.refresh_token)
+
+
+def _revocar_familia(db: Session, refresh_token: str):
+    familia = db.query(RefreshToken.familia).filter(RefreshToken.token_hash == hash_refresh_token(refresh_token)).scalar()
+    if familia is not None:
+        db.execute(update(RefreshToken).where(RefreshToken.familia == familia).values(revocado=True))
+        db.commit()
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(request: RefreshTokenRequest, db: Session = Depends(get_db)):
+    """Cierra la sesión: revoca el token de refresco y todos los de su familia."""
+    await asyncio.to_thread(_revocar_familia, db, request.refresh_token)
+
+
 @router.put("/users/{user_id}")
 def update_user(user_id: int, updated_user_data: UserUpdate, db: Session = Depends(get_db)):
     """
@@ -141,6 +227,7 @@ def update_user(user_id: int, updated_user_data: UserUpdate, db: Session = Depen
         user_to_update.email = updated_user_data.email
 
         db.commit()
+        principal_cache.invalidar(user_id) # El usuario autenticado cacheado ya no está al día
         db.refresh(user_to_update) # Refrescamos para obtener cualquier actualización automática (como 'onupdate' si se aplicara)
         
         return {"message": "Perfil actualizado exitosamente", "user": {
@@ -168,11 +255,11 @@ def update_user(user_id: int, updated_user_data: UserUpdate, db: Session = Depen
     description="Devuelve los detalles del usuario actualmente autenticado basado en el token JWT proporcionado."
 )
 async def read_current_user(
-    current_user: Usuario = Depends(get_current_user) # La dependencia te inyecta el objeto DBUser
+    current_user: UsuarioAutenticado = Depends(get_current_user) # La dependencia inyecta el usuario autenticado (cacheado)
 ):
     """
-    Retorna el objeto Usuario del usuario autenticado.
-    FastAPI mapeará automáticamente el objeto DBUser a tu UserResponse model,
+    Retorna el usuario autenticado.
+    FastAPI mapeará automáticamente el objeto a tu UserResponse model,
     asumiendo que los nombres de los atributos coinciden.
     """
     # FastAPI/Pydantic con from_attributes=True se encargará de mapear:
@@ -1,9 +1,24 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt ocupa un núcleo por cálculo: un pool acotado evita que una ola de logins acapare la CPU
+# y los hilos del servidor; el resto de peticiones sigue atendiéndose mientras esperan turno.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
 def hash_password(password: str):       #Funcion encriptar contraseña en Hash
     return pwd_context.hash(password)
 
 def verify_password(plain_password, hashed_password):   #Compara la contraseña ingresada con la contraseña encriptada
     return pwd_context.verify(plain_password, hashed_password)
+
+async def hash_password_async(password: str) -> str:    #hash_password en el pool acotado
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, hash_password, password)
+
+async def verify_password_async(plain_password, hashed_password) -> bool:   #verify_password en el pool acotado
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, verify_password, plain_password, hashed_password)
@@ -1,12 +1,15 @@
+import hashlib
 import os
+import secrets
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 
 from jose import JWTError, jwt
 
 SECRET_KEY = os.getenv("SECRET_KEY", "tu-super-secreto-muy-largo-y-seguro-que-debes-cambiar-en-produccion-1234567890")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -17,3 +20,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+
+def hash_refresh_token(token: str) -> str:
+    # El token es aleatorio y largo: basta un hash rápido (no bcrypt) para no guardarlo en claro
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def create_refresh_token() -> Tuple[str, str]:
+    """Retorna (token para el cliente, hash para la base de datos)."""
+    token = secrets.token_urlsafe(48)
+    return token, hash_refresh_token(token)
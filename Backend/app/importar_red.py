@@ -0,0 +1,53 @@
+# app/importar_red.py
+"""
+Importación masiva e idempotente de la red (paradas, rutas y su orden) desde GeoJSON o GTFS.
+
+Uso:
+    python -m app.importar_red paradasTransca.geojson
+    python -m app.importar_red --gtfs feed_transcaribe.zip
+    python -m app.importar_red --gtfs directorio_gtfs/ --mostrar-descartadas
+
+Un GeoJSON aporta solo paradas (features Point). Un feed GTFS aporta paradas (stops.txt) y, por
+cada ruta, la secuencia de paradas de uno de sus viajes (routes.txt, trips.txt, stop_times.txt).
+Repetir la importación actualiza los registros existentes por nombre en lugar de duplicarlos.
+Al terminar se incrementa la versión de la red y el API reconstruye su snapshot una sola vez.
+"""
+import argparse
+import sys
+
+from app.database import Base, SessionLocal, engine
+from app.models.entities import NetworkVersion
+from app.services.network_import import abrir_gtfs, importar_red, leer_paradas_geojson, leer_paradas_gtfs, leer_rutas_gtfs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa paradas y rutas desde GeoJSON o GTFS.")
+    parser.add_argument("entrada", help="Archivo GeoJSON, o feed GTFS (.zip o directorio) con --gtfs.")
+    parser.add_argument("--gtfs", action="store_true", help="La entrada es un feed GTFS.")
+    parser.add_argument("--mostrar-descartadas", action="store_true", help="Lista cada registro descartado.")
+    args = parser.parse_args()
+
+    # La marca de versión es una tabla nueva; las demás ya existen en cualquier despliegue
+    Base.metadata.create_all(bind=engine, tables=[NetworkVersion.__table__])
+
+    descartadas = []
+    db = SessionLocal()
+    try:
+        if args.gtfs:
+            with abrir_gtfs(args.entrada) as abrir:
+                rutas = leer_rutas_gtfs(abrir)
+                resultado = importar_red(db, leer_paradas_gtfs(abrir, descartadas), rutas, descartadas)
+        else:
+            with open(args.entrada, encoding="utf-8") as archivo:
+                resultado = importar_red(db, leer_paradas_geojson(archivo, descartadas), descartadas=descartadas)
+    finally:
+        db.close()
+
+    if args.mostrar_descartadas:
+        for motivo in resultado.descartadas:
+            print(motivo, file=sys.stderr)
+    print(resultado.resumen())
+
+
+if __name__ == "__main__":
+    main()
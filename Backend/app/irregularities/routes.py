@@ -1,31 +1,110 @@
 # app/irregularities/routes.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import base64
+import json
+import math
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
+from sqlalchemy import and_, cast, or_, tuple_
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError # Para manejar duplicados en la clave primaria compuesta
 from sqlalchemy.sql import func
-from geoalchemy2.shape import from_shape, to_shape
+from sqlalchemy.orm import defer
+from geoalchemy2.shape import from_shape
+from geoalchemy2.types import Geography
 from shapely.geometry import Point
 from datetime import datetime # Importa datetime para actualizar ultimo_like_atz|
 from app.database import get_db
-from app.models.entities import ReportedIrregularity, Usuario, IrregularityVote as DBIrregularityVote
+from app.models.entities import ReportedIrregularity
 from app.models.models import IrregularityCreate, IrregularityResponse, IrregularityVoteResponse  
 from app.auth.dependencies import get_current_user # Para obtener el usuario autenticado
+from app.auth.principal_cache import UsuarioAutenticado
+from app.services.coordenadas import columnas_lat_lon, ubicacion_dict
+from app.services.irregularity_dedup import irregularity_dedup_index
+from app.services.irregularity_penalties import irregularity_penalty_service
+from app.services.irregularity_push import Suscripcion, irregularity_push_service
+from app.services.irregularity_votes import registrar_voto
+from app.services.network_snapshot import network_snapshot_service
 
 router = APIRouter()
 
+LIMITE_IRREGULARIDADES = 100 # Tamaño de página por defecto de /active
+LIMITE_MAXIMO_IRREGULARIDADES = 500
+
+
+def _irregularidad_response(irregularity: ReportedIrregularity, latitude: float, longitude: float) -> IrregularityResponse:
+    """Arma la respuesta con coordenadas ya calculadas (sin decodificar la geometría)."""
+    return IrregularityResponse(
+        id=irregularity.id,
+        titulo=irregularity.titulo,
+        descripcion=irregularity.descripcion,
+        activa=irregularity.activa,
+        created_at=irregularity.created_at,
+        ultimo_like_at=irregularity.ultimo_like_at,
+        likes=irregularity.likes,
+        dislikes=irregularity.dislikes,
+        ubicacion=ubicacion_dict(latitude, longitude)
+    )
+
+
+def _query_irregularidades(db: Session):
+    """Irregularidades con su latitud/longitud calculadas por PostGIS; la geometría no se carga."""
+    return db.query(ReportedIrregularity, *columnas_lat_lon(ReportedIrregularity.ubicacion)) \
+        .options(defer(ReportedIrregularity.ubicacion))
+
+
+def _leer_bbox(bbox: str) -> tuple:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(valor) for valor in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox debe ser min_lon,min_lat,max_lon,max_lat.")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="bbox inválido: los mínimos superan a los máximos.")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _publicar(respuesta: IrregularityResponse):
+    """Envía la irregularidad nueva o actualizada a los clientes suscritos a su zona."""
+    if not irregularity_push_service.hay_suscriptores:
+        return
+    mensaje = json.dumps({"tipo": "irregularidad", "irregularidad": respuesta.model_dump(mode="json")})
+    irregularity_push_service.publicar(respuesta.ubicacion.latitude, respuesta.ubicacion.longitude, mensaje)
+
 @router.post(
     "/report",
     response_model=IrregularityResponse,
     status_code=status.HTTP_201_CREATED,
     summary="Reportar una nueva irregularidad o accidente",
-    description="Permite a un usuario autenticado reportar una irregularidad en la vía pública (accidente, desvío, etc.). El reporte es anónimo."
+    description=(
+        "Permite a un usuario autenticado reportar una irregularidad en la vía pública (accidente, desvío, etc.). "
+        "El reporte es anónimo. Si ya hay una irregularidad activa reportada cerca y hace poco, el reporte se "
+        "suma a ella como confirmación ('Me gusta') y se responde 200 con la irregularidad existente."
+    )
 )
 async def report_irregularity(
     irregularity: IrregularityCreate,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioAutenticado = Depends(get_current_user)
 ):
+    # Deduplicación: un reporte cercano, reciente y con el mismo título confirma la irregularidad existente
+    existente_id = irregularity_dedup_index.buscar(db, irregularity.latitud, irregularity.longitud, irregularity.titulo)
+    if existente_id is not None:
+        registrar_voto(db, current_user.id, existente_id, True) # Sin fila si ya la había confirmado: no importa
+        fila = _query_irregularidades(db).filter(
+            ReportedIrregularity.id == existente_id, ReportedIrregularity.activa == True
+        ).first()
+        if fila:
+            irregularity_penalty_service.registrar(
+                network_snapshot_service.get(db), existente_id, fila.latitude, fila.longitude, fila[0].likes, fila[0].dislikes
+            )
+            response.status_code = status.HTTP_200_OK
+            respuesta = _irregularidad_response(*fila)
+            _publicar(respuesta)
+            return respuesta
+        irregularity_dedup_index.quitar(existente_id) # Expiró mientras estaba en la ventana
+
     point = Point(irregularity.longitud, irregularity.latitud)
     db_location = from_shape(point, srid=4326)
 
@@ -41,10 +120,16 @@ async def report_irregularity(
     db.add(db_irregularity)
     db.commit()
     db.refresh(db_irregularity) 
+    irregularity_dedup_index.agregar(
+        db_irregularity.id, irregularity.latitud, irregularity.longitud, irregularity.titulo, db_irregularity.created_at
+    )
+    # Penaliza en el ruteo los tramos de bus cercanos al reporte
+    irregularity_penalty_service.registrar(network_snapshot_service.get(db), db_irregularity.id, irregularity.latitud, irregularity.longitud)
 
-    db_irregularity.ubicacion = to_shape(db_irregularity.ubicacion)
-    
-    return db_irregularity
+    # Las coordenadas son las del reporte: no hace falta leer de vuelta la geometría
+    respuesta = _irregularidad_response(db_irregularity, irregularity.latitud, irregularity.longitud)
+    _publicar(respuesta)
+    return respuesta
 
 
 @router.get(
@@ -60,31 +145,140 @@ async def get_irregularity_details(
     """
     Recupera una irregularidad por su ID.
     """
-    irregularity = db.query(ReportedIrregularity).filter(ReportedIrregularity.id == irregularity_id).first()
-    if not irregularity:
+    fila = _query_irregularidades(db).filter(ReportedIrregularity.id == irregularity_id).first()
+    if not fila:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Irregularidad no encontrada"
         )
-    irregularity.ubicacion = to_shape(irregularity.ubicacion)
-    return irregularity
+    return _irregularidad_response(*fila)
+
+def _codificar_cursor(orden: str, clave: float | str, ultimo_id: int) -> str:
+    datos = json.dumps([orden, clave, ultimo_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(datos).decode("ascii").rstrip("=")
+
+
+def _decodificar_cursor(cursor: str, orden: str):
+    try:
+        datos = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        orden_cursor, clave, ultimo_id = json.loads(datos)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    if orden_cursor != orden:
+        raise HTTPException(status_code=400, detail="El cursor corresponde a otro orden.")
+    if orden == "recientes":
+        try:
+            clave = datetime.fromisoformat(clave)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Cursor inválido.")
+    return clave, ultimo_id
+
+
+def _punto(latitude: float, longitude: float):
+    return func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326)
+
 
 @router.get(
     "/active",
     response_model=list[IrregularityResponse],
-    summary="Obtener todas las irregularidades activas",
-    description="Lista todas las irregularidades que están marcadas como activas en el sistema."
+    summary="Obtener las irregularidades activas de una zona",
+    description=(
+        "Lista las irregularidades activas, opcionalmente dentro de un rectángulo (bbox) o de un radio "
+        "alrededor de un punto. Resultados paginados: si hay más, el encabezado X-Siguiente-Cursor trae "
+        "el cursor para pedir la página siguiente."
+    )
 )
 async def get_active_irregularities(
+    response: Response,
+    bbox: Optional[str] = Query(None, description="Rectángulo visible: min_lon,min_lat,max_lon,max_lat"),
+    latitude: Optional[float] = Query(None, ge=-90, le=90, description="Centro para el radio y el orden 'cercanas'"),
+    longitude: Optional[float] = Query(None, ge=-180, le=180),
+    radius_meters: Optional[float] = Query(None, gt=0, description="Radio de búsqueda en metros alrededor del centro"),
+    orden: str = Query("recientes", pattern="^(recientes|cercanas)$", description="'recientes' o 'cercanas' (al centro)"),
+    limite: int = Query(LIMITE_IRREGULARIDADES, ge=1, le=LIMITE_MAXIMO_IRREGULARIDADES),
+    cursor: Optional[str] = Query(None, description="Valor de X-Siguiente-Cursor de la página anterior"),
     db: Session = Depends(get_db)
 ):
     """
-    Recupera todas las irregularidades activas.
+    Recupera las irregularidades activas de la zona pedida, una página a la vez.
+    Los filtros espaciales usan el índice GiST de la ubicación ('&&'), el orden 'cercanas' es una
+    búsqueda KNN ('<->') y la paginación es por cursor, de modo que el costo depende de la zona
+    visible y del tamaño de página, no del total de reportes.
     """
-    irregularities = db.query(ReportedIrregularity).filter(ReportedIrregularity.activa == True).all()
-    for irreg in irregularities:
-        irreg.ubicacion = to_shape(irreg.ubicacion)
-    return irregularities
+    tiene_centro = latitude is not None and longitude is not None
+    if (radius_meters is not None or orden == "cercanas") and not tiene_centro:
+        raise HTTPException(status_code=400, detail="El radio y el orden 'cercanas' requieren latitude y longitude.")
+
+    query = _query_irregularidades(db).filter(ReportedIrregularity.activa == True)
+
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = _leer_bbox(bbox)
+        query = query.filter(ReportedIrregularity.ubicacion.intersects(
+            func.ST_MakeEnvelope(min_lon, min_lat, max_lon, max_lat, 4326)
+        ))
+
+    if radius_meters is not None:
+        punto = _punto(latitude, longitude)
+        # Caja en grados (usa el índice GiST) y luego la distancia exacta sobre geography
+        grados = radius_meters / (111320 * max(math.cos(math.radians(latitude)), 0.01))
+        query = query.filter(
+            ReportedIrregularity.ubicacion.intersects(func.ST_Expand(punto, grados)),
+            func.ST_DWithin(cast(ReportedIrregularity.ubicacion, Geography), cast(punto, Geography), radius_meters)
+        )
+
+    if orden == "cercanas":
+        distancia = ReportedIrregularity.ubicacion.distance_centroid(_punto(latitude, longitude)) # KNN '<->'
+        query = query.add_columns(distancia.label("distancia"))
+        if cursor:
+            ultima_distancia, ultimo_id = _decodificar_cursor(cursor, orden)
+            query = query.filter(or_(
+                distancia > ultima_distancia,
+                and_(distancia == ultima_distancia, ReportedIrregularity.id > ultimo_id)
+            ))
+        query = query.order_by(distancia, ReportedIrregularity.id)
+    else:
+        if cursor:
+            ultima_fecha, ultimo_id = _decodificar_cursor(cursor, orden)
+            query = query.filter(
+                tuple_(ReportedIrregularity.created_at, ReportedIrregularity.id) < tuple_(ultima_fecha, ultimo_id)
+            )
+        query = query.order_by(ReportedIrregularity.created_at.desc(), ReportedIrregularity.id.desc())
+
+    # Una fila extra indica si hay otra página
+    filas = query.limit(limite + 1).all()
+    if len(filas) > limite:
+        filas = filas[:limite]
+        ultima = filas[-1]
+        if orden == "cercanas":
+            response.headers["X-Siguiente-Cursor"] = _codificar_cursor(orden, ultima.distancia, ultima[0].id)
+        else:
+            response.headers["X-Siguiente-Cursor"] = _codificar_cursor(orden, ultima[0].created_at.isoformat(), ultima[0].id)
+
+    return [_irregularidad_response(fila[0], fila.latitude, fila.longitude) for fila in filas]
+
+def _votar(db: Session, irregularity_id: int, user_id: int, is_like: bool) -> dict:
+    voto = registrar_voto(db, user_id, irregularity_id, is_like)
+    if voto is None:
+        # Sin fila: la irregularidad no existe o el voto ya estaba en el mismo sentido
+        if not db.query(ReportedIrregularity.id).filter(ReportedIrregularity.id == irregularity_id).first():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Irregularidad no encontrada"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Ya has dado 'Me gusta' a esta irregularidad." if is_like else "Ya has dado 'No me gusta' a esta irregularidad."
+        )
+    voto = dict(voto._mapping)
+    if voto.get("likes") is not None:
+        # Con el buffer de votos activo los contadores aún no están escritos: los toma la sincronización periódica
+        irregularity_penalty_service.actualizar_votos(irregularity_id, voto["likes"], voto["dislikes"])
+    if irregularity_push_service.hay_suscriptores:
+        fila = _query_irregularidades(db).filter(ReportedIrregularity.id == irregularity_id).first()
+        if fila:
+            _publicar(_irregularidad_response(*fila))
+    return voto
+
 
 @router.post(
     "/vote/{irregularity_id}/like",
@@ -96,65 +290,13 @@ async def get_active_irregularities(
 async def like_irregularity(
     irregularity_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioAutenticado = Depends(get_current_user)
 ):
     """
-    Registra un voto 'like' para una irregularidad.
-    Actualiza el contador de likes y el campo 'ultimo_like_at' de la irregularidad.
+    Registra un voto 'like' para una irregularidad (o cambia un 'dislike' previo).
+    El voto y los contadores se actualizan en una sola sentencia, sin leer la irregularidad antes.
     """
-    irregularity = db.query(ReportedIrregularity).filter(ReportedIrregularity.id == irregularity_id).first()
-    if not irregularity:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Irregularidad no encontrada"
-        )
-
-    # Verificar si el usuario ya votó por esta irregularidad
-    existing_vote = db.query(DBIrregularityVote).filter(
-        DBIrregularityVote.irregularity_id == irregularity_id, # <--- CAMBIO AQUÍ: 'irregularity_id'
-        DBIrregularityVote.user_id == current_user.id  
-    ).first()
-
-    if existing_vote:
-        if existing_vote.is_like:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Ya has dado 'Me gusta' a esta irregularidad."
-            )
-        else: # Si ya dio dislike, cambia a like
-            existing_vote.is_like = True # <-- ¡CAMBIO IMPORTANTE AQUÍ!
-            existing_vote.created_at = func.now()
-            irregularity.dislikes -= 1 # Reduce el dislike
-            irregularity.likes += 1    # Incrementa el like
-            irregularity.ultimo_like_at = datetime.now() # Actualiza el tiempo del último like
-            db.add(existing_vote)
-            db.add(irregularity)
-            db.commit()
-            db.refresh(existing_vote)
-            return existing_vote
-    
-    # Si no ha votado, crea un nuevo voto 'like'
-    new_vote = DBIrregularityVote(
-        irregularity_id=irregularity_id, # <--- CAMBIO AQUÍ: 'irregularity_id'
-        user_id=current_user.id,         # <--- CAMBIO AQUÍ: 'user_id'
-        is_like=True     
-    )
-    
-    try:
-        db.add(new_vote)
-        irregularity.likes += 1
-        irregularity.ultimo_like_at = datetime.now() # Actualiza el tiempo del último like
-        db.add(irregularity) # Marca la irregularidad para ser actualizada
-        db.commit()
-        db.refresh(new_vote)
-        return new_vote
-    except IntegrityError:
-        # Esto debería ser prevenido por la verificación previa, pero es un buen respaldo
-        db.rollback()
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Ya has votado por esta irregularidad."
-        )
+    return _votar(db, irregularity_id, current_user.id, True)
 
 
 @router.post(
@@ -167,60 +309,49 @@ async def like_irregularity(
 async def dislike_irregularity(
     irregularity_id: int,
     db: Session = Depends(get_db),
-    current_user: Usuario = Depends(get_current_user)
+    current_user: UsuarioAutenticado = Depends(get_current_user)
 ):
     """
-    Registra un voto 'dislike' para una irregularidad.
-    Actualiza el contador de dislikes.
+    Registra un voto 'dislike' para una irregularidad (o cambia un 'like' previo).
+    No actualiza 'ultimo_like_at'.
     """
-    irregularity = db.query(ReportedIrregularity).filter(ReportedIrregularity.id == irregularity_id).first()
-    if not irregularity:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Irregularidad no encontrada"
-        )
+    return _votar(db, irregularity_id, current_user.id, False)
 
-    # Verificar si el usuario ya votó por esta irregularidad
-    existing_vote = db.query(DBIrregularityVote).filter(
-        DBIrregularityVote.irregularity_id == irregularity_id, # <--- CAMBIO AQUÍ: 'irregularity_id'
-        DBIrregularityVote.user_id == current_user.id    
-    ).first()
 
-    if existing_vote:
-        if not existing_vote.is_like:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Ya has dado 'No me gusta' a esta irregularidad."
-            )
-        else: # Si ya dio like, cambia a dislike
-            existing_vote.is_like = False # <-- ¡CAMBIO IMPORTANTE AQUÍ!
-            existing_vote.created_at = func.now()
-            irregularity.likes -= 1    # Reduce el like
-            irregularity.dislikes += 1 # Incrementa el dislike
-            # NOTA: No se actualiza 'ultimo_like_at' al dar dislike.
-            db.add(existing_vote)
-            db.add(irregularity)
-            db.commit() 
-            db.refresh(existing_vote)
-            return existing_vote
-
-    # Si no ha votado, crea un nuevo voto 'dislike'
-    new_vote = DBIrregularityVote(
-        irregularity_id=irregularity_id, # <--- CAMBIO AQUÍ: 'irregularity_id'
-        user_id=current_user.id,         # <--- CAMBIO AQUÍ: 'user_id'
-        is_like=False  
-    )
-    
+def _leer_suscripcion(mensaje: dict) -> Suscripcion:
+    """{"bbox": "min_lon,min_lat,max_lon,max_lat"} o {"latitude", "longitude", "radius_meters"}."""
+    if mensaje.get("bbox") is not None:
+        return Suscripcion(_leer_bbox(str(mensaje["bbox"])))
     try:
-        db.add(new_vote)
-        irregularity.dislikes += 1
-        db.add(irregularity) # Marca la irregularidad para ser actualizada
-        db.commit()
-        db.refresh(new_vote)
-        return new_vote
-    except IntegrityError:
-        db.rollback()
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Ya has votado por esta irregularidad."
-        )
\ No newline at end of file
+        lat, lon, radio = float(mensaje["latitude"]), float(mensaje["longitude"]), float(mensaje["radius_meters"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Se espera bbox o latitude, longitude y radius_meters.")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180 and radio > 0):
+        raise HTTPException(status_code=400, detail="Coordenadas o radio fuera de rango.")
+    return Suscripcion.por_radio(lat, lon, radio)
+
+
+@router.websocket("/ws")
+async def irregularities_websocket(websocket: WebSocket):
+    """
+    Canal de suscripción: el cliente envía su vista (bbox o centro y radio) cada vez que mueve el
+    mapa y recibe {"tipo": "irregularidad", "irregularidad": {...}} por cada irregularidad nueva o
+    actualizada dentro de ella.
+    """
+    await websocket.accept()
+    cliente_id = irregularity_push_service.conectar(websocket)
+    envio = asyncio.create_task(irregularity_push_service.atender(cliente_id))
+    try:
+        while True:
+            mensaje = await websocket.receive_json()
+            try:
+                irregularity_push_service.suscribir(cliente_id, _leer_suscripcion(mensaje if isinstance(mensaje, dict) else {}))
+            except HTTPException as e:
+                await websocket.send_json({"error": e.detail})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Error inesperado en el WebSocket de irregularidades: {e}")
+    finally:
+        envio.cancel()
+        irregularity_push_service.desconectar(cliente_id)
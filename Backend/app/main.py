@@ -1,12 +1,20 @@
 # app/main.py
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+from typing import Optional
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
-from app.database import engine, Base, get_db
+from app.database import engine, Base, get_db, metricas_pool
 # Importa solo las entidades necesarias aquí, como UserTrackingSession y Usuario
-from app.models.entities import UserTrackingSession, UserLocationHistory, Usuario
+from app.models.entities import UserLocationHistory
 from app.models.models import UserLocationUpdateWS
 from app.services.clustering_service import clustering_service # Importa la instancia del servicio
+from app.services.network_snapshot import network_snapshot_service
+from app.services.segment_stats import segment_stats_service
+from app.services.irregularity_votes import deduplicar_votos, vote_counter_buffer
+from app.services.irregularity_expiry import irregularity_expiry_service
+from app.services.tracking_registry import tracking_registry
+from app.auth.dependencies import autenticar_token
 from geoalchemy2.shape import to_shape, from_shape
 from shapely.geometry import Point as ShapelyPoint
 from datetime import datetime
@@ -20,6 +28,8 @@ from app.rutas.route_planning import router as route_planning_router # Asumiendo
 from app.irregularities.routes import router as irregularities_router # Importa el router de irregularidades
 from app.auth import routes as auth_routes
 from app.rutas.paradas import router as paradas_router
+from app.rutas.tiles import router as tiles_router
+from app.rutas.gtfs import router as gtfs_router
 
 
 app = FastAPI(
@@ -34,6 +44,17 @@ app.include_router(tracking_router, prefix="/api/tracking", tags=["Tracking"])
 app.include_router(irregularities_router, prefix="/api/irregularities", tags=["Irregularidades"])
 app.include_router(route_planning_router, prefix="/api/ruta", tags=["Rutas"])
 app.include_router(paradas_router, prefix="/api/paradas", tags=["Paradas"])
+app.include_router(tiles_router, prefix="/api/tiles", tags=["Mapa"])
+app.include_router(gtfs_router, prefix="/api/gtfs", tags=["GTFS"])
+
+
+@app.get("/api/db/metricas", tags=["Monitoreo"], summary="Métricas del pool de conexiones a la base de datos")
+def get_db_pool_metrics():
+    """
+    Devuelve el uso del pool: conexiones en uso, libres, desborde y utilización, más los
+    contadores de conexiones creadas, checkouts e invalidaciones (p. ej. conexiones caídas).
+    """
+    return metricas_pool()
 
 
 # --- EVENTOS DE INICIO/APAGADO PARA CLUSTERING SERVICE (Añadir) ---
@@ -43,8 +64,32 @@ async def startup_event():
     # Asegura que las tablas se creen ANTES de iniciar el servicio
     # Esto puede tomar un momento, pero es sincrónico aquí
     Base.metadata.create_all(bind=engine)
+    # Votos duplicados de antes del índice único (una sola vez, mientras el índice no existe)
+    try:
+        borrados = deduplicar_votos(engine)
+        if borrados:
+            print(f"{borrados} votos duplicados eliminados antes de crear ux_irregularity_votes_usuario.")
+    except Exception as e:
+        print(f"Error eliminando votos duplicados: {e}")
+    # create_all no agrega índices nuevos a tablas que ya existen. Un índice que no se puede crear
+    # se informa y se omite: la aplicación arranca igual
+    for tabla in Base.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            try:
+                indice.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                print(f"No se pudo crear el índice {indice.name}: {e}")
     print("Tablas verificadas/creadas.")
 
+    # Construye el snapshot de la red (y la matriz de rutas, si está habilitada) antes de recibir peticiones
+    db = next(get_db())
+    try:
+        network_snapshot_service.rebuild(db)
+        # Sesiones de seguimiento activas en memoria (WebSocket de ubicación y clustering)
+        print(f"{tracking_registry.cargar(db)} sesiones de seguimiento activas cargadas.")
+    finally:
+        db.close()
+
     # Puedes añadir un pequeño retraso aquí para mayor seguridad,
     # aunque create_all() debería ser sincrónico y bloquear hasta que termine.
     # await asyncio.sleep(1) # Opcional: Descomentar si aún experimentas el problema
@@ -53,19 +98,62 @@ async def startup_event():
     clustering_service.start(get_db) # Pasa la función get_db al servicio
     print("ClusteringService iniciado.")
 
+    # Agregación incremental de tiempos de viaje por segmento (historial de ubicaciones)
+    segment_stats_service.start(get_db)
+
+    # Contadores de votos por lotes (solo si IRREGULARITY_VOTE_BUFFER_SECONDS > 0)
+    vote_counter_buffer.start(get_db)
+
+    # Expiración periódica de irregularidades sin relevancia
+    irregularity_expiry_service.start(get_db)
+
 @app.on_event("shutdown")
 async def shutdown_event():
     print("Aplicación cerrándose. Deteniendo ClusteringService...")
     clustering_service.stop()
+    segment_stats_service.stop()
+    vote_counter_buffer.stop()
+    irregularity_expiry_service.stop()
 
 # --- WEB SOCKET ENDPOINT (Añadir) ---
-@app.websocket("/ws/location/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = Depends(get_db)):
+def _token_websocket(websocket: WebSocket, token: Optional[str]) -> Optional[str]:
+    """Token JWT del parámetro 'token' o del encabezado 'Authorization: Bearer ...'."""
+    if token:
+        return token
+    autorizacion = websocket.headers.get("authorization", "")
+    return autorizacion[7:] if autorizacion.lower().startswith("bearer ") else None
+
+
+@app.websocket("/ws/location")
+@app.websocket("/ws/location/{path_user_id}")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    path_user_id: Optional[int] = None,
+    token: Optional[str] = Query(None),
+    db: Session = Depends(get_db)
+):
     """
     Endpoint WebSocket para que los usuarios envíen actualizaciones de su ubicación en tiempo real.
-    Un usuario solo puede conectar si tiene una UserTrackingSession activa y está marcado como 'is_on_bus'.
+    El usuario se autentica una sola vez con su JWT al conectar (el id de la URL, si se envía,
+    debe coincidir). Solo puede conectar si tiene una sesión de seguimiento activa y está marcado
+    como 'is_on_bus'; la sesión se lee del registro en memoria, sin consultar la base de datos.
     """
-    user_session = db.query(UserTrackingSession).filter_by(user_id=user_id, status='active').first()
+    token = _token_websocket(websocket, token)
+    try:
+        if token is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+        user = await autenticar_token(token, db)
+    except HTTPException:
+        print("Conexión WebSocket de ubicación rechazada: token ausente o inválido.")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    user_id = user.id
+    if path_user_id is not None and path_user_id != user_id:
+        print(f"Usuario {user_id} intentó conectar el WebSocket de ubicación de otro usuario ({path_user_id}).")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    user_session = tracking_registry.get(user_id)
     if not user_session or not user_session.is_on_bus:
         print(f"Usuario {user_id} intentó conectar WebSocket sin sesión activa o no marcado 'is_on_bus'.")
         # Cierra la conexión si no cumple las condiciones
@@ -77,6 +165,11 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
     try:
         while True:
             data = await websocket.receive_json()
+            user_session = tracking_registry.get(user_id)
+            if not user_session or not user_session.is_on_bus:
+                # La sesión terminó (stop-session) o el usuario se bajó del bus
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                break
             try:
                 location_update = UserLocationUpdateWS(**data)
             except Exception as e:
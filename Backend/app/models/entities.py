@@ -1,7 +1,7 @@
 # app/models/entities.py
 
 #Contiene los modelos especificos para uso de SLQAlchemy PostGIS
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, Index
 from sqlalchemy.dialects.postgresql import UUID, ARRAY
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -162,6 +162,20 @@ class ReportedIrregularity(Base):
     # Relación con IrregularityVote
     votes = relationship("IrregularityVote", back_populates="irregularity")
 
+    __table_args__ = (
+        # Paginación por cursor (created_at, id) de las irregularidades activas, más recientes primero.
+        # Ambos índices son parciales sobre 'activa'; el job de expiración mantiene chico ese conjunto.
+        Index(
+            "ix_irregularidades_activas_recientes", created_at.desc(), id.desc(),
+            postgresql_where=activa
+        ),
+        # Filtros espaciales y KNN solo sobre las activas: el índice no crece con el historial expirado
+        Index(
+            "ix_irregularidades_activas_ubicacion", ubicacion,
+            postgresql_using="gist", postgresql_where=activa
+        ),
+    )
+
 class IrregularityVote(Base):
     __tablename__ = "irregularity_votes"
     id = Column(Integer, primary_key=True, index=True)
@@ -176,6 +190,26 @@ class IrregularityVote(Base):
     user = relationship("Usuario", back_populates="votes")
     irregularity = relationship("ReportedIrregularity", back_populates="votes")
 
+    __table_args__ = (
+        # Un voto por usuario e irregularidad; es el destino del ON CONFLICT al votar
+        Index("ux_irregularity_votes_usuario", user_id, irregularity_id, unique=True),
+    )
+
+
+class RefreshToken(Base):
+    """
+    Token de refresco emitido en el login. Solo se guarda su hash; cada uso lo revoca y emite
+    uno nuevo de la misma familia (rotación). Reusar uno ya revocado revoca toda la familia.
+    """
+    __tablename__ = "refresh_tokens"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("usuario.id", ondelete="CASCADE"), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False, unique=True) # sha256 en hexadecimal
+    familia = Column(PG_UUID(as_uuid=True), nullable=False, index=True) # Cadena de rotaciones desde un mismo login
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    revocado = Column(Boolean, default=False, nullable=False)
+
    # --- NUEVAS/ACTUALIZADAS Tablas de Seguimiento (Exclusivamente estas) ---
 
 # --- NUEVAS CLASES DE ENTIDADES PARA EL SEGUIMIENTO (Añadir) ---
@@ -225,4 +259,44 @@ class VirtualBus(Base):
     created_at = Column(DateTime(timezone=True), default=func.now())
 
     # Relación con Ruta
-    ruta = relationship("Ruta", backref="virtual_buses")
\ No newline at end of file
+    ruta = relationship("Ruta", backref="virtual_buses")
+
+# --- Estadísticas históricas de tiempos de viaje por segmento ---
+
+class SegmentTravelTimeStat(Base):
+    """
+    Histograma de tiempos de viaje de un segmento (parada -> siguiente parada de una ruta)
+    para una hora de la semana (0 = lunes 00h ... 167 = domingo 23h), con sus percentiles.
+    """
+    __tablename__ = 'segment_travel_time_stats'
+    ruta_id = Column(Integer, ForeignKey('ruta.id'), primary_key=True)
+    from_parada_id = Column(Integer, ForeignKey('parada.id'), primary_key=True)
+    to_parada_id = Column(Integer, ForeignKey('parada.id'), primary_key=True)
+    hora_semana = Column(Integer, primary_key=True)
+    histograma = Column(ARRAY(Integer), nullable=False) # Conteos por intervalo de tiempo de viaje
+    muestras = Column(Integer, nullable=False, default=0)
+    p50_segundos = Column(Float)
+    p90_segundos = Column(Float)
+    actualizado_en = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+
+class AggregationWatermark(Base):
+    """
+    Último id procesado por cada trabajo de agregación incremental.
+    """
+    __tablename__ = 'aggregation_watermarks'
+    nombre = Column(String(50), primary_key=True)
+    ultimo_id = Column(Integer, nullable=False, default=0)
+    actualizado_en = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+
+class NetworkVersion(Base):
+    """
+    Versión de los datos de la red (paradas, rutas y su orden), en una única fila.
+    Las importaciones masivas la incrementan; cada proceso del API compara este valor con el
+    de su snapshot y lo reconstruye una sola vez cuando cambia.
+    """
+    __tablename__ = 'network_version'
+    id = Column(Integer, primary_key=True, default=1)
+    version = Column(Integer, nullable=False, default=0)
+    actualizado_en = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
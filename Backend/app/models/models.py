@@ -26,6 +26,10 @@ class UserLogin(BaseModel):
     username: str
     password: str    
 
+# Esquema para renovar la sesión (o cerrarla) con el token de refresco
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 # Esquema para la actualización de datos de usuario (sin password aquí)
 class UserUpdate(BaseModel):
     username: str # Puedes hacerlo opcional si solo se actualizan otros campos
@@ -95,6 +99,7 @@ class CalculateRouteRequest(BaseModel):
     origen_lon: float = Field(..., description="Longitud de la ubicación de origen del usuario.")
     destino_lat: float = Field(..., description="Latitud de la ubicación de destino del usuario.")
     destino_lon: float = Field(..., description="Longitud de la ubicación de destino del usuario.")
+    alternativas: int = Field(1, ge=1, le=5, description="Número de itinerarios a retornar (el principal más alternativas).")
 
 # ============================================================================
 # --- Esquemas para las Paradas (usando UbicacionLatLon para la ubicación) ---
@@ -214,12 +219,59 @@ class SimplifiedParadaResponse(BaseModel):
     longitude: float
     latitude: float
 
+class ItinerarioAlternativoResponse(BaseModel):
+    """Itinerario alternativo al principal, entre las mismas paradas de origen y destino."""
+    criterio: str # "menos_transbordos", "menos_caminata" o "alternativo"
+    tiempo_estimado_minutos: float # Tiempo total estimado en minutos (bus + caminata)
+    transbordos: int # Cambios de ruta de bus
+    distancia_caminata_metros: float # Caminata total: hasta/desde las paradas y transbordos a pie
+    paradas_trayecto: List[SimplifiedParadaResponse]
+
 class SimplifiedCalculatedRouteResponse(BaseModel):
     """Modelo de respuesta conciso para el cálculo de ruta."""
     tiempo_estimado_minutos: float # Tiempo total estimado en minutos (bus + caminata)
     distancia_origen_primera_parada_metros: float # Distancia a pie desde el origen del usuario a la primera parada de bus
     distancia_ultima_parada_destino_metros: float # Distancia a pie desde la última parada de bus al destino del usuario
     paradas_trayecto: List[SimplifiedParadaResponse] # Lista de paradas de bus en el segmento de la ruta principal
+    alternativas: Optional[List[ItinerarioAlternativoResponse]] = None # Solo si se pidieron alternativas
+
+# ================================================================
+# ESQUEMAS PARA LA ISÓCRONA (PARADAS ALCANZABLES EN UN TIEMPO DADO)
+# ================================================================
+
+class ParadaAlcanzableResponse(BaseModel):
+    """Parada alcanzable desde el origen dentro del presupuesto de tiempo."""
+    id: int
+    nombre: str
+    latitude: float
+    longitude: float
+    tiempo_minutos: float # Caminata inicial + bus + penalizaciones por transbordo
+
+class IsocronaResponse(BaseModel):
+    """Paradas alcanzables en 'minutos' y, opcionalmente, el polígono que las envuelve."""
+    minutos: float
+    paradas_alcanzables: List[ParadaAlcanzableResponse]
+    poligono: Optional[List[UbicacionLatLon]] = None # Anillo exterior (convexo o cóncavo)
+
+class AccesibilidadRequest(BaseModel):
+    """Rectángulo a cubrir con una grilla regular y presupuesto de tiempo por punto."""
+    min_lat: float = Field(..., ge=-90, le=90)
+    min_lon: float = Field(..., ge=-180, le=180)
+    max_lat: float = Field(..., ge=-90, le=90)
+    max_lon: float = Field(..., ge=-180, le=180)
+    paso_metros: float = Field(500, ge=50, le=10000, description="Separación entre puntos de la grilla.")
+    minutos: float = Field(..., gt=0, le=180, description="Presupuesto de tiempo en minutos.")
+
+class PuntoAccesibilidadResponse(BaseModel):
+    latitude: float
+    longitude: float
+    paradas_alcanzables: int
+    tiempo_medio_minutos: Optional[float] = None # None si no se alcanza ninguna parada
+
+class AccesibilidadResponse(BaseModel):
+    """Accesibilidad de cada punto de la grilla: paradas alcanzables en 'minutos' y tiempo medio hasta ellas."""
+    minutos: float
+    puntos: List[PuntoAccesibilidadResponse]
 
 # ================================================================
 # Esquemas para reporte y respuesta de  irregularidades
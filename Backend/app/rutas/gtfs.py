@@ -0,0 +1,43 @@
+# app/rutas/gtfs.py
+
+from fastapi import APIRouter, Depends, Request, Response, status
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.services.clustering_service import clustering_service
+from app.services.gtfs_feed import ArchivoFeed, gtfs_feed_service
+from app.services.network_snapshot import network_snapshot_service
+from app.services.route_catalog import etags_peticion
+
+router = APIRouter()
+
+
+def _respuesta_feed(request: Request, archivo: ArchivoFeed, media_type: str, headers: dict) -> Response:
+    headers = {"ETag": archivo.etag, **headers}
+    etags = etags_peticion(request)
+    if "*" in etags or archivo.etag in etags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=archivo.cuerpo, media_type=media_type, headers=headers)
+
+
+@router.get("/gtfs.zip", summary="Feed GTFS estático de la red")
+def get_gtfs_estatico(request: Request, db: Session = Depends(get_db)):
+    """
+    Paradas, rutas y un viaje modelo por ruta (con frecuencias) en formato GTFS.
+    Se genera una vez por versión de la red.
+    """
+    archivo = gtfs_feed_service.estatico(network_snapshot_service.get(db))
+    return _respuesta_feed(request, archivo, "application/zip", {
+        "Cache-Control": "no-cache",
+        "Content-Disposition": 'attachment; filename="gtfs.zip"',
+    })
+
+
+@router.get("/realtime/vehicle-positions", summary="Feed GTFS-Realtime de posiciones de los buses")
+def get_vehicle_positions(request: Request):
+    """
+    FeedMessage de GTFS-Realtime (protobuf) con la última posición de cada bus virtual activo.
+    Se serializa una vez por tick del clustering y se sirve igual a todos los consumidores.
+    """
+    archivo = gtfs_feed_service.vehicle_positions(clustering_service.tick, clustering_service.estado_buses)
+    return _respuesta_feed(request, archivo, "application/x-protobuf", {"Cache-Control": "no-cache"})
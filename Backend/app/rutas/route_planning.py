@@ -1,12 +1,18 @@
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional # Asegúrate de que List y Optional estén importados
-from app.database import get_db
+from app.database import get_db, SessionLocal
 # Asegúrate de que las importaciones de entidades y modelos sean correctas para lo que MANTIENES
 from app.models.entities import Ruta, Parada # Solo las entidades que uses en este archivo
 from app.services.route_calculation import calcular_trayecto_usuario
-from app.services import route_info_service # Si lo usas aquí
+from app.services.route_cache import route_result_cache
+from app.services.network_snapshot import network_snapshot_service
+from app.services.route_batch import CalculadorLotes, a_ndjson, bloques_ndjson, en_bloques
+from app.services.isochrone import ACCESIBILIDAD_MAX_PUNTOS, calcular_accesibilidad_lote, calcular_isocrona, puntos_grilla
+from app.services.route_catalog import respuesta_precomprimida, route_catalog_service
 
 from app.models.models import (
     SimplifiedCalculatedRouteResponse,
@@ -14,6 +20,9 @@ from app.models.models import (
     # Asegúrate de importar RutaDetalleResponse, UbicacionResponse, ParadaEnRutaResponse
     # si los necesitas para los endpoints /rutas
     RutaDetalleResponse,
+    IsocronaResponse,
+    AccesibilidadRequest,
+    AccesibilidadResponse,
     # ... otros modelos de respuesta si los tienes para rutas
 )
 
@@ -61,7 +70,8 @@ async def calculate_user_route(request: CalculateRouteRequest, db: Session = Dep
             request.origen_lat,
             request.origen_lon,
             request.destino_lat,
-            request.destino_lon
+            request.destino_lon,
+            request.alternativas
         )
         if suggested_route:
             return suggested_route
@@ -78,25 +88,117 @@ async def calculate_user_route(request: CalculateRouteRequest, db: Session = Dep
         )
 
 
+@router.post(
+    "/calculate_route/batch",
+    summary="Calcular trayectos para muchos pares origen/destino",
+    response_class=StreamingResponse,
+)
+async def calculate_user_routes_batch(
+    request: Request,
+    paralelo: bool = Query(False, description="Reparte las búsquedas en varios procesos.")
+):
+    """
+    Calcula trayectos para una lista de pares origen/destino (mismos campos que /calculate_route).
+    El cuerpo puede ser una lista JSON o un flujo NDJSON (Content-Type: application/x-ndjson).
+    Los resultados se devuelven como NDJSON, una línea por par en el orden de entrada:
+    {"indice": i, "ruta": {...}} o {"indice": i, "error": "..."}.
+    """
+    es_ndjson = "ndjson" in request.headers.get("content-type", "")
+    if not es_ndjson:
+        try:
+            pares = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="El cuerpo debe ser una lista JSON o NDJSON de pares origen/destino.")
+        if not isinstance(pares, list):
+            raise HTTPException(status_code=400, detail="El cuerpo debe ser una lista JSON de pares origen/destino.")
+
+    async def _bloques_lista():
+        for bloque in en_bloques(pares):
+            yield bloque
+
+    async def generar_resultados():
+        # Sesión propia: la respuesta se sigue generando después de que el endpoint retorna
+        db = SessionLocal()
+        try:
+            # get() puede consultar la base de datos o reconstruir el snapshot: fuera del loop de eventos
+            snapshot = await run_in_threadpool(network_snapshot_service.get, db)
+            with CalculadorLotes(snapshot, paralelo) as calculador:
+                bloques = bloques_ndjson(request.stream()) if es_ndjson else _bloques_lista()
+                async for bloque in bloques:
+                    resultados = await run_in_threadpool(calculador.calcular, db, bloque)
+                    for resultado in resultados:
+                        yield a_ndjson(resultado)
+        finally:
+            db.close()
+
+    return StreamingResponse(generar_resultados(), media_type="application/x-ndjson")
+
+
+@router.get("/isocrona", response_model=IsocronaResponse, summary="Paradas alcanzables en un tiempo dado")
+def get_isocrona(
+    lat: float = Query(..., ge=-90, le=90, description="Latitud del origen."),
+    lon: float = Query(..., ge=-180, le=180, description="Longitud del origen."),
+    minutos: float = Query(..., gt=0, le=180, description="Presupuesto de tiempo en minutos."),
+    poligono: Optional[str] = Query(None, pattern="^(convexo|concavo)$", description="Incluye el polígono de alcance: 'convexo' o 'concavo'."),
+    db: Session = Depends(get_db)
+):
+    """
+    Devuelve todas las paradas alcanzables desde el origen dentro de 'minutos',
+    contando la caminata hasta las paradas cercanas y las penalizaciones por transbordo.
+    """
+    return calcular_isocrona(db, lat, lon, minutos, poligono)
+
+
+@router.post("/accesibilidad", response_model=AccesibilidadResponse, summary="Accesibilidad en bus sobre una grilla")
+def post_accesibilidad(request: AccesibilidadRequest, db: Session = Depends(get_db)):
+    """
+    Cubre el rectángulo con una grilla de 'paso_metros' y, para cada punto, cuenta las paradas
+    alcanzables en 'minutos' (caminata + bus) y el tiempo medio hasta ellas. Útil para mapas de calor
+    de cobertura; la grilla admite hasta ACCESIBILIDAD_MAX_PUNTOS puntos.
+    """
+    if request.min_lat > request.max_lat or request.min_lon > request.max_lon:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El rectángulo es inválido: min debe ser menor o igual que max.")
+    try:
+        puntos = puntos_grilla(
+            request.min_lat, request.min_lon, request.max_lat, request.max_lon, request.paso_metros,
+            max_puntos=ACCESIBILIDAD_MAX_PUNTOS
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{e} Aumente 'paso_metros' o reduzca el rectángulo."
+        )
+    return AccesibilidadResponse(minutos=request.minutos, puntos=calcular_accesibilidad_lote(db, puntos, request.minutos))
+
+
+@router.get("/cache/metricas", summary="Métricas de la caché de trayectos calculados")
+def get_route_cache_metrics():
+    """
+    Devuelve el estado de la caché de tramos en bus: entradas, hits, misses, tasa de acierto y desalojos.
+    """
+    return route_result_cache.metricas()
+
+
 # --- NUEVOS ENDPOINTS PARA INFORMACIÓN DE RUTAS ---
 
 @router.get("/rutas", response_model=List[RutaDetalleResponse])
-def get_all_transcaribe_routes(db: Session = Depends(get_db)):
+def get_all_transcaribe_routes(request: Request, db: Session = Depends(get_db)):
     """
     Obtiene una lista de todas las rutas de Transcaribe con sus detalles, incluyendo las paradas.
+    El catálogo se serializa una vez por versión de la red; responde 304 si el ETag coincide.
     """
-    routes = route_info_service.get_all_routes(db)
-    return routes
+    catalogo = route_catalog_service.get(network_snapshot_service.get(db))
+    return respuesta_precomprimida(request, catalogo.catalogo)
 
 @router.get("/rutas/{route_id}", response_model=RutaDetalleResponse)
-def get_transcaribe_route_by_id(route_id: int, db: Session = Depends(get_db)):
+def get_transcaribe_route_by_id(route_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Obtiene los detalles de una ruta específica de Transcaribe por su ID.
     """
-    route = route_info_service.get_route_by_id(db, route_id)
-    if not route:
+    entrada = route_catalog_service.get(network_snapshot_service.get(db)).por_ruta.get(route_id)
+    if not entrada:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Ruta con ID {route_id} no encontrada."
         )
-    return route
\ No newline at end of file
+    return respuesta_precomprimida(request, entrada)
\ No newline at end of file
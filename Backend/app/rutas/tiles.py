@@ -0,0 +1,35 @@
+# app/rutas/tiles.py
+
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.services.clustering_service import clustering_service
+from app.services.network_snapshot import network_snapshot_service
+from app.services.vector_tiles import VECTOR_TILE_DYNAMIC_TTL, tesela_valida, vector_tile_service
+
+router = APIRouter()
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+@router.get("/{z}/{x}/{y}.mvt", summary="Tesela vectorial con paradas, rutas, buses e irregularidades")
+def get_tesela(z: int, x: int, y: int, db: Session = Depends(get_db)):
+    """
+    Tesela Mapbox Vector Tile (esquema XYZ) con las capas 'ruta', 'parada' (desde el zoom
+    VECTOR_TILE_MIN_ZOOM_PARADAS), 'bus' (buses virtuales activos) e 'irregularidad' (activas).
+    El cliente solo descarga lo que está a la vista en lugar de las listas completas.
+    """
+    if not tesela_valida(z, x, y):
+        raise HTTPException(status_code=400, detail="Coordenadas de tesela inválidas.")
+
+    snapshot = network_snapshot_service.get(db)
+    cuerpo = vector_tile_service.tesela(db, snapshot.version, clustering_service.tick, z, x, y)
+    if not cuerpo:
+        return Response(status_code=204)
+    # Caché corta: las capas dinámicas cambian en cada tick del clustering
+    return Response(
+        content=cuerpo,
+        media_type=MVT_MEDIA_TYPE,
+        headers={"Cache-Control": f"public, max-age={int(VECTOR_TILE_DYNAMIC_TTL)}"}
+    )
@@ -1,7 +1,7 @@
 # app/routers/tracking.py
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, defer
 from typing import List, Optional
 from uuid import UUID
 from datetime import datetime
@@ -9,7 +9,8 @@ from datetime import datetime
 from app.database import get_db
 from app.models.entities import UserTrackingSession, VirtualBus, Usuario, Ruta
 from app.models.models import UserTrackingStartRequest, UserTrackingStopRequest, UserSetOnBusRequest, BusLocationResponse
-from geoalchemy2.shape import to_shape # Necesario para convertir la geometría a lat/lon
+from app.services.coordenadas import columnas_lat_lon
+from app.services.tracking_registry import tracking_registry
 
 # Crea una instancia de APIRouter con prefijo y tags
 router = APIRouter()
@@ -33,6 +34,7 @@ async def start_user_tracking_session(request: UserTrackingStartRequest, db: Ses
         db.add(session)
         db.commit()
         db.refresh(session)
+        tracking_registry.registrar(session)
         return {"message": "Sesión de seguimiento actualizada", "session_id": session.id}
 
     # Si no hay sesión activa, crea una nueva
@@ -45,6 +47,7 @@ async def start_user_tracking_session(request: UserTrackingStartRequest, db: Ses
     db.add(new_session)
     db.commit()
     db.refresh(new_session)
+    tracking_registry.registrar(new_session)
     return {"message": "Sesión de seguimiento iniciada", "session_id": new_session.id}
 
 @router.post("/set-on-bus", summary="Usuario indica que está a bordo de un bus")
@@ -67,6 +70,7 @@ async def set_user_on_bus(request: UserSetOnBusRequest, db: Session = Depends(ge
     db.add(session)
     db.commit()
     db.refresh(session)
+    tracking_registry.registrar(session)
     return {"message": f"Usuario {request.user_id} marcado como 'a bordo' de la ruta {request.reported_route_id}"}
 
 @router.post("/stop-session", summary="Detener una sesión de seguimiento de un usuario")
@@ -85,6 +89,7 @@ async def stop_user_tracking_session(request: UserTrackingStopRequest, db: Sessi
     session.assigned_bus_id = None # Desasigna del bus virtual
     db.add(session)
     db.commit()
+    tracking_registry.quitar(request.user_id)
     return {"message": "Sesión de seguimiento detenida"}
 
 @router.get("/active-buses", response_model=List[BusLocationResponse], summary="Obtener la ubicación de todos los buses virtuales activos")
@@ -93,21 +98,22 @@ async def get_active_virtual_buses(route_id: Optional[int] = None, db: Session =
     Recupera la información de todos los buses virtuales actualmente activos en el sistema.
     Opcionalmente filtra por ID de ruta.
     """
-    query = db.query(VirtualBus).filter(VirtualBus.status == 'active')
+    # La latitud y longitud salen de ST_Y/ST_X; la geometría no se carga
+    query = db.query(VirtualBus, *columnas_lat_lon(VirtualBus.ubicacion)) \
+        .options(defer(VirtualBus.ubicacion)) \
+        .filter(VirtualBus.status == 'active')
     if route_id:
         query = query.filter(VirtualBus.route_id == route_id)
 
     virtual_buses = query.all()
 
     response_buses = []
-    for bus in virtual_buses:
-        # Convertir la geometría de la DB a latitud y longitud para la respuesta Pydantic
-        point = to_shape(bus.ubicacion)
+    for bus, latitude, longitude in virtual_buses:
         response_buses.append(BusLocationResponse(
             id=bus.id,
             route_id=bus.route_id,
-            latitude=point.y, # Latitud
-            longitude=point.x, # Longitud
+            latitude=latitude, # Latitud
+            longitude=longitude, # Longitud
             current_speed=bus.current_speed,
             current_heading=bus.current_heading,
             assigned_user_ids=bus.assigned_user_ids,
@@ -121,16 +127,18 @@ async def get_virtual_bus_status(bus_id: UUID, db: Session = Depends(get_db)):
     """
     Obtiene el estado detallado de un bus virtual específico por su ID.
     """
-    virtual_bus = db.query(VirtualBus).filter_by(id=bus_id).first()
-    if not virtual_bus:
+    fila = db.query(VirtualBus, *columnas_lat_lon(VirtualBus.ubicacion)) \
+        .options(defer(VirtualBus.ubicacion)) \
+        .filter(VirtualBus.id == bus_id).first()
+    if not fila:
         raise HTTPException(status_code=404, detail="Bus virtual no encontrado")
 
-    point = to_shape(virtual_bus.ubicacion)
+    virtual_bus, latitude, longitude = fila
     return BusLocationResponse(
         id=virtual_bus.id,
         route_id=virtual_bus.route_id,
-        latitude=point.y,
-        longitude=point.x,
+        latitude=latitude,
+        longitude=longitude,
         current_speed=virtual_bus.current_speed,
         current_heading=virtual_bus.current_heading,
         assigned_user_ids=virtual_bus.assigned_user_ids,
@@ -0,0 +1,69 @@
+# app/rutas_lote.py
+"""
+Cálculo de trayectos en lote desde la línea de comandos (estudios de cobertura, matrices OD).
+
+Uso:
+    python -m app.rutas_lote pares.csv > resultados.ndjson
+    python -m app.rutas_lote pares.ndjson --paralelo > resultados.ndjson
+    cat pares.ndjson | python -m app.rutas_lote - > resultados.ndjson
+
+El CSV debe tener las columnas origen_lat, origen_lon, destino_lat, destino_lon.
+El NDJSON lleva un objeto JSON con esos mismos campos por línea.
+"""
+import argparse
+import csv
+import json
+import sys
+from typing import Any, Dict, Iterator, TextIO
+
+from app.database import SessionLocal
+from app.services.network_snapshot import network_snapshot_service
+from app.services.route_batch import CalculadorLotes, a_ndjson, en_bloques
+
+
+def _leer_csv(archivo: TextIO) -> Iterator[Dict[str, Any]]:
+    for fila in csv.DictReader(archivo):
+        yield fila
+
+
+def _leer_ndjson(archivo: TextIO) -> Iterator[Any]:
+    for linea in archivo:
+        if not linea.strip():
+            continue
+        try:
+            yield json.loads(linea)
+        except ValueError:
+            yield None # Se reporta como par inválido en la salida
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calcula trayectos para muchos pares origen/destino y escribe NDJSON.")
+    parser.add_argument("entrada", help="Archivo .csv o .ndjson con los pares ('-' para leer NDJSON de stdin).")
+    parser.add_argument("--paralelo", action="store_true", help="Reparte las búsquedas en varios procesos.")
+    args = parser.parse_args()
+
+    if args.entrada == "-":
+        archivo = sys.stdin
+    else:
+        archivo = open(args.entrada, encoding="utf-8", newline="")
+
+    pares = _leer_csv(archivo) if args.entrada.endswith(".csv") else _leer_ndjson(archivo)
+
+    db = SessionLocal()
+    try:
+        snapshot = network_snapshot_service.get(db)
+        total = 0
+        with CalculadorLotes(snapshot, args.paralelo) as calculador:
+            for bloque in en_bloques(pares):
+                for resultado in calculador.calcular(db, bloque):
+                    sys.stdout.write(a_ndjson(resultado))
+                total += len(bloque)
+                print(f"{total} pares procesados...", file=sys.stderr)
+    finally:
+        db.close()
+        if archivo is not sys.stdin:
+            archivo.close()
+
+
+if __name__ == "__main__":
+    main()
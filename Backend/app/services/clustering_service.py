@@ -13,6 +13,9 @@ from geoalchemy2.shape import from_shape, to_shape
 from geoalchemy2.elements import WKBElement
 
 from app.database import get_db # Importa get_db
+from app.services.network_snapshot import network_snapshot_service
+from app.services.traffic_costs import ROUTING_COSTS, traffic_cost_service
+from app.services.tracking_registry import SesionSeguimiento, tracking_registry
 from app.models.entities import UserTrackingSession, VirtualBus, Ruta, UserLocationHistory, Parada, RutaParada
 import collections
 import numpy as np
@@ -29,6 +32,13 @@ class ClusteringService:
         self.processing_task: Optional[asyncio.Task] = None
         self.db_provider: Optional[Callable[[], Session]] = None
 
+        # Estado en memoria de los buses en el tick actual, para los costos por tráfico
+        self.tick = 0
+        self.posiciones_buses: Dict[uuid.UUID, tuple] = {} # bus_id -> (ruta_id, lat, lon, instante)
+        # Última posición conocida de cada bus activo (se conserva entre ticks; la usa el feed GTFS-Realtime).
+        # 'tick' cambia cada vez que este estado cambia.
+        self.estado_buses: Dict[uuid.UUID, tuple] = {} # bus_id -> (ruta_id, lat, lon, instante)
+
         # Configuración del clustering (ajustar según necesidades)
         self.MAX_DISTANCE_TO_ROUTE = 50  # Metros: Distancia máxima de un usuario a una ruta para ser considerado "en ruta"
         self.MAX_BUS_IDLE_TIME = timedelta(minutes=5) # Tiempo para desactivar un bus virtual si no hay actualizaciones
@@ -91,6 +101,16 @@ class ClusteringService:
             for user_id, user_data in user_latest_updates.items():
                 self._perform_clustering(db, user_data, routes_map)
 
+            # Actualizar los costos por tráfico con el movimiento de los buses en este tick
+            # (solo si el ruteo los usa: con otros ROUTING_COSTS nadie lee el resultado)
+            self.tick += 1
+            if self.posiciones_buses and ROUTING_COSTS == "trafico":
+                snapshot = network_snapshot_service.get(db)
+                aristas = traffic_cost_service.registrar_tick(snapshot, self.posiciones_buses)
+                if aristas:
+                    print(f"Tick {self.tick}: costos por tráfico actualizados en {aristas} segmentos.")
+            self.posiciones_buses = {}
+
             # Limpiar buses inactivos periódicamente
             await self._clean_inactive_buses()
 
@@ -107,14 +127,10 @@ class ClusteringService:
         user_id = user_data["user_id"]
         location_data = user_data["location"]
         
-        # Obtener la sesión de seguimiento del usuario
-        user_session = db.query(UserTrackingSession).filter(
-            UserTrackingSession.user_id == user_id,
-            UserTrackingSession.status == 'active',
-            UserTrackingSession.is_on_bus == True
-        ).first()
-
-        if not user_session:
+        # Obtener la sesión de seguimiento del usuario (del registro en memoria, sin consultar la DB)
+        user_session = tracking_registry.get(user_id)
+
+        if not user_session or not user_session.is_on_bus:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Clustering: Usuario {user_id} sin sesión activa con is_on_bus=True. Saltando clustering.")
             return
 
@@ -194,17 +210,16 @@ class ClusteringService:
                     assigned_bus.ubicacion = WKBElement(shapely.wkb.dumps(user_location_point, hex=False), srid=4326)
                     assigned_bus.last_update = datetime.utcnow()
                     db.add(assigned_bus)
-                    db.commit() # ¡Commit individual para esta actualización si sales aquí!
+                    self._confirmar(db) # ¡Commit individual para esta actualización si sales aquí!
+                    self._registrar_posicion_bus(assigned_bus.id, route_id, location_data)
                     return # Si el usuario ya está asignado y se actualizó, podemos salir.
                 else:
                     print(f"[{datetime.now().strftime('%H:%M:%S')}] Clustering: Usuario {user_id} demasiado lejos de su bus asignado {assigned_bus.id} ({distance:.2f}m). Buscando nuevo bus o creando uno.")
-                    user_session.assigned_bus_id = None # Desasignar temporalmente para buscar un nuevo bus
-                    db.add(user_session) # Guardar el cambio de desasignación
+                    self._asignar_bus_sesion(db, user_session, None) # Desasignar temporalmente para buscar un nuevo bus
                     # Continuar para buscar/crear un nuevo bus
             else:
                 print(f"[{datetime.now().strftime('%H:%M:%S')}] Clustering: Bus asignado {user_session.assigned_bus_id} para usuario {user_id} no encontrado/activo. Buscando nuevo bus o creando uno.")
-                user_session.assigned_bus_id = None # Limpiar el ID si el bus ya no existe/activo
-                db.add(user_session)
+                self._asignar_bus_sesion(db, user_session, None) # Limpiar el ID si el bus ya no existe/activo
 
 
         # 2. Si no se mantuvo la asignación, buscar el bus activo más cercano o crear uno nuevo
@@ -234,11 +249,12 @@ class ClusteringService:
             assigned_bus.ubicacion = WKBElement(shapely.wkb.dumps(user_location_point, hex=False), srid=4326)
             assigned_bus.last_update = datetime.utcnow()
             db.add(assigned_bus)
+            bus_id = assigned_bus.id
+            self._al_confirmar(db, lambda: self._registrar_posicion_bus(bus_id, route_id, location_data))
 
             # Actualiza la sesión del usuario con el bus asignado si es necesario
             if user_session.assigned_bus_id != assigned_bus.id: # Solo si cambió o estaba nulo
-                user_session.assigned_bus_id = assigned_bus.id
-                db.add(user_session)
+                self._asignar_bus_sesion(db, user_session, assigned_bus.id)
                 print(f"[{datetime.now().strftime('%H:%M:%S')}] Clustering: Actualizando UserTrackingSession de {user_id} con assigned_bus_id: {assigned_bus.id}")
 
         else:
@@ -252,14 +268,15 @@ class ClusteringService:
             )
             db.add(new_bus)
             db.flush() # Para que new_bus.id se genere antes del commit
+            new_bus_id = new_bus.id
+            self._al_confirmar(db, lambda: self._registrar_posicion_bus(new_bus_id, route_id, location_data))
             print(f"[{datetime.now().strftime('%H:%M:%S')}] *** Clustering: NUEVO bus virtual {new_bus.id} CREADO en ruta {route_id} por usuario {user_id}.***")
 
             # Actualizar la sesión del usuario con el bus recién creado
-            user_session.assigned_bus_id = new_bus.id
-            db.add(user_session)
+            self._asignar_bus_sesion(db, user_session, new_bus.id)
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Clustering: Actualizando UserTrackingSession de {user_id} con assigned_bus_id: {new_bus.id}")
 
-        db.commit() # Confirmar todos los cambios en esta transacción
+        self._confirmar(db) # Confirmar todos los cambios en esta transacción (y luego los de memoria)
         
         # Recargar buses activos para el mensaje final (o contar los que ya tenemos)
         final_active_buses_count = len(db.query(VirtualBus).filter_by(status='active', route_id=route_id).all())
@@ -268,6 +285,28 @@ class ClusteringService:
 
 
 
+    def _al_confirmar(self, db: Session, accion: Callable[[], None]):
+        # Cambios en memoria (registro de sesiones, estado de buses) que dependen de lo escrito en 'db':
+        # se aplican en _confirmar, solo si el commit tuvo éxito
+        db.info.setdefault("al_confirmar", []).append(accion)
+
+    def _confirmar(self, db: Session):
+        pendientes = db.info.pop("al_confirmar", [])
+        db.commit()
+        for accion in pendientes:
+            accion()
+
+    def _asignar_bus_sesion(self, db: Session, user_session: SesionSeguimiento, bus_id: Optional[uuid.UUID]):
+        # UPDATE directo por id: la sesión no se carga desde la DB; el registro se actualiza tras el commit
+        db.query(UserTrackingSession).filter(UserTrackingSession.id == user_session.session_id) \
+            .update({UserTrackingSession.assigned_bus_id: bus_id}, synchronize_session=False)
+        self._al_confirmar(db, lambda: tracking_registry.asignar_bus(user_session.user_id, bus_id))
+
+    def _registrar_posicion_bus(self, bus_id: uuid.UUID, route_id: int, location_data: Dict):
+        # Se guarda la última posición del bus en el tick; varios usuarios del mismo bus la sobrescriben
+        self.posiciones_buses[bus_id] = (route_id, location_data["lat"], location_data["lon"], time.time())
+        self.estado_buses[bus_id] = self.posiciones_buses[bus_id]
+
     async def _clean_inactive_buses(self):
         db: Session = next(self.db_provider()) # Obtener la sesión del generador
         try:
@@ -277,37 +316,42 @@ class ClusteringService:
                 VirtualBus.last_update < inactive_threshold
             ).all()
 
+            desactivados = []
             for bus in buses_to_deactivate:
-                # Comprobar si hay sesiones de usuario activas asignadas a este bus
-                active_assigned_sessions = db.query(UserTrackingSession).filter(
-                    UserTrackingSession.assigned_bus_id == bus.id,
-                    UserTrackingSession.status == 'active',
-                    UserTrackingSession.is_on_bus == True
-                ).first() # Solo necesitamos verificar si existe al menos una
-
-                if not active_assigned_sessions: # Si no hay sesiones activas asignadas, desactivar el bus
+                # Comprobar si hay sesiones de usuario activas asignadas a este bus (registro en memoria)
+                if not tracking_registry.tiene_pasajeros(bus.id): # Si no hay sesiones activas asignadas, desactivar el bus
                     bus.status = 'inactive'
                     db.add(bus)
-                    print(f"Bus virtual {bus.id} desactivado por inactividad y sin usuarios activos.")
+                    desactivados.append(bus.id)
                 # else: El bus tiene usuarios activos asignados, no lo desactives solo por last_update
 
             # Además, limpia las asignaciones de bus en UserTrackingSession si el bus se ha inactivo
             # Esto es redundante si la lógica anterior maneja bien la desactivación,
             # pero asegura consistencia si un bus se desactiva por otros medios.
-            sessions_with_inactive_bus = db.query(UserTrackingSession).join(VirtualBus).filter(
-                UserTrackingSession.status == 'active',
-                UserTrackingSession.is_on_bus == True,
-                VirtualBus.status == 'inactive'
-            ).all()
-            for session in sessions_with_inactive_bus:
-                session.assigned_bus_id = None
-                session.is_on_bus = False # Ya no está en un bus
-                db.add(session)
-                print(f"Sesión de usuario {session.user_id} desasignada del bus inactivo {session.assigned_bus_id}.")
-
+            a_bordo = [s for s in tracking_registry.a_bordo() if s.assigned_bus_id is not None]
+            buses_inactivos = {
+                bus_id for (bus_id,) in db.query(VirtualBus.id).filter(
+                    VirtualBus.id.in_({s.assigned_bus_id for s in a_bordo}),
+                    VirtualBus.status == 'inactive'
+                )
+            } if a_bordo else set()
+            sessions_with_inactive_bus = [s for s in a_bordo if s.assigned_bus_id in buses_inactivos]
+            if sessions_with_inactive_bus:
+                db.query(UserTrackingSession).filter(
+                    UserTrackingSession.id.in_([s.session_id for s in sessions_with_inactive_bus])
+                ).update({UserTrackingSession.assigned_bus_id: None, UserTrackingSession.is_on_bus: False}, synchronize_session=False)
 
             db.commit()
 
+            # La memoria (estado de buses y registro de sesiones) solo cambia si el commit tuvo éxito
+            for bus_id in desactivados:
+                if self.estado_buses.pop(bus_id, None) is not None:
+                    self.tick += 1
+                print(f"Bus virtual {bus_id} desactivado por inactividad y sin usuarios activos.")
+            for session in sessions_with_inactive_bus:
+                print(f"Sesión de usuario {session.user_id} desasignada del bus inactivo {session.assigned_bus_id}.")
+                tracking_registry.bajar_del_bus(session.user_id) # Ya no está en un bus
+
         finally:
             db.close() # Asegurarse de cerrar la sesión
 
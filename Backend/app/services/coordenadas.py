@@ -0,0 +1,36 @@
+# app/services/coordenadas.py
+
+import math
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func
+
+
+RADIO_TIERRA_METROS = 6371008.8
+
+
+def columnas_lat_lon(geometria, prefijo: str = "") -> Tuple:
+    """
+    Columnas (latitude, longitude) calculadas por PostGIS con ST_Y/ST_X.
+    Se agregan a la consulta en lugar de traer la geometría y decodificar el WKB en Python.
+    """
+    return (
+        func.ST_Y(geometria).label(f"{prefijo}latitude"),
+        func.ST_X(geometria).label(f"{prefijo}longitude"),
+    )
+
+
+def ubicacion_dict(latitude: Optional[float], longitude: Optional[float]) -> Optional[Dict[str, float]]:
+    """Ubicación en el formato {"latitude", "longitude"} de las respuestas (None si falta)."""
+    if latitude is None or longitude is None:
+        return None
+    return {"latitude": latitude, "longitude": longitude}
+
+
+def distancia_metros(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia haversine en metros (la misma escala que ST_DWithin sobre geography)."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * RADIO_TIERRA_METROS * math.asin(math.sqrt(a))
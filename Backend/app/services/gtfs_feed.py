@@ -0,0 +1,203 @@
+# app/services/gtfs_feed.py
+
+import csv
+import hashlib
+import io
+import os
+import struct
+import threading
+import time
+import uuid
+import zipfile
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services.network_snapshot import NetworkSnapshot
+
+
+# Datos de la agencia para agency.txt
+GTFS_AGENCY_NAME = os.getenv("GTFS_AGENCY_NAME", "Transcaribe")
+GTFS_AGENCY_URL = os.getenv("GTFS_AGENCY_URL", "https://www.transcaribe.gov.co")
+GTFS_TIMEZONE = os.getenv("GTFS_TIMEZONE", "America/Bogota")
+
+# Servicio publicado: un viaje modelo por ruta repetido con frecuencia fija (frequencies.txt)
+GTFS_SERVICE_START = os.getenv("GTFS_SERVICE_START", "05:00:00")
+GTFS_SERVICE_END = os.getenv("GTFS_SERVICE_END", "22:00:00")
+GTFS_HEADWAY_SECONDS = int(os.getenv("GTFS_HEADWAY_SECONDS", "600"))
+GTFS_SERVICE_ID = "diario"
+
+
+def _segundos(hora: str) -> int:
+    h, m, s = (int(parte) for parte in hora.split(":"))
+    return h * 3600 + m * 60 + s
+
+
+def _hora(segundos: float) -> str:
+    # GTFS admite horas >= 24 para viajes que pasan la medianoche
+    segundos = int(round(segundos))
+    return f"{segundos // 3600:02d}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+
+
+def trip_id(ruta_id: int) -> str:
+    """Viaje modelo de la ruta; lo comparten el feed estático y el de tiempo real."""
+    return f"ruta-{ruta_id}"
+
+
+def _csv(filas: Iterable[Iterable]) -> bytes:
+    salida = io.StringIO()
+    escritor = csv.writer(salida, lineterminator="\n")
+    escritor.writerows(filas)
+    return salida.getvalue().encode("utf-8")
+
+
+def _costo_segmento(snapshot: NetworkSnapshot, desde: int, hasta: int, ruta_id: int) -> Optional[float]:
+    for edge in snapshot.graph.get(desde, []):
+        if edge["neighbor"] == hasta and edge["ruta_id"] == ruta_id:
+            return edge["cost"]
+    return None
+
+
+def construir_gtfs(snapshot: NetworkSnapshot) -> bytes:
+    """
+    Feed GTFS estático de la versión de la red: paradas, rutas y, por ruta, un viaje modelo
+    cuyos tiempos entre paradas son los costos estáticos del grafo de ruteo.
+    """
+    inicio = _segundos(GTFS_SERVICE_START)
+    archivos: Dict[str, List[Tuple]] = {
+        "agency.txt": [("agency_id", "agency_name", "agency_url", "agency_timezone", "agency_lang")],
+        "stops.txt": [("stop_id", "stop_name", "stop_lat", "stop_lon")],
+        "routes.txt": [("route_id", "agency_id", "route_short_name", "route_long_name", "route_type")],
+        "trips.txt": [("route_id", "service_id", "trip_id")],
+        "stop_times.txt": [("trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence")],
+        "calendar.txt": [("service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "start_date", "end_date")],
+        "frequencies.txt": [("trip_id", "start_time", "end_time", "headway_secs", "exact_times")],
+    }
+    archivos["agency.txt"].append(("transcaribe", GTFS_AGENCY_NAME, GTFS_AGENCY_URL, GTFS_TIMEZONE, "es"))
+    # Vigencia de un año desde la versión de la red; cada versión nueva renueva el feed
+    desde, hasta = snapshot.creado_en.date(), snapshot.creado_en.date() + timedelta(days=365)
+    archivos["calendar.txt"].append((GTFS_SERVICE_ID, 1, 1, 1, 1, 1, 1, 1, desde.strftime("%Y%m%d"), hasta.strftime("%Y%m%d")))
+
+    for parada_id, parada in sorted(snapshot.paradas.items()):
+        if parada.get("latitude") is not None:
+            archivos["stops.txt"].append((parada_id, parada["nombre"], f"{parada['latitude']:.7f}", f"{parada['longitude']:.7f}"))
+
+    for ruta in snapshot.catalogo_rutas:
+        paradas = [p["id"] for p in ruta["paradas"] if p.get("ubicacion") is not None]
+        if len(paradas) < 2:
+            continue # Un viaje GTFS necesita al menos dos paradas
+        viaje = trip_id(ruta["id"])
+        # route_type 3 = bus
+        archivos["routes.txt"].append((ruta["id"], "transcaribe", ruta["nombre"], "", 3))
+        archivos["trips.txt"].append((ruta["id"], GTFS_SERVICE_ID, viaje))
+        archivos["frequencies.txt"].append((viaje, GTFS_SERVICE_START, GTFS_SERVICE_END, GTFS_HEADWAY_SECONDS, 0))
+
+        transcurrido = 0.0
+        for secuencia, parada_id in enumerate(paradas, start=1):
+            if secuencia > 1:
+                costo = _costo_segmento(snapshot, paradas[secuencia - 2], parada_id, ruta["id"])
+                transcurrido += costo if costo is not None else 0
+            hora = _hora(inicio + transcurrido)
+            archivos["stop_times.txt"].append((viaje, hora, hora, parada_id, secuencia))
+
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, "w", compression=zipfile.ZIP_DEFLATED) as feed:
+        for nombre, filas in archivos.items():
+            # Fecha fija en las entradas: el mismo contenido produce los mismos bytes (y el mismo ETag)
+            info = zipfile.ZipInfo(nombre, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            feed.writestr(info, _csv(filas))
+    return salida.getvalue()
+
+
+# --- Codificación protobuf de GTFS-Realtime (gtfs-realtime.proto), sin dependencias ---
+
+def _varint(valor: int) -> bytes:
+    salida = bytearray()
+    while True:
+        byte = valor & 0x7F
+        valor >>= 7
+        if valor:
+            salida.append(byte | 0x80)
+        else:
+            salida.append(byte)
+            return bytes(salida)
+
+
+def _campo_varint(numero: int, valor: int) -> bytes:
+    return _varint(numero << 3) + _varint(valor)
+
+
+def _campo_float(numero: int, valor: float) -> bytes:
+    return _varint(numero << 3 | 5) + struct.pack("<f", valor)
+
+
+def _campo_bytes(numero: int, valor: bytes) -> bytes:
+    return _varint(numero << 3 | 2) + _varint(len(valor)) + valor
+
+
+def _campo_texto(numero: int, valor: str) -> bytes:
+    return _campo_bytes(numero, valor.encode("utf-8"))
+
+
+def codificar_vehicle_positions(buses: Dict[uuid.UUID, tuple], instante: int) -> bytes:
+    """
+    FeedMessage (FULL_DATASET) con un VehiclePosition por bus virtual:
+    trip (TripDescriptor trip_id/route_id), position (lat/lon), vehicle (id) y timestamp.
+    """
+    # FeedHeader: gtfs_realtime_version = 1, incrementality = 2 (FULL_DATASET = 0), timestamp = 3
+    mensaje = bytearray(_campo_bytes(1, _campo_texto(1, "2.0") + _campo_varint(2, 0) + _campo_varint(3, instante)))
+    for bus_id, (ruta_id, lat, lon, visto_en) in buses.items():
+        viaje = _campo_texto(1, trip_id(ruta_id)) + _campo_texto(5, str(ruta_id))
+        posicion = _campo_float(1, lat) + _campo_float(2, lon)
+        vehiculo = (
+            _campo_bytes(1, viaje) # trip
+            + _campo_bytes(2, posicion) # position
+            + _campo_varint(5, int(visto_en)) # timestamp
+            + _campo_bytes(8, _campo_texto(1, str(bus_id))) # vehicle.id
+        )
+        # FeedEntity: id = 1, vehicle = 4
+        mensaje += _campo_bytes(2, _campo_texto(1, str(bus_id)) + _campo_bytes(4, vehiculo))
+    return bytes(mensaje)
+
+
+class ArchivoFeed:
+    def __init__(self, clave, cuerpo: bytes):
+        self.clave = clave
+        self.cuerpo = cuerpo
+        self.etag = f'"{hashlib.sha256(cuerpo).hexdigest()[:32]}"'
+
+
+class GtfsFeedService:
+    """
+    Feeds GTFS ya serializados: el estático se arma una vez por versión de la red y el de
+    posiciones una vez por tick del clustering, así muchos consumidores cuestan una sola
+    serialización.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._estatico: Optional[ArchivoFeed] = None
+        self._posiciones: Optional[ArchivoFeed] = None
+
+    def estatico(self, snapshot: NetworkSnapshot) -> ArchivoFeed:
+        archivo = self._estatico
+        if archivo is not None and archivo.clave == snapshot.version:
+            return archivo
+        with self._lock:
+            if self._estatico is None or self._estatico.clave != snapshot.version:
+                self._estatico = ArchivoFeed(snapshot.version, construir_gtfs(snapshot))
+                print(f"Feed GTFS de la red v{snapshot.version} generado: {len(self._estatico.cuerpo)} bytes.")
+            return self._estatico
+
+    def vehicle_positions(self, tick: int, buses: Dict[uuid.UUID, tuple]) -> ArchivoFeed:
+        archivo = self._posiciones
+        if archivo is not None and archivo.clave == tick:
+            return archivo
+        with self._lock:
+            if self._posiciones is None or self._posiciones.clave != tick:
+                # Copia: el clustering puede modificar el diccionario mientras se codifica
+                self._posiciones = ArchivoFeed(tick, codificar_vehicle_positions(dict(buses), int(time.time())))
+            return self._posiciones
+
+
+# Instancia global del servicio
+gtfs_feed_service = GtfsFeedService()
@@ -0,0 +1,122 @@
+# app/services/irregularity_dedup.py
+
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.entities import ReportedIrregularity
+from app.services.coordenadas import columnas_lat_lon, distancia_metros
+
+
+IRREGULARITY_DEDUP_RADIUS_METERS = float(os.getenv("IRREGULARITY_DEDUP_RADIUS_METERS", "100"))
+IRREGULARITY_DEDUP_WINDOW_MINUTES = float(os.getenv("IRREGULARITY_DEDUP_WINDOW_MINUTES", "30"))
+
+# Reporte reciente en el índice: (irregularity_id, lat, lon, created_at, título normalizado)
+ReporteReciente = Tuple[int, float, float, datetime, str]
+
+
+def normalizar_titulo(titulo: str) -> str:
+    """Minúsculas, sin tildes ni signos y con los espacios colapsados: 'Bache  en la vía!' == 'bache en la via'."""
+    sin_tildes = unicodedata.normalize("NFKD", titulo or "").encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", sin_tildes.lower()).split())
+
+
+class IrregularityDedupIndex:
+    """
+    Índice en memoria (grilla de celdas del tamaño del radio) de las irregularidades activas
+    reportadas dentro de la ventana de tiempo. Al llegar un reporte nuevo se buscan coincidencias
+    solo en las celdas vecinas, sin consultar la base de datos. Solo se unen reportes con el mismo
+    título normalizado: dos problemas distintos en la misma esquina siguen siendo dos reportes.
+    """
+    def __init__(self, radio_metros: float = IRREGULARITY_DEDUP_RADIUS_METERS, ventana_minutos: float = IRREGULARITY_DEDUP_WINDOW_MINUTES):
+        self.radio_metros = radio_metros
+        self.ventana = timedelta(minutes=ventana_minutos)
+        self._grados_celda = radio_metros / 111320
+        self._celdas: Dict[Tuple[int, int], List[ReporteReciente]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._cargado = False
+
+    @property
+    def activo(self) -> bool:
+        return self.radio_metros > 0 and self.ventana > timedelta(0)
+
+    def _celda(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self._grados_celda), math.floor(lon / self._grados_celda)
+
+    def _cargar(self, db: Session, ahora: datetime):
+        """Al primer uso se cargan los reportes activos de la ventana (p. ej. tras un reinicio)."""
+        filas = db.query(
+            ReportedIrregularity.id, ReportedIrregularity.titulo, ReportedIrregularity.created_at,
+            *columnas_lat_lon(ReportedIrregularity.ubicacion)
+        ) \
+            .filter(ReportedIrregularity.activa == True, ReportedIrregularity.created_at >= ahora - self.ventana) \
+            .all()
+        for fila in filas:
+            self._celdas[self._celda(fila.latitude, fila.longitude)].append(
+                (fila.id, fila.latitude, fila.longitude, fila.created_at, normalizar_titulo(fila.titulo))
+            )
+        self._cargado = True
+
+    def _purgar(self, ahora: datetime):
+        limite = ahora - self.ventana
+        for celda in list(self._celdas):
+            vigentes = [r for r in self._celdas[celda] if r[3] >= limite]
+            if vigentes:
+                self._celdas[celda] = vigentes
+            else:
+                del self._celdas[celda]
+
+    def buscar(self, db: Session, lat: float, lon: float, titulo: str) -> Optional[int]:
+        """Id de la irregularidad reciente más cercana dentro del radio con el mismo título normalizado, o None."""
+        if not self.activo:
+            return None
+        ahora = datetime.now(timezone.utc)
+        with self._lock:
+            if not self._cargado:
+                self._cargar(db, ahora)
+            self._purgar(ahora)
+
+            clave_titulo = normalizar_titulo(titulo)
+            fila, columna = self._celda(lat, lon)
+            # En longitud una celda mide menos metros que el radio: se revisan más columnas
+            columnas = math.ceil(1 / max(math.cos(math.radians(lat)), 0.01))
+            mejor: Optional[Tuple[float, int]] = None
+            for df in (-1, 0, 1):
+                for dc in range(-columnas, columnas + 1):
+                    for irregularity_id, r_lat, r_lon, _, r_titulo in self._celdas.get((fila + df, columna + dc), ()):
+                        if r_titulo != clave_titulo:
+                            continue
+                        distancia = distancia_metros(lat, lon, r_lat, r_lon)
+                        if distancia <= self.radio_metros and (mejor is None or distancia < mejor[0]):
+                            mejor = (distancia, irregularity_id)
+            return mejor[1] if mejor else None
+
+    def agregar(self, irregularity_id: int, lat: float, lon: float, titulo: str, created_at: Optional[datetime] = None):
+        if not self.activo:
+            return
+        with self._lock:
+            self._celdas[self._celda(lat, lon)].append(
+                (irregularity_id, lat, lon, created_at or datetime.now(timezone.utc), normalizar_titulo(titulo))
+            )
+
+    def quitar(self, irregularity_id: int):
+        """Saca una irregularidad que ya no está activa (expirada antes de salir de la ventana)."""
+        with self._lock:
+            for celda, reportes in list(self._celdas.items()):
+                restantes = [r for r in reportes if r[0] != irregularity_id]
+                if len(restantes) != len(reportes):
+                    if restantes:
+                        self._celdas[celda] = restantes
+                    else:
+                        del self._celdas[celda]
+
+
+# Instancia global del índice
+irregularity_dedup_index = IrregularityDedupIndex()
@@ -0,0 +1,141 @@
+# app/services/irregularity_expiry.py
+
+import asyncio
+import json
+import os
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.services.irregularity_penalties import irregularity_penalty_service
+from app.services.irregularity_push import irregularity_push_service
+from app.services.network_snapshot import network_snapshot_service
+
+
+IRREGULARITY_HALF_LIFE_HOURS = float(os.getenv("IRREGULARITY_HALF_LIFE_HOURS", "6")) # La relevancia se reduce a la mitad
+IRREGULARITY_MIN_SCORE = float(os.getenv("IRREGULARITY_MIN_SCORE", "0.1")) # Por debajo, el reporte expira
+IRREGULARITY_MAX_AGE_HOURS = float(os.getenv("IRREGULARITY_MAX_AGE_HOURS", "72")) # Expira aunque siga recibiendo likes
+IRREGULARITY_EXPIRY_INTERVAL_SECONDS = float(os.getenv("IRREGULARITY_EXPIRY_INTERVAL_SECONDS", "300"))
+IRREGULARITY_EXPIRY_BATCH = int(os.getenv("IRREGULARITY_EXPIRY_BATCH", "1000"))
+
+# Relevancia con decaimiento exponencial desde la última actividad (reporte o último like),
+# ponderada por los votos: (1 + likes) / (1 + dislikes). Un reporte nuevo sin votos vale 1.
+SQL_RELEVANCIA = """
+    (1.0 + COALESCE(likes, 0)) / (1.0 + COALESCE(dislikes, 0))
+    * exp(
+        -ln(2) * EXTRACT(EPOCH FROM now() - GREATEST(created_at, COALESCE(ultimo_like_at, created_at)))
+        / (3600.0 * :vida_media_horas)
+    )
+"""
+
+# Expira un lote por sentencia; SKIP LOCKED evita esperar filas que se están votando en ese momento.
+# Retorna id y coordenadas de las expiradas para avisar a los clientes suscritos a su zona.
+SQL_EXPIRAR = text(f"""
+    UPDATE reported_irregularities
+    SET activa = false
+    WHERE id IN (
+        SELECT id FROM reported_irregularities
+        WHERE activa
+          AND (
+              {SQL_RELEVANCIA} < :relevancia_minima
+              OR created_at < now() - make_interval(secs => :edad_maxima_segundos)
+          )
+        LIMIT :lote
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, ST_Y(ubicacion) AS latitude, ST_X(ubicacion) AS longitude
+""")
+
+
+class IrregularityExpiryService:
+    """
+    Trabajo periódico que desactiva en bloque las irregularidades que perdieron relevancia,
+    para que el conjunto activo (y los índices parciales sobre 'activa') no crezca sin límite.
+    """
+    def __init__(self):
+        self.is_running = False
+        self.processing_task: Optional[asyncio.Task] = None
+        self.db_provider: Optional[Callable[[], Session]] = None
+
+    def start(self, db_provider: Callable[[], Session]):
+        self.db_provider = db_provider
+        self.is_running = True
+        self.processing_task = asyncio.create_task(self._expirar_periodicamente())
+        print("IrregularityExpiryService iniciado.")
+
+    def stop(self):
+        self.is_running = False
+        if self.processing_task:
+            self.processing_task.cancel()
+        print("IrregularityExpiryService detenido.")
+
+    async def _expirar_periodicamente(self):
+        while self.is_running:
+            try:
+                expiradas = await asyncio.to_thread(self.expirar)
+                self._publicar_expiradas(expiradas)
+                await asyncio.to_thread(self.sincronizar_penalizaciones)
+            except asyncio.CancelledError:
+                print("IrregularityExpiryService task cancelled.")
+                break
+            except Exception as e:
+                print(f"Error expirando irregularidades: {e}")
+                import traceback
+                traceback.print_exc()
+            await asyncio.sleep(IRREGULARITY_EXPIRY_INTERVAL_SECONDS)
+
+    def expirar(self) -> List[Tuple[int, float, float]]:
+        """
+        Desactiva, lote a lote, las irregularidades vencidas.
+        Retorna (id, latitud, longitud) de cada irregularidad desactivada.
+        """
+        db: Session = next(self.db_provider())
+        expiradas: List[Tuple[int, float, float]] = []
+        try:
+            while True:
+                lote = db.execute(SQL_EXPIRAR, {
+                    "vida_media_horas": IRREGULARITY_HALF_LIFE_HOURS,
+                    "relevancia_minima": IRREGULARITY_MIN_SCORE,
+                    "edad_maxima_segundos": IRREGULARITY_MAX_AGE_HOURS * 3600,
+                    "lote": IRREGULARITY_EXPIRY_BATCH,
+                }).all()
+                db.commit()
+                expiradas.extend((fila.id, fila.latitude, fila.longitude) for fila in lote)
+                if len(lote) < IRREGULARITY_EXPIRY_BATCH:
+                    break
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if expiradas:
+            print(f"{len(expiradas)} irregularidades expiradas por baja relevancia o antigüedad.")
+        return expiradas
+
+    def _publicar_expiradas(self, expiradas: List[Tuple[int, float, float]]):
+        """Avisa a los clientes suscritos que la irregularidad ya no está activa. Corre en el loop de eventos."""
+        if not irregularity_push_service.hay_suscriptores:
+            return
+        for irregularity_id, lat, lon in expiradas:
+            mensaje = json.dumps({
+                "tipo": "irregularidad",
+                "irregularidad": {
+                    "id": irregularity_id,
+                    "activa": False,
+                    "ubicacion": {"latitude": lat, "longitude": lon},
+                },
+            })
+            irregularity_push_service.publicar(lat, lon, mensaje)
+
+    def sincronizar_penalizaciones(self) -> int:
+        """Quita del ruteo las irregularidades expiradas y toma reportes y votos de otros procesos."""
+        db: Session = next(self.db_provider())
+        try:
+            return irregularity_penalty_service.sincronizar(db, network_snapshot_service.get(db))
+        finally:
+            db.close()
+
+
+# Instancia global del servicio
+irregularity_expiry_service = IrregularityExpiryService()
@@ -0,0 +1,194 @@
+# app/services/irregularity_penalties.py
+
+import math
+import os
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from shapely import STRtree
+from shapely.geometry import LineString, Point
+from sqlalchemy.orm import Session
+
+from app.models.entities import ReportedIrregularity
+from app.services.coordenadas import columnas_lat_lon
+from app.services.network_snapshot import NetworkSnapshot
+
+
+IRREGULARITY_EDGE_RADIUS_METERS = float(os.getenv("IRREGULARITY_EDGE_RADIUS_METERS", "75")) # Distancia al tramo del bus
+IRREGULARITY_EDGE_PENALTY_SECONDS = float(os.getenv("IRREGULARITY_EDGE_PENALTY_SECONDS", "300")) # Por irregularidad, con peso 1
+IRREGULARITY_MAX_WEIGHT = 3.0 # Tope del peso por votos
+# Las penalizaciones publicadas se redondean a este paso: un voto que no mueve el redondeo no
+# cambia la versión de costos (ni invalida la caché de trayectos)
+IRREGULARITY_PENALTY_STEP_SECONDS = float(os.getenv("IRREGULARITY_PENALTY_STEP_SECONDS", "60"))
+
+
+def peso_irregularidad(likes: Optional[int], dislikes: Optional[int]) -> float:
+    """Las confirmaciones aumentan la penalización y los 'No me gusta' la reducen."""
+    return min((1 + (likes or 0)) / (1 + (dislikes or 0)), IRREGULARITY_MAX_WEIGHT)
+
+
+class _SegmentosRed:
+    """Tramos en bus del snapshot como líneas en metros (proyección local), en un STRtree."""
+    def __init__(self, snapshot: NetworkSnapshot):
+        latitudes = [p["latitude"] for p in snapshot.paradas.values() if p.get("latitude") is not None]
+        self.cos_ref = math.cos(math.radians(sum(latitudes) / len(latitudes))) if latitudes else 1.0
+        lineas, edge_ids = [], []
+        for node_id, aristas in snapshot.graph.items():
+            for edge in aristas:
+                desde, hasta = snapshot.paradas.get(node_id), snapshot.paradas.get(edge["neighbor"])
+                if edge["ruta_id"] is None or not desde or not hasta or desde.get("latitude") is None or hasta.get("latitude") is None:
+                    continue
+                lineas.append(LineString([self.metros(desde["latitude"], desde["longitude"]), self.metros(hasta["latitude"], hasta["longitude"])]))
+                edge_ids.append(edge["edge_id"])
+        self.edge_ids = np.array(edge_ids, dtype=np.int64)
+        self.tree = STRtree(lineas)
+
+    def metros(self, lat: float, lon: float) -> Tuple[float, float]:
+        return lon * 111320 * self.cos_ref, lat * 111320
+
+    def cercanas(self, lat: float, lon: float) -> np.ndarray:
+        if not len(self.edge_ids):
+            return self.edge_ids
+        indices = self.tree.query(Point(self.metros(lat, lon)), predicate="dwithin", distance=IRREGULARITY_EDGE_RADIUS_METERS)
+        return self.edge_ids[indices]
+
+
+class IrregularityPenaltyService:
+    """
+    Penalización en segundos por arista debida a las irregularidades activas cercanas.
+    Cada irregularidad se une una sola vez (STRtree) a los tramos en bus a menos de
+    IRREGULARITY_EDGE_RADIUS_METERS; crear, votar o expirar un reporte solo ajusta las aristas
+    de esa irregularidad. El arreglo se publica redondeado y copiado (copy-on-write), y la versión
+    solo cambia cuando cambia lo publicado. La búsqueda de rutas lo lee sin consultar la base de datos.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version_red: Optional[int] = None
+        self._segmentos: Optional[_SegmentosRed] = None
+        self._penalizaciones = np.zeros(0) # Exactas, para sumar y restar irregularidades
+        self._publicadas = np.zeros(0) # Redondeadas a IRREGULARITY_PENALTY_STEP_SECONDS; las lee el ruteo
+        self.version = 0 # Cambia con cada arreglo de penalizaciones publicado
+
+        self._irregularidades: Dict[int, Tuple[float, float, float]] = {} # id -> (lat, lon, peso)
+        self._aristas: Dict[int, np.ndarray] = {} # id -> edge_ids afectados
+
+        # Última combinación costos base + penalizaciones: ((versión de red, versión base, versión propia), arreglo)
+        self._combinado: Optional[Tuple[Tuple, np.ndarray]] = None
+
+    def _preparar(self, snapshot: NetworkSnapshot):
+        """Con una versión nueva de la red se vuelven a unir todas las irregularidades conocidas."""
+        if self._version_red == snapshot.version:
+            return
+        self._segmentos = _SegmentosRed(snapshot)
+        penalizaciones = np.zeros(len(snapshot.costos_estaticos))
+        self._aristas = {}
+        for irregularity_id, (lat, lon, peso) in self._irregularidades.items():
+            aristas = self._segmentos.cercanas(lat, lon)
+            self._aristas[irregularity_id] = aristas
+            np.add.at(penalizaciones, aristas, IRREGULARITY_EDGE_PENALTY_SECONDS * peso)
+        self._version_red = snapshot.version
+        self._publicar(penalizaciones)
+
+    def _ajustar(self, cambios: Dict[int, Optional[Tuple[float, float, float]]]):
+        """Aplica altas, cambios de peso y bajas (valor None) en una sola copia del arreglo."""
+        penalizaciones = self._penalizaciones.copy()
+        for irregularity_id, nuevo in cambios.items():
+            previo = self._irregularidades.pop(irregularity_id, None)
+            if previo is not None:
+                np.subtract.at(penalizaciones, self._aristas.pop(irregularity_id), IRREGULARITY_EDGE_PENALTY_SECONDS * previo[2])
+            if nuevo is not None:
+                lat, lon, peso = nuevo
+                aristas = self._aristas[irregularity_id] = self._segmentos.cercanas(lat, lon)
+                np.add.at(penalizaciones, aristas, IRREGULARITY_EDGE_PENALTY_SECONDS * peso)
+                self._irregularidades[irregularity_id] = nuevo
+        np.maximum(penalizaciones, 0, out=penalizaciones) # Errores de redondeo al restar
+        self._publicar(penalizaciones)
+
+    def _publicar(self, penalizaciones: np.ndarray):
+        self._penalizaciones = penalizaciones
+        paso = IRREGULARITY_PENALTY_STEP_SECONDS
+        publicadas = np.round(penalizaciones / paso) * paso if paso > 0 else penalizaciones.copy()
+        if not np.array_equal(publicadas, self._publicadas):
+            self._publicadas = publicadas
+            self.version += 1
+
+    def registrar(self, snapshot: NetworkSnapshot, irregularity_id: int, lat: float, lon: float, likes: int = 0, dislikes: int = 0):
+        """Alta (o actualización) de una irregularidad activa."""
+        with self._lock:
+            self._preparar(snapshot)
+            self._ajustar({irregularity_id: (lat, lon, peso_irregularidad(likes, dislikes))})
+
+    def actualizar_votos(self, irregularity_id: int, likes: int, dislikes: int):
+        """Cambio de peso tras un voto; solo afecta a irregularidades ya conocidas."""
+        with self._lock:
+            previo = self._irregularidades.get(irregularity_id)
+            if previo is None or self._segmentos is None:
+                return
+            peso = peso_irregularidad(likes, dislikes)
+            if peso != previo[2]:
+                self._ajustar({irregularity_id: (previo[0], previo[1], peso)})
+
+    def sincronizar(self, db: Session, snapshot: NetworkSnapshot) -> int:
+        """
+        Reconcilia con las irregularidades activas de la base de datos (expiradas, reportes y votos
+        de otros procesos). Retorna cuántas irregularidades cambiaron.
+        """
+        filas = db.query(
+            ReportedIrregularity.id, ReportedIrregularity.likes, ReportedIrregularity.dislikes,
+            *columnas_lat_lon(ReportedIrregularity.ubicacion)
+        ).filter(ReportedIrregularity.activa == True).all()
+        activas = {f.id: (f.latitude, f.longitude, peso_irregularidad(f.likes, f.dislikes)) for f in filas}
+
+        with self._lock:
+            self._preparar(snapshot)
+            cambios: Dict[int, Optional[Tuple[float, float, float]]] = {
+                irregularity_id: None for irregularity_id in self._irregularidades if irregularity_id not in activas
+            }
+            for irregularity_id, estado in activas.items():
+                if self._irregularidades.get(irregularity_id) != estado:
+                    cambios[irregularity_id] = estado
+            if cambios:
+                self._ajustar(cambios)
+            return len(cambios)
+
+    def _publicadas_para(self, snapshot: NetworkSnapshot) -> np.ndarray:
+        if self._version_red != snapshot.version and self._irregularidades:
+            with self._lock:
+                self._preparar(snapshot)
+        publicadas = self._publicadas
+        return publicadas if len(publicadas) == len(snapshot.costos_estaticos) else np.zeros(0)
+
+    def toca(self, snapshot: NetworkSnapshot, edge_ids: Sequence[int]) -> bool:
+        """
+        True si alguna arista del camino está penalizada. Un camino que no toca aristas penalizadas
+        sigue siendo el óptimo con penalizaciones (solo encarecen otros caminos), así que solo los
+        que sí las tocan necesitan otra búsqueda.
+        """
+        publicadas = self._publicadas_para(snapshot)
+        if not len(publicadas) or not len(edge_ids):
+            return False
+        return bool(publicadas[np.asarray(edge_ids, dtype=np.int64)].any())
+
+    def aplicar(self, snapshot: NetworkSnapshot, costos: Optional[Sequence[float]], version_costos) -> Tuple[Optional[Sequence[float]], object]:
+        """
+        Suma las penalizaciones a los costos vigentes. Sin aristas penalizadas retorna los costos tal cual
+        (así los costos estáticos siguen pudiendo usar la matriz o la contracción).
+        """
+        publicadas = self._publicadas_para(snapshot)
+        if not publicadas.any():
+            return costos, version_costos
+        with self._lock:
+            # La versión de red entra en la clave: los costos estáticos cambian con la red aunque
+            # las penalizaciones publicadas (y self.version) queden iguales
+            clave = (snapshot.version, version_costos, self.version)
+            if self._combinado is not None and self._combinado[0] == clave:
+                return self._combinado[1], clave
+            base = snapshot.costos_estaticos if costos is None else np.asarray(costos)
+            combinado = base + self._publicadas
+            self._combinado = (clave, combinado)
+            return combinado, clave
+
+
+# Instancia global del servicio
+irregularity_penalty_service = IrregularityPenaltyService()
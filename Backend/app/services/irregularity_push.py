@@ -0,0 +1,145 @@
+# app/services/irregularity_push.py
+
+import asyncio
+import itertools
+import math
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from app.services.coordenadas import distancia_metros
+
+
+IRREGULARITY_PUSH_CELL_DEGREES = float(os.getenv("IRREGULARITY_PUSH_CELL_DEGREES", "0.01")) # ~1.1 km por celda
+IRREGULARITY_PUSH_MAX_CELLS = int(os.getenv("IRREGULARITY_PUSH_MAX_CELLS", "400")) # Vistas más amplias no se indexan por celda
+IRREGULARITY_PUSH_QUEUE = int(os.getenv("IRREGULARITY_PUSH_QUEUE", "100")) # Mensajes pendientes por cliente
+
+# Rectángulo (min_lon, min_lat, max_lon, max_lat)
+Rectangulo = Tuple[float, float, float, float]
+
+
+@dataclass
+class Suscripcion:
+    rectangulo: Rectangulo
+    centro: Optional[Tuple[float, float]] = None # (lat, lon) si la suscripción es por radio
+    radio_metros: Optional[float] = None
+
+    @classmethod
+    def por_radio(cls, lat: float, lon: float, radio_metros: float) -> "Suscripcion":
+        d_lat = radio_metros / 111320
+        d_lon = radio_metros / (111320 * max(math.cos(math.radians(lat)), 0.01))
+        return cls((lon - d_lon, lat - d_lat, lon + d_lon, lat + d_lat), (lat, lon), radio_metros)
+
+    def contiene(self, lat: float, lon: float) -> bool:
+        min_lon, min_lat, max_lon, max_lat = self.rectangulo
+        if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+            return False
+        return self.centro is None or distancia_metros(lat, lon, *self.centro) <= self.radio_metros
+
+
+class _Cliente:
+    """Socket suscrito con su cola de salida; un cliente lento solo pierde sus propios mensajes."""
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=IRREGULARITY_PUSH_QUEUE)
+        self.suscripcion: Optional[Suscripcion] = None
+        self.celdas: Tuple[Tuple[int, int], ...] = ()
+
+    async def enviar_pendientes(self):
+        while True:
+            mensaje = await self.cola.get()
+            await self.websocket.send_text(mensaje)
+
+
+class IrregularityPushService:
+    """
+    Envía a los clientes conectados las irregularidades nuevas o actualizadas dentro de su vista.
+    Las suscripciones se indexan en una grilla de celdas: un reporte solo se compara con los
+    clientes de su celda (más los pocos con vistas muy amplias), no con todos los conectados.
+    """
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._clientes: Dict[int, _Cliente] = {}
+        self._celdas: Dict[Tuple[int, int], Set[int]] = defaultdict(set)
+        self._amplias: Set[int] = set() # Suscripciones que cubren más de IRREGULARITY_PUSH_MAX_CELLS celdas
+
+    @property
+    def hay_suscriptores(self) -> bool:
+        return bool(self._celdas) or bool(self._amplias)
+
+    def _celda(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / IRREGULARITY_PUSH_CELL_DEGREES), math.floor(lon / IRREGULARITY_PUSH_CELL_DEGREES)
+
+    def conectar(self, websocket: WebSocket) -> int:
+        cliente_id = next(self._ids)
+        self._clientes[cliente_id] = _Cliente(websocket)
+        return cliente_id
+
+    def desconectar(self, cliente_id: int):
+        self._desindexar(cliente_id)
+        self._clientes.pop(cliente_id, None)
+
+    def _desindexar(self, cliente_id: int):
+        cliente = self._clientes.get(cliente_id)
+        if cliente is None:
+            return
+        for celda in cliente.celdas:
+            suscritos = self._celdas.get(celda)
+            if suscritos is not None:
+                suscritos.discard(cliente_id)
+                if not suscritos:
+                    del self._celdas[celda]
+        self._amplias.discard(cliente_id)
+        cliente.celdas = ()
+
+    def suscribir(self, cliente_id: int, suscripcion: Suscripcion):
+        """Reemplaza la vista del cliente (p. ej. cada vez que mueve el mapa)."""
+        cliente = self._clientes[cliente_id]
+        self._desindexar(cliente_id)
+        cliente.suscripcion = suscripcion
+
+        min_lon, min_lat, max_lon, max_lat = suscripcion.rectangulo
+        fila_min, columna_min = self._celda(min_lat, min_lon)
+        fila_max, columna_max = self._celda(max_lat, max_lon)
+        if (fila_max - fila_min + 1) * (columna_max - columna_min + 1) > IRREGULARITY_PUSH_MAX_CELLS:
+            self._amplias.add(cliente_id)
+            return
+        cliente.celdas = tuple(
+            (fila, columna)
+            for fila in range(fila_min, fila_max + 1)
+            for columna in range(columna_min, columna_max + 1)
+        )
+        for celda in cliente.celdas:
+            self._celdas[celda].add(cliente_id)
+
+    def destinatarios(self, lat: float, lon: float) -> Set[int]:
+        candidatos = self._celdas.get(self._celda(lat, lon), set()) | self._amplias
+        return {
+            cliente_id for cliente_id in candidatos
+            if self._clientes[cliente_id].suscripcion.contiene(lat, lon)
+        }
+
+    def publicar(self, lat: float, lon: float, mensaje: str) -> int:
+        """
+        Encola el mensaje (ya serializado una sola vez) para los clientes cuya vista contiene el punto.
+        Debe llamarse desde el loop de eventos. Retorna a cuántos clientes se encoló.
+        """
+        enviados = 0
+        for cliente_id in self.destinatarios(lat, lon):
+            try:
+                self._clientes[cliente_id].cola.put_nowait(mensaje)
+                enviados += 1
+            except asyncio.QueueFull:
+                pass # El cliente recupera lo perdido al volver a consultar /active
+        return enviados
+
+    async def atender(self, cliente_id: int):
+        """Envía los mensajes encolados del cliente hasta que se cancele."""
+        await self._clientes[cliente_id].enviar_pendientes()
+
+
+# Instancia global del servicio
+irregularity_push_service = IrregularityPushService()
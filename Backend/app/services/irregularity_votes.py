@@ -0,0 +1,224 @@
+# app/services/irregularity_votes.py
+
+import asyncio
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+# Segundos entre aplicaciones de los contadores acumulados; 0 = se actualizan en la misma sentencia del voto
+IRREGULARITY_VOTE_BUFFER_SECONDS = float(os.getenv("IRREGULARITY_VOTE_BUFFER_SECONDS", "0"))
+
+# Upsert del voto. El DO UPDATE solo se aplica si el voto cambia de sentido, así que una fila
+# devuelta es un voto nuevo (xmax = 0) o un cambio like <-> dislike; sin fila, el voto ya existía igual
+# (o la irregularidad no existe).
+_CTE_VOTO = """
+    WITH voto AS (
+        INSERT INTO irregularity_votes (user_id, irregularity_id, is_like, created_at)
+        SELECT :user_id, :irregularity_id, :is_like, now()
+        WHERE EXISTS (SELECT 1 FROM reported_irregularities WHERE id = :irregularity_id)
+        ON CONFLICT (user_id, irregularity_id) DO UPDATE
+            SET is_like = EXCLUDED.is_like, created_at = EXCLUDED.created_at
+            WHERE irregularity_votes.is_like IS DISTINCT FROM EXCLUDED.is_like
+        RETURNING id, user_id, irregularity_id, is_like, created_at, (xmax = 0) AS insertado
+    )
+"""
+
+SQL_VOTO = text(_CTE_VOTO + """
+    SELECT * FROM voto
+""")
+
+# Voto y contadores en una sola sentencia: los deltas se aplican en SQL, sin leer-modificar-escribir en Python.
+# Retorna además los contadores resultantes (para el peso de la irregularidad en el ruteo).
+SQL_VOTO_CON_CONTADORES = text(_CTE_VOTO + """
+    , contadores AS (
+        UPDATE reported_irregularities AS r
+        SET likes = r.likes + CASE WHEN voto.is_like THEN 1 WHEN voto.insertado THEN 0 ELSE -1 END,
+            dislikes = r.dislikes + CASE WHEN NOT voto.is_like THEN 1 WHEN voto.insertado THEN 0 ELSE -1 END,
+            ultimo_like_at = CASE WHEN voto.is_like THEN voto.created_at ELSE r.ultimo_like_at END
+        FROM voto
+        WHERE r.id = voto.irregularity_id
+        RETURNING r.id, r.likes, r.dislikes
+    )
+    SELECT voto.*, contadores.likes, contadores.dislikes
+    FROM voto LEFT JOIN contadores ON contadores.id = voto.irregularity_id
+""")
+
+# Aplica en un solo UPDATE los deltas acumulados de muchas irregularidades
+SQL_APLICAR_DELTAS = text("""
+    UPDATE reported_irregularities AS r
+    SET likes = r.likes + d.likes,
+        dislikes = r.dislikes + d.dislikes,
+        ultimo_like_at = GREATEST(r.ultimo_like_at, d.ultimo_like_at)
+    FROM unnest(
+        CAST(:ids AS integer[]), CAST(:likes AS integer[]), CAST(:dislikes AS integer[]),
+        CAST(:ultimos AS timestamptz[])
+    ) AS d(id, likes, dislikes, ultimo_like_at)
+    WHERE r.id = d.id
+""")
+
+# Migración única previa a ux_irregularity_votes_usuario: deja el voto más reciente de cada
+# (usuario, irregularidad) y retorna las irregularidades afectadas para recalcular sus contadores
+SQL_BORRAR_VOTOS_DUPLICADOS = text("""
+    DELETE FROM irregularity_votes AS v
+    USING (
+        SELECT id, row_number() OVER (
+            PARTITION BY user_id, irregularity_id ORDER BY created_at DESC, id DESC
+        ) AS orden
+        FROM irregularity_votes
+    ) AS d
+    WHERE v.id = d.id AND d.orden > 1
+    RETURNING v.irregularity_id
+""")
+
+SQL_RECALCULAR_CONTADORES = text("""
+    UPDATE reported_irregularities AS r
+    SET likes = c.likes, dislikes = c.dislikes
+    FROM (
+        SELECT irregularity_id,
+               count(*) FILTER (WHERE is_like) AS likes,
+               count(*) FILTER (WHERE NOT is_like) AS dislikes
+        FROM irregularity_votes
+        WHERE irregularity_id = ANY(CAST(:ids AS integer[]))
+        GROUP BY irregularity_id
+    ) AS c
+    WHERE r.id = c.irregularity_id
+""")
+
+
+def deduplicar_votos(engine) -> int:
+    """
+    Borra los votos duplicados anteriores al índice único ux_irregularity_votes_usuario (sin esto
+    CREATE UNIQUE INDEX falla) y recalcula likes/dislikes de las irregularidades afectadas.
+    Solo corre mientras el índice no existe. Retorna cuántos votos se borraron.
+    """
+    with engine.begin() as conexion:
+        if conexion.execute(text("SELECT to_regclass('ux_irregularity_votes_usuario')")).scalar() is not None:
+            return 0
+        afectadas = conexion.execute(SQL_BORRAR_VOTOS_DUPLICADOS).scalars().all()
+        if afectadas:
+            conexion.execute(SQL_RECALCULAR_CONTADORES, {"ids": sorted(set(afectadas))})
+        return len(afectadas)
+
+
+def deltas_voto(is_like: bool, insertado: bool) -> tuple:
+    """(delta likes, delta dislikes) de un voto nuevo o de un cambio de sentido."""
+    if insertado:
+        return (1, 0) if is_like else (0, 1)
+    return (1, -1) if is_like else (-1, 1)
+
+
+class VoteCounterBuffer:
+    """
+    Acumula en memoria los deltas de likes/dislikes por irregularidad y los aplica por lotes.
+    Un reporte viral recibe muchos votos seguidos: en lugar de que cada voto bloquee la misma
+    fila, cada intervalo se aplica un único UPDATE con la suma de los deltas.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deltas: Dict[int, List] = defaultdict(lambda: [0, 0, None]) # id -> [likes, dislikes, ultimo_like_at]
+        self.is_running = False
+        self.processing_task: Optional[asyncio.Task] = None
+        self.db_provider: Optional[Callable[[], Session]] = None
+
+    @property
+    def activo(self) -> bool:
+        return IRREGULARITY_VOTE_BUFFER_SECONDS > 0
+
+    def acumular(self, irregularity_id: int, d_likes: int, d_dislikes: int, like_at: Optional[datetime]):
+        with self._lock:
+            delta = self._deltas[irregularity_id]
+            delta[0] += d_likes
+            delta[1] += d_dislikes
+            if like_at is not None and (delta[2] is None or like_at > delta[2]):
+                delta[2] = like_at
+
+    def aplicar(self, db: Session) -> int:
+        """Escribe los deltas pendientes. Retorna cuántas irregularidades se actualizaron."""
+        with self._lock:
+            pendientes, self._deltas = self._deltas, defaultdict(lambda: [0, 0, None])
+        if not pendientes:
+            return 0
+        try:
+            db.execute(SQL_APLICAR_DELTAS, {
+                "ids": list(pendientes.keys()),
+                "likes": [d[0] for d in pendientes.values()],
+                "dislikes": [d[1] for d in pendientes.values()],
+                "ultimos": [d[2] for d in pendientes.values()],
+            })
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Se devuelven al buffer para el próximo intento
+            for irregularity_id, (likes, dislikes, ultimo) in pendientes.items():
+                self.acumular(irregularity_id, likes, dislikes, ultimo)
+            raise
+        return len(pendientes)
+
+    # --- Ciclo de vida ---
+
+    def start(self, db_provider: Callable[[], Session]):
+        if not self.activo:
+            return
+        self.db_provider = db_provider
+        self.is_running = True
+        self.processing_task = asyncio.create_task(self._aplicar_periodicamente())
+        print(f"VoteCounterBuffer iniciado (cada {IRREGULARITY_VOTE_BUFFER_SECONDS}s).")
+
+    def stop(self):
+        self.is_running = False
+        if self.processing_task:
+            self.processing_task.cancel()
+        if self.db_provider is not None:
+            # Lo acumulado no se pierde al apagar
+            self._aplicar_con_sesion()
+        print("VoteCounterBuffer detenido.")
+
+    def _aplicar_con_sesion(self) -> int:
+        db: Session = next(self.db_provider())
+        try:
+            return self.aplicar(db)
+        finally:
+            db.close()
+
+    async def _aplicar_periodicamente(self):
+        while self.is_running:
+            try:
+                await asyncio.sleep(IRREGULARITY_VOTE_BUFFER_SECONDS)
+                await asyncio.to_thread(self._aplicar_con_sesion)
+            except asyncio.CancelledError:
+                print("VoteCounterBuffer task cancelled.")
+                break
+            except Exception as e:
+                print(f"Error aplicando los contadores de votos: {e}")
+                import traceback
+                traceback.print_exc()
+
+
+def registrar_voto(db: Session, user_id: int, irregularity_id: int, is_like: bool):
+    """
+    Registra (o cambia) el voto del usuario con una sola sentencia. Retorna la fila del voto,
+    o None si el usuario ya había votado en el mismo sentido o la irregularidad no existe.
+    """
+    parametros = {"user_id": user_id, "irregularity_id": irregularity_id, "is_like": is_like}
+    if not vote_counter_buffer.activo:
+        voto = db.execute(SQL_VOTO_CON_CONTADORES, parametros).first()
+        db.commit()
+        return voto
+
+    voto = db.execute(SQL_VOTO, parametros).first()
+    db.commit()
+    if voto is not None:
+        d_likes, d_dislikes = deltas_voto(voto.is_like, voto.insertado)
+        like_at = voto.created_at if voto.is_like else None
+        vote_counter_buffer.acumular(irregularity_id, d_likes, d_dislikes, like_at)
+    return voto
+
+
+# Instancia global del buffer
+vote_counter_buffer = VoteCounterBuffer()
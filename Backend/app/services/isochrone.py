@@ -0,0 +1,172 @@
+# app/services/isochrone.py
+
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+import shapely
+from shapely.geometry import MultiPoint, Polygon
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.models.models import IsocronaResponse, ParadaAlcanzableResponse, UbicacionLatLon
+from app.services.network_snapshot import NetworkSnapshot, network_snapshot_service
+from app.services.route_calculation import (
+    MAX_DISTANCE_TO_STOP_METERS,
+    WALKING_SPEED_MPS,
+    dijkstra_desde,
+)
+
+
+# Qué tan "ajustado" es el polígono cóncavo (0 = muy ajustado, 1 = igual al convexo)
+CONCAVE_HULL_RATIO = 0.3
+
+# Puntos máximos de una grilla de accesibilidad pedida por la API (POST /api/ruta/accesibilidad)
+ACCESIBILIDAD_MAX_PUNTOS = int(os.getenv("ACCESIBILIDAD_MAX_PUNTOS", "2500"))
+
+
+def paradas_en_radio_lote(db: Session, puntos: List[Tuple[float, float]]) -> List[Dict[int, float]]:
+    """
+    Para cada punto (lat, lon) retorna {parada_id: distancia_metros} de todas las paradas
+    a menos de MAX_DISTANCE_TO_STOP_METERS, con una sola consulta para todos los puntos.
+    """
+    cercanas: List[Dict[int, float]] = [{} for _ in puntos]
+    if not puntos:
+        return cercanas
+
+    resultados = db.execute(
+        text("""
+            SELECT q.idx, parada.id AS parada_id,
+                   ST_Distance(CAST(parada.ubicacion AS geography), q.geog) AS distance_meters
+            FROM (
+                SELECT t.idx, CAST(ST_SetSRID(ST_MakePoint(t.lon, t.lat), 4326) AS geography) AS geog
+                FROM unnest(CAST(:idx AS integer[]), CAST(:lats AS double precision[]), CAST(:lons AS double precision[]))
+                    AS t(idx, lat, lon)
+            ) AS q
+            JOIN parada ON ST_DWithin(CAST(parada.ubicacion AS geography), q.geog, :radio)
+        """),
+        {
+            "idx": list(range(len(puntos))),
+            "lats": [lat for lat, _ in puntos],
+            "lons": [lon for _, lon in puntos],
+            "radio": MAX_DISTANCE_TO_STOP_METERS,
+        },
+    ).all()
+
+    for r in resultados:
+        cercanas[r.idx][r.parada_id] = r.distance_meters
+    return cercanas
+
+
+def paradas_alcanzables(snapshot: NetworkSnapshot, distancias_caminata: Dict[int, float], limite_segundos: float) -> Dict[int, float]:
+    """
+    Búsqueda uno-a-todos sobre el grafo del snapshot partiendo de todas las paradas a las que se
+    llega caminando. Retorna {parada_id: segundos} para las paradas dentro del presupuesto.
+    """
+    semillas = {
+        parada_id: distancia / WALKING_SPEED_MPS
+        for parada_id, distancia in distancias_caminata.items()
+        if distancia / WALKING_SPEED_MPS <= limite_segundos
+    }
+    if not semillas:
+        return {}
+
+    distances, _ = dijkstra_desde(snapshot.graph, semillas, limite_costo=limite_segundos)
+    return {parada_id: segundos for parada_id, segundos in distances.items() if segundos <= limite_segundos}
+
+
+def _poligono_alcance(puntos_lon_lat: List[Tuple[float, float]], tipo: str) -> Optional[List[UbicacionLatLon]]:
+    """Envolvente convexa o cóncava de los puntos alcanzados (None si no forman un área)."""
+    multipunto = MultiPoint(puntos_lon_lat)
+    if tipo == "concavo":
+        envolvente = shapely.concave_hull(multipunto, ratio=CONCAVE_HULL_RATIO)
+    else:
+        envolvente = multipunto.convex_hull
+
+    if not isinstance(envolvente, Polygon) or envolvente.is_empty:
+        return None
+    return [UbicacionLatLon(latitude=lat, longitude=lon) for lon, lat in envolvente.exterior.coords]
+
+
+def calcular_isocrona(
+    db: Session,
+    lat: float,
+    lon: float,
+    minutos: float,
+    tipo_poligono: Optional[str] = None
+) -> IsocronaResponse:
+    """
+    Paradas alcanzables desde (lat, lon) en 'minutos', incluyendo la caminata inicial y las
+    penalizaciones por transbordo, con el polígono convexo/cóncavo opcional.
+    """
+    snapshot = network_snapshot_service.get(db)
+    limite_segundos = minutos * 60
+
+    distancias_caminata = paradas_en_radio_lote(db, [(lat, lon)])[0]
+    alcanzadas = paradas_alcanzables(snapshot, distancias_caminata, limite_segundos)
+
+    paradas_response = []
+    for parada_id, segundos in sorted(alcanzadas.items(), key=lambda item: item[1]):
+        parada = snapshot.paradas.get(parada_id)
+        if not parada:
+            continue
+        paradas_response.append(ParadaAlcanzableResponse(
+            id=parada_id,
+            nombre=parada["nombre"],
+            latitude=parada["latitude"],
+            longitude=parada["longitude"],
+            tiempo_minutos=round(segundos / 60, 2)
+        ))
+
+    poligono = None
+    if tipo_poligono and paradas_response:
+        puntos = [(lon, lat)] + [(p.longitude, p.latitude) for p in paradas_response]
+        poligono = _poligono_alcance(puntos, tipo_poligono)
+
+    return IsocronaResponse(minutos=minutos, paradas_alcanzables=paradas_response, poligono=poligono)
+
+
+# --- Uso en lote: grillas de accesibilidad ---
+
+def puntos_grilla(
+    min_lat: float, min_lon: float, max_lat: float, max_lon: float, paso_metros: float,
+    max_puntos: Optional[int] = None
+) -> List[Tuple[float, float]]:
+    """
+    Genera los centros (lat, lon) de una grilla regular de 'paso_metros' sobre el rectángulo dado.
+    Lanza ValueError si la grilla supera 'max_puntos' (sin llegar a generarla completa).
+    """
+    paso_lat = paso_metros / 111320
+    paso_lon = paso_metros / (111320 * math.cos(math.radians((min_lat + max_lat) / 2)))
+    puntos = []
+    lat = min_lat
+    while lat <= max_lat:
+        lon = min_lon
+        while lon <= max_lon:
+            if max_puntos is not None and len(puntos) >= max_puntos:
+                raise ValueError(f"La grilla supera los {max_puntos} puntos.")
+            puntos.append((lat, lon))
+            lon += paso_lon
+        lat += paso_lat
+    return puntos
+
+
+def calcular_accesibilidad_lote(db: Session, puntos: List[Tuple[float, float]], minutos: float) -> List[Dict]:
+    """
+    Precalcula la accesibilidad de muchos puntos (p. ej. una grilla): un snapping espacial
+    para todos y una búsqueda acotada por punto sobre el mismo snapshot.
+    Retorna por punto el número de paradas alcanzables y el tiempo medio hasta ellas.
+    """
+    snapshot = network_snapshot_service.get(db)
+    limite_segundos = minutos * 60
+
+    resultados = []
+    for (lat, lon), distancias_caminata in zip(puntos, paradas_en_radio_lote(db, puntos)):
+        alcanzadas = paradas_alcanzables(snapshot, distancias_caminata, limite_segundos)
+        resultados.append({
+            "latitude": lat,
+            "longitude": lon,
+            "paradas_alcanzables": len(alcanzadas),
+            "tiempo_medio_minutos": round(sum(alcanzadas.values()) / len(alcanzadas) / 60, 2) if alcanzadas else None,
+        })
+    return resultados
@@ -0,0 +1,367 @@
+# app/services/network_import.py
+
+import csv
+import io
+import json
+import os
+import zipfile
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, TextIO, Tuple
+
+import numpy as np
+from geoalchemy2 import WKTElement
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from app.models.entities import NetworkVersion, Parada, Ruta, RutaParada
+
+
+LOTE_IMPORTACION = int(os.getenv("NETWORK_IMPORT_BATCH", "1000")) # Filas por sentencia INSERT ... ON CONFLICT
+TAMANO_LECTURA = 64 * 1024 # Bytes leídos del GeoJSON en cada paso
+
+
+class ParadaImportada(NamedTuple):
+    clave: str # Identificador en la fuente (stop_id de GTFS, id del feature GeoJSON)
+    nombre: str
+    latitude: float
+    longitude: float
+
+
+class RutaImportada(NamedTuple):
+    clave: str # route_id de GTFS
+    nombre: str
+    paradas: List[str] # Claves de las paradas, en orden
+
+
+class ResultadoImportacion:
+    def __init__(self):
+        self.paradas = 0
+        self.rutas = 0
+        self.ruta_paradas = 0
+        self.descartadas: List[str] = [] # Motivo de cada registro descartado
+        self.version_red: Optional[int] = None
+
+    def resumen(self) -> str:
+        return (f"{self.paradas} paradas, {self.rutas} rutas y {self.ruta_paradas} paradas en rutas importadas; "
+                f"{len(self.descartadas)} registros descartados; versión de la red {self.version_red}.")
+
+
+def en_lotes(items: Iterable, tamano: int = LOTE_IMPORTACION) -> Iterator[List]:
+    lote = []
+    for item in items:
+        lote.append(item)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+# --- Lectura de GeoJSON ---
+
+def _features_geojson(archivo: TextIO) -> Iterator[Dict]:
+    """
+    Recorre el arreglo "features" de un FeatureCollection sin cargar el archivo completo:
+    decodifica un feature a la vez con JSONDecoder.raw_decode sobre un buffer que se va llenando.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    fin_archivo = False
+
+    def _llenar() -> bool:
+        nonlocal buffer, fin_archivo
+        bloque = archivo.read(TAMANO_LECTURA)
+        if not bloque:
+            fin_archivo = True
+            return False
+        buffer += bloque
+        return True
+
+    # Avanza hasta el "[" que abre el arreglo de features
+    while True:
+        inicio = buffer.find('"features"')
+        if inicio >= 0:
+            corchete = buffer.find("[", inicio)
+            if corchete >= 0:
+                buffer = buffer[corchete + 1:]
+                break
+        if not _llenar():
+            raise ValueError('El GeoJSON no tiene un arreglo "features".')
+
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,")
+        if buffer.startswith("]"):
+            return
+        if not buffer:
+            if not _llenar():
+                raise ValueError("GeoJSON truncado: el arreglo de features no se cierra.")
+            continue
+        try:
+            feature, fin = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # Feature incompleto en el buffer: se lee más
+            if fin_archivo or not _llenar():
+                raise ValueError("GeoJSON inválido o truncado dentro del arreglo de features.")
+            continue
+        buffer = buffer[fin:]
+        yield feature
+
+
+def leer_paradas_geojson(archivo: TextIO, descartadas: List[str]) -> Iterator[ParadaImportada]:
+    """
+    Paradas desde los features Point de un GeoJSON (p. ej. la exportación de Overpass de
+    paradasTransca.geojson). Las paradas sin nombre reciben uno derivado de su id.
+    """
+    for numero, feature in enumerate(_features_geojson(archivo)):
+        geometria = feature.get("geometry") or {}
+        propiedades = feature.get("properties") or {}
+        clave = str(feature.get("id") or propiedades.get("@id") or numero)
+        if geometria.get("type") != "Point" or len(geometria.get("coordinates") or []) < 2:
+            descartadas.append(f"Feature {clave}: la geometría no es un punto.")
+            continue
+        lon, lat = geometria["coordinates"][:2]
+        nombre = propiedades.get("name") or f"Parada {clave.rsplit('/', 1)[-1]}"
+        yield ParadaImportada(clave, nombre.strip(), lat, lon)
+
+
+# --- Lectura de GTFS ---
+
+@contextmanager
+def abrir_gtfs(ruta_gtfs: str):
+    """Da una función que abre (en texto, en streaming) un archivo del feed, sea un directorio o un .zip."""
+    if os.path.isdir(ruta_gtfs):
+        yield lambda nombre: open(os.path.join(ruta_gtfs, nombre), encoding="utf-8-sig", newline="")
+        return
+    with zipfile.ZipFile(ruta_gtfs) as feed:
+        yield lambda nombre: io.TextIOWrapper(feed.open(nombre), encoding="utf-8-sig", newline="")
+
+
+def leer_paradas_gtfs(abrir, descartadas: List[str]) -> Iterator[ParadaImportada]:
+    with abrir("stops.txt") as archivo:
+        for fila in csv.DictReader(archivo):
+            # location_type 1 = estación "padre"; no es un punto de parada de los buses
+            if fila.get("location_type") not in (None, "", "0"):
+                continue
+            try:
+                lat, lon = float(fila["stop_lat"]), float(fila["stop_lon"])
+            except (KeyError, TypeError, ValueError):
+                descartadas.append(f"stop_id {fila.get('stop_id')}: coordenadas ilegibles.")
+                continue
+            nombre = (fila.get("stop_name") or "").strip() or f"Parada {fila['stop_id']}"
+            yield ParadaImportada(fila["stop_id"], nombre, lat, lon)
+
+
+def leer_rutas_gtfs(abrir) -> List[RutaImportada]:
+    """
+    Una secuencia de paradas por ruta: la del primer viaje de la ruta en trips.txt (preferentemente
+    direction_id 0). stop_times.txt se recorre en streaming conservando solo esos viajes.
+    """
+    nombres: Dict[str, str] = {}
+    with abrir("routes.txt") as archivo:
+        for fila in csv.DictReader(archivo):
+            nombres[fila["route_id"]] = (
+                fila.get("route_short_name") or fila.get("route_long_name") or fila["route_id"]
+            ).strip()
+
+    viaje_por_ruta: Dict[str, Tuple[str, str]] = {} # route_id -> (direction_id, trip_id)
+    with abrir("trips.txt") as archivo:
+        for fila in csv.DictReader(archivo):
+            direccion = fila.get("direction_id") or "0"
+            actual = viaje_por_ruta.get(fila["route_id"])
+            if actual is None or (actual[0] != "0" and direccion == "0"):
+                viaje_por_ruta[fila["route_id"]] = (direccion, fila["trip_id"])
+    ruta_por_viaje = {trip_id: route_id for route_id, (_, trip_id) in viaje_por_ruta.items()}
+
+    secuencias: Dict[str, List[Tuple[int, str]]] = {route_id: [] for route_id in viaje_por_ruta}
+    with abrir("stop_times.txt") as archivo:
+        for fila in csv.DictReader(archivo):
+            route_id = ruta_por_viaje.get(fila["trip_id"])
+            if route_id is not None:
+                secuencias[route_id].append((int(fila["stop_sequence"]), fila["stop_id"]))
+
+    return [
+        RutaImportada(route_id, nombres.get(route_id, route_id), [stop_id for _, stop_id in sorted(secuencia)])
+        for route_id, secuencia in secuencias.items() if secuencia
+    ]
+
+
+# --- Validación y escritura ---
+
+def validar_lote(lote: List[ParadaImportada], descartadas: List[str], vistas: Set) -> List[ParadaImportada]:
+    """
+    Valida las coordenadas del lote en forma vectorizada y descarta duplicados: ya vistos por
+    nombre (la columna es única) o por ubicación (también única).
+    """
+    coords = np.array([(p.latitude, p.longitude) for p in lote], dtype=np.float64).reshape(-1, 2)
+    validas = (
+        np.isfinite(coords).all(axis=1)
+        & (np.abs(coords[:, 0]) <= 90) & (np.abs(coords[:, 1]) <= 180)
+        & ~((coords[:, 0] == 0) & (coords[:, 1] == 0)) # (0, 0): coordenada faltante exportada como cero
+    )
+    resultado = []
+    for parada, valida in zip(lote, validas.tolist()):
+        if not valida:
+            descartadas.append(f"Parada {parada.clave} ({parada.nombre}): coordenadas fuera de rango.")
+            continue
+        ubicacion = (round(parada.latitude, 7), round(parada.longitude, 7))
+        if parada.nombre in vistas or ubicacion in vistas:
+            descartadas.append(f"Parada {parada.clave} ({parada.nombre}): nombre o ubicación repetidos.")
+            continue
+        vistas.add(parada.nombre)
+        vistas.add(ubicacion)
+        resultado.append(parada)
+    return resultado
+
+
+# Paradas existentes en las ubicaciones de un lote (la columna 'ubicacion' también es única)
+SQL_PARADAS_POR_UBICACION = text("""
+    SELECT u.i, p.id, p.nombre
+    FROM unnest(CAST(:lons AS float8[]), CAST(:lats AS float8[])) WITH ORDINALITY AS u(lon, lat, i)
+    JOIN parada AS p ON p.ubicacion = ST_SetSRID(ST_MakePoint(u.lon, u.lat), 4326)
+""")
+
+SQL_RENOMBRAR_PARADAS = text("""
+    UPDATE parada AS p SET nombre = d.nombre
+    FROM unnest(CAST(:ids AS integer[]), CAST(:nombres AS text[])) AS d(id, nombre)
+    WHERE p.id = d.id
+""")
+
+
+def upsert_paradas(db: Session, lote: List[ParadaImportada], descartadas: List[str]) -> Dict[str, int]:
+    """
+    Escribe un lote de paradas. Retorna {nombre: parada_id}.
+    Una parada que ya existe en la misma ubicación se actualiza por id (p. ej. cambio de nombre);
+    el resto va por INSERT ... ON CONFLICT (nombre) DO UPDATE. Si el nombre y la ubicación
+    pertenecen a dos paradas distintas se descarta: actualizarla violaría una de las dos columnas únicas.
+    """
+    existentes = db.execute(SQL_PARADAS_POR_UBICACION, {
+        "lons": [p.longitude for p in lote], "lats": [p.latitude for p in lote]
+    }).all()
+    por_ubicacion = {fila.i - 1: (fila.id, fila.nombre) for fila in existentes}
+    nombres_renombrados = [lote[i].nombre for i, (_, nombre) in por_ubicacion.items() if lote[i].nombre != nombre]
+    id_por_nombre = dict(
+        db.query(Parada.nombre, Parada.id).filter(Parada.nombre.in_(nombres_renombrados)).all()
+    ) if nombres_renombrados else {}
+
+    ids: Dict[str, int] = {}
+    renombrar: List[Tuple[int, str]] = []
+    nuevas: List[ParadaImportada] = []
+    for i, parada in enumerate(lote):
+        if i not in por_ubicacion:
+            nuevas.append(parada)
+            continue
+        parada_id, nombre_actual = por_ubicacion[i]
+        if parada.nombre != nombre_actual:
+            if id_por_nombre.get(parada.nombre, parada_id) != parada_id:
+                descartadas.append(
+                    f"Parada {parada.clave} ({parada.nombre}): el nombre y la ubicación pertenecen a paradas distintas."
+                )
+                continue
+            renombrar.append((parada_id, parada.nombre))
+        ids[parada.nombre] = parada_id
+
+    if renombrar:
+        db.execute(SQL_RENOMBRAR_PARADAS, {
+            "ids": [parada_id for parada_id, _ in renombrar], "nombres": [nombre for _, nombre in renombrar]
+        })
+    if nuevas:
+        stmt = pg_insert(Parada).values([
+            {"nombre": p.nombre, "ubicacion": WKTElement(f"POINT({p.longitude} {p.latitude})", srid=4326)}
+            for p in nuevas
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Parada.nombre],
+            set_={"ubicacion": stmt.excluded.ubicacion}
+        ).returning(Parada.id, Parada.nombre)
+        ids.update({fila.nombre: fila.id for fila in db.execute(stmt)})
+    return ids
+
+
+def upsert_rutas(db: Session, nombres: List[str]) -> Dict[str, int]:
+    """Rutas por nombre (único). Retorna {nombre: ruta_id}, existan o no de antes."""
+    ids: Dict[str, int] = {}
+    for lote in en_lotes(nombres):
+        stmt = pg_insert(Ruta).values([{"nombre": nombre} for nombre in lote])
+        # DO UPDATE (sin cambios reales) para que RETURNING también incluya las rutas existentes
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Ruta.nombre], set_={"nombre": stmt.excluded.nombre}
+        ).returning(Ruta.id, Ruta.nombre)
+        ids.update({fila.nombre: fila.id for fila in db.execute(stmt)})
+    return ids
+
+
+def reemplazar_ruta_paradas(db: Session, filas: List[Dict]) -> int:
+    """Reemplaza la secuencia de paradas de las rutas importadas (borrado + inserción en lotes)."""
+    rutas = sorted({fila["ruta_id"] for fila in filas})
+    if not rutas:
+        return 0
+    db.query(RutaParada).filter(RutaParada.ruta_id.in_(rutas)).delete(synchronize_session=False)
+    for lote in en_lotes(filas):
+        db.execute(pg_insert(RutaParada).values(lote).on_conflict_do_nothing())
+    return len(filas)
+
+
+def incrementar_version_red(db: Session) -> int:
+    """Marca la red como modificada; los procesos del API reconstruyen su snapshot al verla."""
+    stmt = pg_insert(NetworkVersion).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[NetworkVersion.id],
+        set_={"version": NetworkVersion.version + 1, "actualizado_en": func.now()}
+    ).returning(NetworkVersion.version)
+    return db.execute(stmt).scalar()
+
+
+def importar_red(
+    db: Session,
+    paradas: Iterable[ParadaImportada],
+    rutas: Iterable[RutaImportada] = (),
+    descartadas: Optional[List[str]] = None
+) -> ResultadoImportacion:
+    """
+    Importación idempotente en una sola transacción: paradas por lotes (validadas, por ubicación
+    o con upsert por nombre), rutas por nombre y la secuencia completa de cada ruta importada. Al final incrementa
+    la versión de la red, lo que provoca una única reconstrucción del snapshot en el API.
+    """
+    resultado = ResultadoImportacion()
+    if descartadas is not None:
+        resultado.descartadas = descartadas
+    vistas: Set = set()
+    nombre_por_clave: Dict[str, str] = {}
+    parada_ids: Dict[str, int] = {}
+
+    try:
+        for lote in en_lotes(paradas):
+            for parada in lote:
+                # Claves repetidas por nombre (p. ej. andenes de una misma estación) se unen en una parada
+                nombre_por_clave.setdefault(parada.clave, parada.nombre)
+            validas = validar_lote(lote, resultado.descartadas, vistas)
+            if validas:
+                ids_lote = upsert_paradas(db, validas, resultado.descartadas)
+                parada_ids.update(ids_lote)
+                resultado.paradas += len(ids_lote)
+
+        rutas = list(rutas)
+        ruta_ids = upsert_rutas(db, sorted({ruta.nombre for ruta in rutas}))
+        filas_ruta_parada = []
+        for ruta in rutas:
+            incluidas: Set[int] = set()
+            for clave in ruta.paradas:
+                parada_id = parada_ids.get(nombre_por_clave.get(clave))
+                if parada_id is None:
+                    resultado.descartadas.append(f"Ruta {ruta.nombre}: parada {clave} desconocida o descartada.")
+                    continue
+                if parada_id in incluidas: # La clave primaria es (ruta_id, parada_id)
+                    continue
+                incluidas.add(parada_id)
+                filas_ruta_parada.append({"ruta_id": ruta_ids[ruta.nombre], "parada_id": parada_id, "orden": len(incluidas)})
+        resultado.rutas = len(ruta_ids)
+        resultado.ruta_paradas = reemplazar_ruta_paradas(db, filas_ruta_parada)
+
+        resultado.version_red = incrementar_version_red(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return resultado
@@ -0,0 +1,215 @@
+# app/services/network_snapshot.py
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models.entities import NetworkVersion, Ruta, Parada, RutaParada
+from app.services.coordenadas import columnas_lat_lon
+
+
+# Motor de búsqueda usado por calculate_route: "dijkstra" (por defecto), "matriz" o "contraccion".
+# "dijkstra" y "matriz" guardan una etiqueta por parada; "contraccion" busca sobre estados
+# (parada, ruta) y con transbordos puede encontrar tiempos menores (ver dijkstra_desde).
+ROUTING_BACKEND = os.getenv("ROUTING_BACKEND", "dijkstra")
+
+# Cada cuánto se consulta la marca de versión de la red (la cambian las importaciones de otros procesos)
+NETWORK_VERSION_CHECK_SECONDS = float(os.getenv("NETWORK_VERSION_CHECK_SECONDS", "30"))
+
+
+class NetworkSnapshot:
+    """
+    Fotografía en memoria de la red de Transcaribe (paradas, rutas y grafo de transporte).
+    Se construye una sola vez por versión de la red y se comparte entre peticiones,
+    de modo que el cálculo de rutas ya no reconstruye el grafo en cada llamada.
+    """
+    def __init__(
+        self,
+        version: int,
+        graph: Dict[int, List[Dict]],
+        paradas: Dict[int, Dict],
+        rutas: Dict[int, str],
+    ):
+        self.version = version
+        self.graph = graph
+        self.paradas = paradas # {parada_id: {"nombre": str, "latitude": float, "longitude": float}}
+        self.rutas = rutas # {ruta_id: nombre}
+        self.creado_en = datetime.utcnow()
+        self.version_datos = 0 # Valor de NetworkVersion con el que se construyó
+
+        # Índice denso de nodos, usado por las estructuras basadas en arreglos (matriz, etc.)
+        self.node_ids: List[int] = sorted(graph.keys())
+        self.node_index: Dict[int, int] = {node_id: i for i, node_id in enumerate(self.node_ids)}
+
+        # Índice denso de aristas: cada arista recibe un "edge_id" que la alinea con arreglos
+        # compactos de costos (p. ej. los costos por tráfico), sin reconstruir el grafo.
+        costos, longitudes, a_pie = [], [], []
+        # Por índice denso de nodo: (índice del vecino, edge_id, ruta_id); lo usan las búsquedas con arreglos
+        self.adyacencia_densa: List[List[tuple]] = []
+        for node_id in self.node_ids:
+            salientes = []
+            for edge in graph[node_id]:
+                edge["edge_id"] = len(costos)
+                costos.append(edge["cost"])
+                longitudes.append(edge.get("distance_meters", 0))
+                a_pie.append(edge["ruta_id"] is None)
+                salientes.append((self.node_index[edge["neighbor"]], edge["edge_id"], edge["ruta_id"]))
+            self.adyacencia_densa.append(salientes)
+        self.costos_estaticos = np.array(costos, dtype=np.float64)
+        self.longitudes = np.array(longitudes, dtype=np.float64)
+        self.aristas_a_pie = np.array(a_pie, dtype=bool) # Transbordos caminando entre paradas cercanas
+
+        # Rutas con sus paradas en orden (formato de RutaDetalleResponse), base del catálogo /rutas
+        self.catalogo_rutas: List[Dict] = []
+
+        # Índice espacial de paradas con sus rutas (/paradas/cercanas-con-rutas)
+        self.indice_paradas = None
+
+        # Matriz de tiempos entre todas las paradas (solo si ROUTING_BACKEND == "matriz")
+        self.route_matrix = None
+
+        # Grafo con cadenas contraídas y búsqueda bidireccional (solo si ROUTING_BACKEND == "contraccion")
+        self.contraccion = None
+
+
+class NetworkSnapshotService:
+    """
+    Mantiene la versión vigente de la red. La reconstrucción crea un snapshot nuevo
+    y lo publica con una sola asignación, así las peticiones en curso siguen usando
+    el anterior sin bloqueos.
+    Salvo la primera construcción, get() no consulta la base de datos ni reconstruye: la
+    verificación de versión y la reconstrucción corren en un hilo aparte y, mientras tanto,
+    se sigue sirviendo el snapshot anterior (get() se llama desde endpoints async).
+    """
+    def __init__(self):
+        self._snapshot: Optional[NetworkSnapshot] = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._verificado_en = 0.0
+        self._obsoleto = False # La red cambió en este proceso (ver invalidate)
+        self._hilo: Optional[threading.Thread] = None
+        self._lock_hilo = threading.Lock()
+
+    def get(self, db: Session) -> NetworkSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._build(db)
+                return self._snapshot
+        if self._obsoleto or time.monotonic() - self._verificado_en >= NETWORK_VERSION_CHECK_SECONDS:
+            self._actualizar_en_segundo_plano()
+        return snapshot
+
+    def rebuild(self, db: Session) -> NetworkSnapshot:
+        with self._lock:
+            self._snapshot = self._build(db)
+            return self._snapshot
+
+    def invalidate(self):
+        """Marca el snapshot como obsoleto; el siguiente get() lanza la reconstrucción en segundo plano."""
+        self._obsoleto = True
+
+    def _actualizar_en_segundo_plano(self):
+        with self._lock_hilo:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._verificado_en = time.monotonic()
+            self._hilo = threading.Thread(target=self._actualizar, name="network-snapshot", daemon=True)
+            self._hilo.start()
+
+    def _actualizar(self):
+        """Corre en el hilo de fondo, con su propia sesión: verifica la versión y reconstruye si cambió."""
+        from app.database import SessionLocal
+
+        obsoleto, self._obsoleto = self._obsoleto, False # Una invalidación durante la construcción provoca otra
+        db = SessionLocal()
+        try:
+            version_datos = _version_datos(db)
+            if not obsoleto and version_datos == self._snapshot.version_datos:
+                return
+            motivo = "la red se modificó en este proceso" if obsoleto else f"la versión de la red cambió (antes {self._snapshot.version_datos})"
+            print(f"Se reconstruye el snapshot en segundo plano: {motivo}.")
+            with self._lock:
+                self._snapshot = self._build(db)
+        except Exception as e:
+            self._obsoleto = self._obsoleto or obsoleto # Se reintenta en el siguiente get()
+            print(f"Error reconstruyendo el snapshot de la red: {e}")
+        finally:
+            db.close()
+
+    def _build(self, db: Session) -> NetworkSnapshot:
+        # Import local para evitar el ciclo route_calculation -> network_snapshot
+        from app.services.route_calculation import _agregar_transbordos_a_pie, _build_transport_graph
+        from app.services.route_info_service import get_all_routes
+        from app.services.stop_index import build_stop_index
+
+        # Se lee antes que los datos: un cambio concurrente provoca, a lo sumo, una reconstrucción extra
+        version_datos = _version_datos(db)
+        graph = _build_transport_graph(db)
+        # Coordenadas como floats: las respuestas no vuelven a decodificar la geometría
+        paradas = {
+            p.id: {"nombre": p.nombre, "latitude": p.latitude, "longitude": p.longitude}
+            for p in db.query(Parada.id, Parada.nombre, *columnas_lat_lon(Parada.ubicacion)).all()
+        }
+        rutas = {r.id: r.nombre for r in db.query(Ruta).all()}
+
+        # Aristas de caminata entre paradas cercanas (las usan todos los motores de búsqueda)
+        aristas_a_pie = _agregar_transbordos_a_pie(graph, paradas)
+
+        self._version += 1
+        snapshot = NetworkSnapshot(self._version, graph, paradas, rutas)
+        snapshot.version_datos = version_datos
+        snapshot.catalogo_rutas = get_all_routes(db)
+        snapshot.indice_paradas = build_stop_index(snapshot.paradas, snapshot.catalogo_rutas)
+
+        if ROUTING_BACKEND == "matriz":
+            from app.services.route_matrix import build_route_matrix
+            snapshot.route_matrix = build_route_matrix(snapshot.graph, snapshot.node_ids)
+        elif ROUTING_BACKEND == "contraccion":
+            from app.services.route_contraction import build_route_contraction
+            snapshot.contraccion = build_route_contraction(snapshot.graph)
+
+        self._verificado_en = time.monotonic()
+        print(f"Snapshot de red v{snapshot.version} construido: {len(snapshot.node_ids)} paradas, {len(rutas)} rutas, {aristas_a_pie} transbordos a pie.")
+        return snapshot
+
+
+def _version_datos(db: Session) -> int:
+    return db.query(NetworkVersion.version).filter(NetworkVersion.id == 1).scalar() or 0
+
+
+# Instancia global del servicio
+network_snapshot_service = NetworkSnapshotService()
+
+
+# --- Invalidación al modificar la red ---
+# Cualquier cambio en rutas, paradas o ruta_parada hecho con el ORM marca el snapshot como obsoleto
+# al confirmar la transacción; el siguiente get() reconstruye grafo, catálogo e índice en segundo plano.
+ENTIDADES_RED = (Ruta, Parada, RutaParada)
+
+
+@event.listens_for(Session, "after_flush")
+def _marcar_cambios_red(session: Session, flush_context):
+    for instancia in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instancia, ENTIDADES_RED):
+            session.info["red_modificada"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_snapshot_red(session: Session):
+    if session.info.pop("red_modificada", False):
+        print("Red modificada: el snapshot vigente se reconstruirá en segundo plano.")
+        network_snapshot_service.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_cambios_red(session: Session):
+    session.info.pop("red_modificada", None)
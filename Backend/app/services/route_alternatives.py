@@ -0,0 +1,183 @@
+# app/services/route_alternatives.py
+
+import heapq
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models.models import ItinerarioAlternativoResponse
+from app.services.network_snapshot import NetworkSnapshot
+from app.services.route_calculation import (
+    TRANSFER_PENALTY_SECONDS,
+    WALKING_SPEED_MPS,
+    construir_tramo_bus,
+)
+
+
+# Variantes de la búsqueda para diversificar los itinerarios
+FACTOR_TRANSBORDO_MENOS_TRANSBORDOS = 4 # "menos_transbordos": cada transbordo pesa 4 veces más
+FACTOR_CAMINATA_MENOS_CAMINATA = 3 # "menos_caminata": los tramos a pie pesan 3 veces más
+FACTOR_PENALIZACION_REPETIDAS = 1.5 # Método de penalización: encarece las aristas ya usadas
+
+INF = float('inf')
+
+
+def _transbordos(path_segments: List[Dict]) -> int:
+    """Cambios de ruta de bus a lo largo del camino (los tramos a pie no cuentan como ruta)."""
+    rutas = [s["ruta_id"] for s in path_segments if s["ruta_id"] is not None]
+    return sum(1 for previa, actual in zip(rutas, rutas[1:]) if actual != previa)
+
+
+def _tiempo_real(path_segments: List[Dict]) -> float:
+    """Tiempo del camino con los costos y la penalización reales (no los de la variante que lo encontró)."""
+    total, ruta_actual = 0.0, None
+    for s in path_segments:
+        total += s["cost_seconds"]
+        if ruta_actual is not None and s["ruta_id"] != ruta_actual:
+            total += TRANSFER_PENALTY_SECONDS
+        ruta_actual = s["ruta_id"]
+    return total
+
+
+class _BuscadorAlternativas:
+    """
+    Dijkstra con penalización de transbordo (el mismo criterio que dijkstra_desde) sobre el índice
+    denso del snapshot. Todas las búsquedas de una petición comparten un solo juego de arreglos de
+    distancias y predecesores: entre una búsqueda y otra solo se reinician los nodos tocados.
+    """
+    def __init__(self, snapshot: NetworkSnapshot, costos_base: List[float]):
+        n = len(snapshot.node_ids)
+        self.snapshot = snapshot
+        self.costos_base = costos_base
+        self.distancias = [INF] * n
+        self.previo = [-1] * n
+        self.arista = [-1] * n # edge_id con el que se llegó a cada nodo
+        self.ruta: List[Optional[int]] = [None] * n
+        self.tocados: List[int] = []
+
+    def _reiniciar(self):
+        for nodo in self.tocados:
+            self.distancias[nodo] = INF
+            self.previo[nodo] = -1
+        self.tocados = []
+
+    def buscar(self, inicio: int, fin: int, costos: List[float], penalizacion_transbordo: float) -> Optional[Tuple[List[Dict], List[int]]]:
+        """Retorna (segmentos con los costos base, edge_ids del camino) o None si no hay camino."""
+        self._reiniciar()
+        adyacencia = self.snapshot.adyacencia_densa
+        distancias, previo, arista, ruta, tocados = self.distancias, self.previo, self.arista, self.ruta, self.tocados
+
+        distancias[inicio] = 0.0
+        tocados.append(inicio)
+        cola = [(0.0, inicio, None)]
+        while cola:
+            costo, nodo, ruta_actual = heapq.heappop(cola)
+            if costo > distancias[nodo]:
+                continue
+            if nodo == fin:
+                break
+            for vecino, edge_id, ruta_id in adyacencia[nodo]:
+                nuevo = costo + costos[edge_id]
+                if ruta_actual is not None and ruta_id != ruta_actual:
+                    nuevo += penalizacion_transbordo
+                if nuevo < distancias[vecino]:
+                    if distancias[vecino] == INF:
+                        tocados.append(vecino)
+                    distancias[vecino] = nuevo
+                    previo[vecino], arista[vecino], ruta[vecino] = nodo, edge_id, ruta_id
+                    heapq.heappush(cola, (nuevo, vecino, ruta_id))
+
+        if distancias[fin] == INF:
+            return None
+        return self._reconstruir(inicio, fin)
+
+    def _reconstruir(self, inicio: int, fin: int) -> Tuple[List[Dict], List[int]]:
+        """Mismos segmentos que reconstruir_camino, con los tiempos de los costos base."""
+        node_ids = self.snapshot.node_ids
+        segmentos, edge_ids = [], []
+        ruta_siguiente = None
+        nodo = fin
+        while nodo != inicio:
+            previo, edge_id, ruta_id = self.previo[nodo], self.arista[nodo], self.ruta[nodo]
+            segmentos.append({
+                "from_parada_id": node_ids[previo],
+                "to_parada_id": node_ids[nodo],
+                "ruta_id": ruta_id,
+                "is_transfer_point": ruta_siguiente is not None and ruta_id != ruta_siguiente,
+                "cost_seconds": self.costos_base[edge_id],
+            })
+            edge_ids.append(edge_id)
+            ruta_siguiente = ruta_id
+            nodo = previo
+        return segmentos[::-1], edge_ids[::-1]
+
+
+def itinerarios_alternativos(
+    snapshot: NetworkSnapshot,
+    origen_id: int,
+    destino_id: int,
+    dist_origen: float,
+    dist_destino: float,
+    costos_base: np.ndarray,
+    cantidad: int,
+    edge_ids_principal: Sequence[int]
+) -> List[ItinerarioAlternativoResponse]:
+    """
+    Hasta 'cantidad' itinerarios distintos al más rápido ('edge_ids_principal', el camino que ya
+    se calculó para la respuesta) entre las mismas paradas.
+    Primero variantes con criterio propio (menos transbordos, menos caminata) y luego el método
+    de penalización: cada camino encontrado encarece sus aristas para la búsqueda siguiente.
+    Son hasta 2 + 2 * cantidad búsquedas punto a punto (se detienen al llegar al destino), todas
+    sobre los mismos arreglos; cada variante solo cambia el arreglo de costos.
+    """
+    if cantidad <= 0 or origen_id == destino_id:
+        return []
+    if origen_id not in snapshot.node_index or destino_id not in snapshot.node_index or not edge_ids_principal:
+        return []
+
+    base = costos_base.tolist()
+    buscador = _BuscadorAlternativas(snapshot, base)
+    inicio, fin = snapshot.node_index[origen_id], snapshot.node_index[destino_id]
+
+    vistos = {tuple(edge_ids_principal)}
+    penalizados = list(base)
+    for edge_id in edge_ids_principal:
+        penalizados[edge_id] *= FACTOR_PENALIZACION_REPETIDAS
+
+    variantes = [
+        ("menos_transbordos", base, TRANSFER_PENALTY_SECONDS * FACTOR_TRANSBORDO_MENOS_TRANSBORDOS),
+        ("menos_caminata", np.where(snapshot.aristas_a_pie, costos_base * FACTOR_CAMINATA_MENOS_CAMINATA, costos_base).tolist(), TRANSFER_PENALTY_SECONDS),
+    ]
+    # Intentos extra del método de penalización (los caminos repetidos se vuelven a encarecer)
+    variantes += [("alternativo", None, TRANSFER_PENALTY_SECONDS)] * (cantidad * 2)
+
+    encontrados: List[Tuple[str, List[Dict], List[int]]] = []
+    for criterio, costos_busqueda, penalizacion in variantes:
+        if len(encontrados) >= cantidad:
+            break
+        resultado = buscador.buscar(inicio, fin, penalizados if costos_busqueda is None else costos_busqueda, penalizacion)
+        if resultado is None:
+            continue
+        camino, ids = resultado
+        for edge_id in ids:
+            penalizados[edge_id] *= FACTOR_PENALIZACION_REPETIDAS
+        firma = tuple(ids)
+        if firma in vistos:
+            continue
+        vistos.add(firma)
+        encontrados.append((criterio, camino, ids))
+
+    itinerarios = []
+    for criterio, camino, ids in encontrados:
+        tiempo_bus = _tiempo_real(camino)
+        tramo = construir_tramo_bus(snapshot, {"path_segments": camino, "total_time_seconds": tiempo_bus})
+        caminata = dist_origen + dist_destino + float(snapshot.longitudes[ids][snapshot.aristas_a_pie[ids]].sum())
+        tiempo_total = tiempo_bus + (dist_origen + dist_destino) / WALKING_SPEED_MPS
+        itinerarios.append(ItinerarioAlternativoResponse(
+            criterio=criterio,
+            tiempo_estimado_minutos=round(tiempo_total / 60, 2),
+            transbordos=_transbordos(camino),
+            distancia_caminata_metros=round(caminata, 2),
+            paradas_trayecto=tramo["paradas_trayecto"]
+        ))
+    return itinerarios
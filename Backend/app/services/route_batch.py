@@ -0,0 +1,288 @@
+# app/services/route_batch.py
+
+import codecs
+import json
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.models.models import CalculateRouteRequest
+from app.services.irregularity_penalties import irregularity_penalty_service
+from app.services.network_snapshot import NetworkSnapshot
+from app.services.route_cache import route_result_cache
+from app.services.route_calculation import (
+    MAX_DISTANCE_TO_STOP_METERS,
+    construir_tramo_bus,
+    costos_modo,
+    dijkstra_desde,
+    elegir_paradas,
+    limite_paradas_candidatas,
+    reconstruir_camino,
+    respuesta_trayecto,
+    tramo_con_costos,
+)
+
+
+# Procesos usados cuando se pide cálculo en paralelo
+ROUTE_BATCH_WORKERS = int(os.getenv("ROUTE_BATCH_WORKERS", str(os.cpu_count() or 1)))
+# Pares origen/destino procesados por bloque (cada bloque hace un único snapping en SQL)
+ROUTE_BATCH_CHUNK_SIZE = int(os.getenv("ROUTE_BATCH_CHUNK_SIZE", "500"))
+
+
+def snap_paradas_lote(
+    db: Session,
+    puntos: List[Tuple[float, float]],
+    limite: int = 1
+) -> Dict[Tuple[float, float], List[Tuple[int, float]]]:
+    """
+    Encuentra hasta 'limite' paradas cercanas (dentro de MAX_DISTANCE_TO_STOP_METERS), ordenadas
+    por distancia, para muchos puntos (lat, lon) con una sola consulta.
+    Los puntos sin parada cercana no aparecen en el resultado.
+    """
+    if not puntos:
+        return {}
+
+    resultados = db.execute(
+        text("""
+            SELECT q.idx, p.id AS parada_id, p.distance_meters
+            FROM (
+                SELECT t.idx, CAST(ST_SetSRID(ST_MakePoint(t.lon, t.lat), 4326) AS geography) AS geog
+                FROM unnest(CAST(:idx AS integer[]), CAST(:lats AS double precision[]), CAST(:lons AS double precision[]))
+                    AS t(idx, lat, lon)
+            ) AS q
+            CROSS JOIN LATERAL (
+                SELECT parada.id, ST_Distance(CAST(parada.ubicacion AS geography), q.geog) AS distance_meters
+                FROM parada
+                WHERE ST_DWithin(CAST(parada.ubicacion AS geography), q.geog, :radio)
+                ORDER BY distance_meters
+                LIMIT :limite
+            ) AS p
+            ORDER BY q.idx, p.distance_meters
+        """),
+        {
+            "idx": list(range(len(puntos))),
+            "lats": [lat for lat, _ in puntos],
+            "lons": [lon for _, lon in puntos],
+            "radio": MAX_DISTANCE_TO_STOP_METERS,
+            "limite": limite,
+        },
+    ).all()
+
+    paradas: Dict[Tuple[float, float], List[Tuple[int, float]]] = defaultdict(list)
+    for r in resultados:
+        paradas[puntos[r.idx]].append((r.parada_id, r.distance_meters))
+    return paradas
+
+
+def _tramos_desde_origen(
+    snapshot: NetworkSnapshot,
+    origen_id: int,
+    destinos: List[int],
+    costos: Optional[Sequence[float]] = None
+) -> Dict[int, Optional[Dict]]:
+    """
+    Calcula los tramos en bus desde un origen hacia varios destinos compartiendo una sola búsqueda:
+    una lectura de la matriz por destino, o un único Dijkstra uno-a-todos.
+    Con 'costos' por arista (tráfico o histórico) siempre es Dijkstra: la matriz es de costos estáticos.
+    """
+    if costos is None and snapshot.route_matrix is not None:
+        tramos = {}
+        for destino_id in destinos:
+            resultado = snapshot.route_matrix.camino(snapshot.graph, origen_id, destino_id)
+            tramos[destino_id] = construir_tramo_bus(snapshot, resultado) if resultado else None
+        return tramos
+
+    if origen_id not in snapshot.graph:
+        return {destino_id: None for destino_id in destinos}
+
+    distances, predecessors = dijkstra_desde(snapshot.graph, {origen_id: 0}, costos=costos)
+    tramos = {}
+    for destino_id in destinos:
+        distancia = distances.get(destino_id, float('inf'))
+        if distancia == float('inf'):
+            tramos[destino_id] = None
+            continue
+        tramos[destino_id] = construir_tramo_bus(snapshot, {
+            "path_segments": reconstruir_camino(snapshot.graph, predecessors, origen_id, destino_id, costos),
+            "total_time_seconds": distancia,
+        })
+    return tramos
+
+
+# --- Procesos del pool: reciben el snapshot una sola vez ---
+
+_worker_snapshot: Optional[NetworkSnapshot] = None
+
+
+def _init_worker(snapshot: NetworkSnapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def _tramos_worker(tarea: Tuple[int, List[int], Optional[Sequence[float]]]) -> Tuple[int, Dict[int, Optional[Dict]]]:
+    origen_id, destinos, costos = tarea
+    return origen_id, _tramos_desde_origen(_worker_snapshot, origen_id, destinos, costos)
+
+
+class CalculadorLotes:
+    """
+    Calcula lotes de pares origen/destino sobre un mismo snapshot de la red, con la misma elección
+    de paradas, los mismos costos (ROUTING_COSTS e irregularidades) y las mismas claves de caché
+    que calcular_trayecto_usuario. Agrupa los pares por parada de origen para compartir la búsqueda
+    y, si se pide, reparte los grupos en un pool de procesos. Usar como context manager.
+    """
+    def __init__(self, snapshot: NetworkSnapshot, paralelo: bool = False):
+        self.snapshot = snapshot
+        self.executor: Optional[ProcessPoolExecutor] = None
+        if paralelo and ROUTE_BATCH_WORKERS > 1:
+            # "spawn" y no fork: el proceso del servidor tiene varios hilos (loop de eventos, pool de hilos)
+            self.executor = ProcessPoolExecutor(
+                max_workers=ROUTE_BATCH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(snapshot,),
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    def calcular(self, db: Session, pares: List[Tuple[int, Any]]) -> List[Dict]:
+        """
+        Recibe [(indice, par)] donde par es un dict con origen_lat, origen_lon, destino_lat y destino_lon.
+        Retorna un resultado por par: {"indice", "ruta"} o {"indice", "error"}.
+        """
+        resultados: Dict[int, Dict] = {}
+        validos: List[Tuple[int, CalculateRouteRequest]] = []
+        for indice, par in pares:
+            try:
+                validos.append((indice, CalculateRouteRequest(**par)))
+            except Exception as e:
+                resultados[indice] = {"indice": indice, "error": f"Par origen/destino inválido: {e}"}
+
+        # 1. Snapping de todos los puntos (sin repetir) en una sola consulta
+        puntos = set()
+        for _, req in validos:
+            puntos.add((req.origen_lat, req.origen_lon))
+            puntos.add((req.destino_lat, req.destino_lon))
+        paradas = snap_paradas_lote(db, list(puntos), limite_paradas_candidatas(self.snapshot))
+
+        # Costos del modo para todo el bloque (los de calcular_trayecto_usuario, con su versión en la caché)
+        costos, version_costos = costos_modo(self.snapshot)
+
+        # 2. Agrupar por parada de origen, resolviendo primero lo que ya está en caché
+        pendientes: Dict[int, List[Tuple[int, int, float, float]]] = defaultdict(list)
+        for indice, req in validos:
+            origen = paradas.get((req.origen_lat, req.origen_lon))
+            destino = paradas.get((req.destino_lat, req.destino_lon))
+            if not origen or not destino:
+                resultados[indice] = {"indice": indice, "error": "No hay paradas cercanas al origen o al destino."}
+                continue
+            seleccion = elegir_paradas(self.snapshot, origen, destino)
+            if seleccion is None:
+                resultados[indice] = {"indice": indice, "error": "No se pudo calcular una ruta para las ubicaciones proporcionadas."}
+                continue
+            origen_id, dist_origen, destino_id, dist_destino = seleccion
+            tramo_bus = route_result_cache.get((origen_id, destino_id, self.snapshot.version, version_costos))
+            if tramo_bus is not None:
+                tramo_bus = self._penalizado(origen_id, destino_id, tramo_bus, costos, version_costos)
+                resultados[indice] = self._resultado(indice, tramo_bus, dist_origen, dist_destino)
+            else:
+                pendientes[origen_id].append((indice, destino_id, dist_origen, dist_destino))
+
+        # 3. Una búsqueda por origen (en paralelo si hay pool)
+        tareas = [(origen_id, sorted({p[1] for p in grupo}), costos) for origen_id, grupo in pendientes.items()]
+        if self.executor and len(tareas) > 1:
+            tramos_por_origen = dict(self.executor.map(_tramos_worker, tareas))
+        else:
+            tramos_por_origen = {tarea[0]: _tramos_desde_origen(self.snapshot, *tarea) for tarea in tareas}
+
+        for origen_id, grupo in pendientes.items():
+            tramos = tramos_por_origen[origen_id]
+            for destino_id, tramo_bus in tramos.items():
+                if tramo_bus is not None:
+                    route_result_cache.put((origen_id, destino_id, self.snapshot.version, version_costos), tramo_bus)
+            for indice, destino_id, dist_origen, dist_destino in grupo:
+                tramo_bus = tramos.get(destino_id)
+                if tramo_bus is not None:
+                    tramo_bus = self._penalizado(origen_id, destino_id, tramo_bus, costos, version_costos)
+                resultados[indice] = self._resultado(indice, tramo_bus, dist_origen, dist_destino)
+
+        return [resultados[indice] for indice, _ in pares]
+
+    def _penalizado(self, origen_id: int, destino_id: int, tramo_bus: Dict, costos, version_costos) -> Optional[Dict]:
+        """Como _buscar_tramo_bus: solo un camino que toca aristas penalizadas se vuelve a buscar con las penalizaciones."""
+        if not irregularity_penalty_service.toca(self.snapshot, tramo_bus["edge_ids"]):
+            return tramo_bus
+        costos, version_costos = irregularity_penalty_service.aplicar(self.snapshot, costos, version_costos)
+        return tramo_con_costos(self.snapshot, origen_id, destino_id, costos, version_costos)
+
+    @staticmethod
+    def _resultado(indice: int, tramo_bus: Optional[Dict], dist_origen: float, dist_destino: float) -> Dict:
+        if tramo_bus is None:
+            return {"indice": indice, "error": "No se pudo calcular una ruta para las ubicaciones proporcionadas."}
+        respuesta = respuesta_trayecto(tramo_bus, dist_origen, dist_destino)
+        return {"indice": indice, "ruta": respuesta.model_dump()}
+
+
+def en_bloques(pares: Iterable[Any], tamano: int = ROUTE_BATCH_CHUNK_SIZE) -> Iterator[List[Tuple[int, Any]]]:
+    """Numera los pares y los agrupa en bloques de 'tamano' sin materializar toda la entrada."""
+    bloque: List[Tuple[int, Any]] = []
+    for indice, par in enumerate(pares):
+        bloque.append((indice, par))
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def a_ndjson(resultado: Dict) -> str:
+    return json.dumps(resultado, ensure_ascii=False) + "\n"
+
+
+async def bloques_ndjson(stream: AsyncIterable[bytes], tamano: int = ROUTE_BATCH_CHUNK_SIZE) -> AsyncIterator[List[Tuple[int, Any]]]:
+    """
+    Versión de en_bloques para un cuerpo NDJSON recibido por partes: una línea JSON por par.
+    Las líneas que no son JSON válido se entregan como None y se reportan como error en su resultado.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    indice = 0
+    bloque: List[Tuple[int, Any]] = []
+
+    def _parsear(linea: str) -> Any:
+        try:
+            return json.loads(linea)
+        except ValueError:
+            return None
+
+    async for chunk in stream:
+        buffer += decoder.decode(chunk)
+        *lineas, buffer = buffer.split("\n")
+        for linea in lineas:
+            if not linea.strip():
+                continue
+            bloque.append((indice, _parsear(linea)))
+            indice += 1
+            if len(bloque) >= tamano:
+                yield bloque
+                bloque = []
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer.strip():
+        bloque.append((indice, _parsear(buffer)))
+    if bloque:
+        yield bloque
@@ -0,0 +1,21 @@
+# app/services/route_cache.py
+
+import os
+
+from app.services.ttl_cache import TTLCache
+
+
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "2048"))
+ROUTE_CACHE_TTL_SECONDS = float(os.getenv("ROUTE_CACHE_TTL_SECONDS", "900")) # 15 minutos
+
+
+class RouteResultCache(TTLCache):
+    """
+    Caché LRU con expiración (TTL) para el tramo en bus de los trayectos calculados.
+    La clave es (parada_origen_id, parada_destino_id, version_red, version_costos); las caminatas
+    de cada petición se recalculan fuera de la caché.
+    """
+
+
+# Instancia global de la caché
+route_result_cache = RouteResultCache(ROUTE_CACHE_MAX_ENTRIES, ROUTE_CACHE_TTL_SECONDS)
@@ -4,14 +4,23 @@ from sqlalchemy.sql import alias
 # Importaciones necesarias para trabajar con geometrías en SQLAlchemy y PostGIS
 from geoalchemy2.functions import ST_MakePoint, ST_SetSRID, ST_Distance
 from geoalchemy2.types import Geography
-from geoalchemy2.shape import to_shape # Para convertir de Geometry a Shapely Point
 
-from app.models.entities import Ruta, Parada, RutaParada
+from app.models.entities import Parada, RutaParada
 # Importamos los modelos Pydantic necesarios para la nueva respuesta
 from app.models.models import SimplifiedCalculatedRouteResponse, SimplifiedParadaResponse # ASUMO que estos modelos existen aquí o se importarán
+from app.services.irregularity_penalties import irregularity_penalty_service
+from app.services.network_snapshot import NetworkSnapshot, network_snapshot_service
+from app.services.route_cache import route_result_cache
+from app.services.segment_stats import segment_stats_service
+from app.services.traffic_costs import ROUTING_COSTS, traffic_cost_service
 
-from typing import List, Dict, Optional, Tuple
+from shapely.geometry import Point
+from shapely.strtree import STRtree
+
+from typing import List, Dict, Optional, Sequence, Tuple
 import heapq # Para la cola de prioridad de Dijkstra
+import math
+import os
 from datetime import timedelta # Para manejar tiempos
 
 
@@ -27,6 +36,14 @@ TRANSFER_PENALTY_SECONDS = TRANSFER_PENALTY_MINUTES * 60 # Convertir a segundos
 
 MAX_DISTANCE_TO_STOP_METERS = 300 # Distancia máxima para considerar que una ubicación está cerca de una parada
 
+# Radio para enlazar paradas cercanas con aristas de caminata (transbordos a pie). 0 desactiva.
+WALKING_TRANSFER_RADIUS_METERS = float(os.getenv("WALKING_TRANSFER_RADIUS_METERS", "250"))
+
+RUTA_NOMBRE_CAMINATA = "A pie" # Nombre mostrado para las paradas a las que se llega caminando
+
+# Paradas candidatas por extremo (origen/destino) que se evalúan cuando se usa la matriz precalculada
+MATRIX_CANDIDATE_STOPS = int(os.getenv("MATRIX_CANDIDATE_STOPS", "3"))
+
 # --- La función _get_distance_between_points ya no es necesaria, se remueve ---
 
 
@@ -37,9 +54,8 @@ def _build_transport_graph(db: Session) -> Dict[int, List[Dict]]:
     """
     graph: Dict[int, List[Dict]] = {}
     
-    # 1. Traer todas las paradas y rutas para mapearlas en Python (para nombres y ubicaciones)
-    paradas = db.query(Parada).all()
-    paradas_map = {p.id: p for p in paradas}
+    # 1. Traer los ids de todas las paradas (nombres y coordenadas viven en el snapshot)
+    paradas_map = {p.id: p for p in db.query(Parada.id).all()}
     
     # 2. Obtener todos los segmentos de ruta con sus costos de distancia en una sola consulta
     #    Usamos una subconsulta con LEAD para obtener la siguiente parada en la misma ruta
@@ -62,6 +78,7 @@ def _build_transport_graph(db: Session) -> Dict[int, List[Dict]]:
         subquery_rp.c.ruta_id,
         subquery_rp.c.parada_id.label('from_parada_id'),
         subquery_rp.c.next_parada_id.label('to_parada_id'),
+        subquery_rp.c.orden,
         ST_Distance(
             cast(P1.c.ubicacion, Geography),
             cast(P2.c.ubicacion, Geography)
@@ -95,7 +112,9 @@ def _build_transport_graph(db: Session) -> Dict[int, List[Dict]]:
             "neighbor": to_parada_id,
             "cost": cost,
             "ruta_id": ruta_id,
-            "is_transfer": False # Esto se manejará en Dijkstra si hay cambio de ruta
+            "is_transfer": False, # Esto se manejará en Dijkstra si hay cambio de ruta
+            "distance_meters": distance_meters or 0, # Longitud del segmento (costos por tráfico)
+            "orden": seg.orden # Posición del segmento dentro de la ruta
         })
     
     # Asegurarse de que todas las paradas existan como nodos en el grafo, incluso si no tienen salidas directas
@@ -120,12 +139,70 @@ def _build_transport_graph(db: Session) -> Dict[int, List[Dict]]:
     return graph
 
 
-def _dijkstra(graph: Dict[int, List[Dict]], start_node: int, end_node: int) -> Optional[Dict]:
+def _agregar_transbordos_a_pie(
+    graph: Dict[int, List[Dict]],
+    paradas: Dict[int, Dict],
+    radio_metros: float = WALKING_TRANSFER_RADIUS_METERS
+) -> int:
     """
-    Implementación del algoritmo de Dijkstra para encontrar el camino más corto.
-    Retorna un diccionario con los segmentos del camino y el tiempo total,
-    o None si no hay camino.
-    Cada segmento: {"from_parada_id": X, "to_parada_id": Y, "ruta_id": Z, "is_transfer": False/True, "cost": segundos}
+    Añade aristas de caminata (ruta_id None) en ambos sentidos entre paradas a menos de 'radio_metros',
+    para que estaciones cercanas de rutas distintas queden conectadas.
+    Usa un STRtree sobre coordenadas proyectadas a metros en lugar de comparar todos los pares.
+    Retorna el número de aristas añadidas.
+    """
+    ids = [p_id for p_id, p in paradas.items() if p.get("latitude") is not None]
+    if radio_metros <= 0 or len(ids) < 2:
+        return 0
+
+    # Proyección equirectangular local: suficiente a escala de ciudad y mantiene el radio en metros
+    lat_ref = math.radians(sum(paradas[p_id]["latitude"] for p_id in ids) / len(ids))
+    puntos = [
+        Point(paradas[p_id]["longitude"] * 111320 * math.cos(lat_ref), paradas[p_id]["latitude"] * 111320)
+        for p_id in ids
+    ]
+    tree = STRtree(puntos)
+    pares_i, pares_j = tree.query(puntos, predicate="dwithin", distance=radio_metros)
+
+    agregadas = 0
+    for i, j in zip(pares_i.tolist(), pares_j.tolist()):
+        if i == j:
+            continue
+        distancia = puntos[i].distance(puntos[j])
+        graph.setdefault(ids[i], []).append({
+            "neighbor": ids[j],
+            "cost": max(distancia / WALKING_SPEED_MPS, 1), # Tiempo caminando en segundos
+            "ruta_id": None, # Sin ruta: tramo a pie
+            "is_transfer": True,
+            "distance_meters": distancia
+        })
+        graph.setdefault(ids[j], [])
+        agregadas += 1
+    return agregadas
+
+
+def dijkstra_desde(
+    graph: Dict[int, List[Dict]],
+    semillas: Dict[int, float],
+    end_node: Optional[int] = None,
+    limite_costo: Optional[float] = None,
+    costos: Optional[Sequence[float]] = None,
+    penalizacion_transbordo: float = TRANSFER_PENALTY_SECONDS
+) -> Tuple[Dict[int, float], Dict[int, Tuple[Optional[int], Optional[int]]]]:
+    """
+    Núcleo de Dijkstra con penalización de transbordo.
+    'semillas' son los nodos de partida con su costo inicial (p. ej. la caminata hasta cada parada).
+    Si se indica end_node la búsqueda se detiene al alcanzarlo; si se indica limite_costo no se
+    expanden nodos más allá de ese costo. Sin ninguno de los dos recorre todo el grafo.
+    'costos' (indexado por edge_id) reemplaza el costo fijo de las aristas, p. ej. costos por tráfico.
+    'penalizacion_transbordo' permite búsquedas que castigan más (o menos) los transbordos.
+    Retorna (distances, predecessors).
+
+    Guarda una sola etiqueta por parada (la de menor costo, con la ruta con que se llegó), así que
+    no es exacta con transbordos: si a una parada se llega apenas más caro por la ruta que sigue,
+    esa llegada se descarta y el camino paga un transbordo evitable. RouteContraction.buscar
+    ("contraccion") usa estados (parada, ruta) y es exacta, por lo que puede dar tiempos menores
+    (nunca mayores). La matriz, las isócronas y los lotes usan esta búsqueda (una etiqueta por
+    parada es lo que permite el árbol uno-a-todos). Ver tests/test_route_backends.py.
     """
     distances = {node: float('inf') for node in graph}
     
@@ -133,8 +210,12 @@ def _dijkstra(graph: Dict[int, List[Dict]], start_node: int, end_node: int) -> O
     predecessors: Dict[int, Tuple[Optional[int], Optional[int]]] = {node: (None, None) for node in graph}
     
     # Cola de prioridad: (costo_acumulado, nodo_actual, ruta_id_actual_del_pasajero)
-    priority_queue = [(0, start_node, None)] # costo, nodo_actual, ruta_id que trajo al nodo_actual
-    distances[start_node] = 0
+    priority_queue = [] # costo, nodo_actual, ruta_id que trajo al nodo_actual
+    for nodo, costo_inicial in semillas.items():
+        if nodo in distances and costo_inicial < distances[nodo]:
+            distances[nodo] = costo_inicial
+            priority_queue.append((costo_inicial, nodo, None))
+    heapq.heapify(priority_queue)
 
     while priority_queue:
         current_cost, current_node, current_passenger_route_id = heapq.heappop(priority_queue)
@@ -147,7 +228,7 @@ def _dijkstra(graph: Dict[int, List[Dict]], start_node: int, end_node: int) -> O
 
         for edge in graph.get(current_node, []):
             neighbor = edge["neighbor"]
-            edge_cost = edge["cost"]
+            edge_cost = edge["cost"] if costos is None else costos[edge["edge_id"]]
             edge_ruta_id = edge["ruta_id"] # La ruta de este segmento
 
             cost_to_neighbor = current_cost + edge_cost
@@ -157,7 +238,11 @@ def _dijkstra(graph: Dict[int, List[Dict]], start_node: int, end_node: int) -> O
             # y el segmento que va a tomar (edge_ruta_id) es diferente a su ruta actual,
             # aplicamos la penalización.
             if current_passenger_route_id is not None and edge_ruta_id != current_passenger_route_id:
-                cost_to_neighbor += TRANSFER_PENALTY_SECONDS
+                cost_to_neighbor += penalizacion_transbordo
+
+            # Fuera del presupuesto de tiempo (isócronas): no se expande
+            if limite_costo is not None and cost_to_neighbor > limite_costo:
+                continue
 
             # La condición para actualizar la distancia debe considerar el current_passenger_route_id
             # para evitar ciclos o caminos subóptimos cuando la ruta de un nodo cambia
@@ -168,11 +253,32 @@ def _dijkstra(graph: Dict[int, List[Dict]], start_node: int, end_node: int) -> O
                 predecessors[neighbor] = (current_node, edge_ruta_id)
                 heapq.heappush(priority_queue, (cost_to_neighbor, neighbor, edge_ruta_id))
 
-    if distances[end_node] == float('inf'):
-        return None # No se encontró un camino
+    return distances, predecessors
+
+
+def dijkstra_arbol(
+    graph: Dict[int, List[Dict]],
+    start_node: int,
+    end_node: Optional[int] = None
+) -> Tuple[Dict[int, float], Dict[int, Tuple[Optional[int], Optional[int]]]]:
+    """
+    Dijkstra desde una sola parada. Si se indica end_node la búsqueda se detiene al alcanzarlo;
+    si no, recorre todo el grafo (búsqueda uno-a-todos). Retorna (distances, predecessors).
+    """
+    return dijkstra_desde(graph, {start_node: 0}, end_node)
 
-    # Reconstruir el camino y sus detalles
-    path = []
+
+def reconstruir_camino(
+    graph: Dict[int, List[Dict]],
+    predecessors: Dict[int, Tuple[Optional[int], Optional[int]]],
+    start_node: int,
+    end_node: int,
+    costos: Optional[Sequence[float]] = None
+) -> List[Dict]:
+    """
+    Reconstruye los segmentos del camino start_node -> end_node a partir del árbol de predecesores.
+    Cada segmento: {"from_parada_id": X, "to_parada_id": Y, "ruta_id": Z, "is_transfer_point": bool, "cost_seconds": segundos}
+    """
     current = end_node
     # Mantener un registro de la ruta actual para el último segmento insertado
     # para detectar correctamente el transbordo al principio del siguiente.
@@ -182,7 +288,7 @@ def _dijkstra(graph: Dict[int, List[Dict]], start_node: int, end_node: int) -> O
     # Esto reconstruye el camino en orden inverso, luego se invierte al final
     temp_path_segments = []
     while current != start_node:
-        prev_node, segment_ruta_id = predecessors[current]
+        prev_node, segment_ruta_id = predecessors.get(current, (None, None))
         
         if prev_node is None: # Se llegó al nodo de inicio o hay un problema
             break
@@ -195,7 +301,7 @@ def _dijkstra(graph: Dict[int, List[Dict]], start_node: int, end_node: int) -> O
         actual_segment_cost = 0
         for edge in graph.get(prev_node, []):
             if edge["neighbor"] == current and edge["ruta_id"] == segment_ruta_id:
-                actual_segment_cost = edge["cost"]
+                actual_segment_cost = edge["cost"] if costos is None else costos[edge["edge_id"]]
                 break
 
         # Determinar si este segmento es el *resultado* de un transbordo (es decir, el viaje en bus empieza en una nueva ruta)
@@ -213,100 +319,70 @@ def _dijkstra(graph: Dict[int, List[Dict]], start_node: int, end_node: int) -> O
         last_segment_ruta_id = segment_ruta_id # Actualizar para la siguiente iteración
         current = prev_node
     
-    path = temp_path_segments[::-1] # Invertir para obtener el orden correcto
+    return temp_path_segments[::-1] # Invertir para obtener el orden correcto
+
+
+def _dijkstra(
+    graph: Dict[int, List[Dict]],
+    start_node: int,
+    end_node: int,
+    costos: Optional[Sequence[float]] = None
+) -> Optional[Dict]:
+    """
+    Implementación del algoritmo de Dijkstra para encontrar el camino más corto.
+    Retorna un diccionario con los segmentos del camino y el tiempo total,
+    o None si no hay camino.
+    """
+    distances, predecessors = dijkstra_desde(graph, {start_node: 0}, end_node, costos=costos)
+
+    if distances[end_node] == float('inf'):
+        return None # No se encontró un camino
+
+    path = reconstruir_camino(graph, predecessors, start_node, end_node, costos)
 
     total_time_seconds = distances[end_node]
     return {"path_segments": path, "total_time_seconds": total_time_seconds}
 
 
-# --- Función Principal de Cálculo de Trayecto ---
-
-async def calcular_trayecto_usuario( # Hacemos la función asíncrona
-    db: Session,
-    origen_lat: float,
-    origen_lon: float,
-    destino_lat: float,
-    destino_lon: float
-) -> Optional[SimplifiedCalculatedRouteResponse]: # Modificamos el tipo de retorno
+def _paradas_cercanas(db: Session, lat: float, lon: float, limite: int = 1) -> List[Tuple[int, float]]:
     """
-    Calcula el trayecto más eficiente (en tiempo) para el usuario
-    desde una ubicación de origen a una ubicación de destino,
-    priorizando rutas directas con penalización por transbordo,
-    y retorna la información en un formato simplificado.
+    Retorna hasta 'limite' paradas dentro de MAX_DISTANCE_TO_STOP_METERS de la ubicación dada,
+    ordenadas por distancia, como tuplas (parada_id, distancia_metros).
     """
-    
-    # 1. Identificar la parada de origen más cercana de forma eficiente
-    # Crear un punto GEOGRAPHY para el origen
-    origen_point_geo = cast(ST_SetSRID(ST_MakePoint(origen_lon, origen_lat), 4326), Geography)
-    
-    # Consulta optimizada para encontrar la parada más cercana dentro del radio MAX_DISTANCE_TO_STOP_METERS
-    parada_origen_cercana_result = db.query(
-        Parada,
-        ST_Distance(cast(Parada.ubicacion, Geography), origen_point_geo).label("distance_meters")
-    ).filter(
-        ST_Distance(cast(Parada.ubicacion, Geography), origen_point_geo) <= MAX_DISTANCE_TO_STOP_METERS
-    ).order_by(
-        "distance_meters"
-    ).first()
-
-    if not parada_origen_cercana_result:
-        # Retorna None, el endpoint manejara la HTTPException
-        return None 
-    
-    parada_origen_cercana, min_dist_origen = parada_origen_cercana_result
+    # Crear un punto GEOGRAPHY para la ubicación
+    point_geo = cast(ST_SetSRID(ST_MakePoint(lon, lat), 4326), Geography)
 
-    # 2. Identificar la parada de destino más cercana de forma eficiente
-    # Crear un punto GEOGRAPHY para el destino
-    destino_point_geo = cast(ST_SetSRID(ST_MakePoint(destino_lon, destino_lat), 4326), Geography)
-
-    # Consulta optimizada para encontrar la parada más cercana dentro del radio MAX_DISTANCE_TO_STOP_METERS
-    parada_destino_cercana_result = db.query(
-        Parada,
-        ST_Distance(cast(Parada.ubicacion, Geography), destino_point_geo).label("distance_meters")
+    # Consulta optimizada para encontrar las paradas más cercanas dentro del radio MAX_DISTANCE_TO_STOP_METERS
+    resultados = db.query(
+        Parada.id,
+        ST_Distance(cast(Parada.ubicacion, Geography), point_geo).label("distance_meters")
     ).filter(
-        ST_Distance(cast(Parada.ubicacion, Geography), destino_point_geo) <= MAX_DISTANCE_TO_STOP_METERS
+        ST_Distance(cast(Parada.ubicacion, Geography), point_geo) <= MAX_DISTANCE_TO_STOP_METERS
     ).order_by(
         "distance_meters"
-    ).first()
-    
-    if not parada_destino_cercana_result:
-        # Retorna None, el endpoint manejara la HTTPException
-        return None 
-    
-    parada_destino_cercana, min_dist_destino = parada_destino_cercana_result
+    ).limit(limite).all()
 
-    # 3. Construir el grafo de transporte
-    graph = _build_transport_graph(db)
+    return [(r.id, r.distance_meters) for r in resultados]
 
-    # Asegurarse de que las paradas de origen y destino existan en el grafo
-    if parada_origen_cercana.id not in graph or parada_destino_cercana.id not in graph:
-        # Esto indica un problema de datos o que las paradas no son parte de rutas conectadas
-        return None 
-
-    # 4. Ejecutar el algoritmo de Dijkstra
-    dijkstra_result = _dijkstra(graph, parada_origen_cercana.id, parada_destino_cercana.id)
 
-    if not dijkstra_result:
-        return None # No se encontró un camino viable en bus
+def _nombre_ruta(rutas_map: Dict[int, str], ruta_id: Optional[int]) -> str:
+    if ruta_id is None:
+        return RUTA_NOMBRE_CAMINATA # Tramo a pie entre paradas cercanas
+    return rutas_map.get(ruta_id, "N/A")
 
-    # 5. Calcular los componentes de la respuesta simplificada
-    
-    # Tiempo estimado total
-    total_bus_and_transfer_time_seconds = dijkstra_result["total_time_seconds"]
-
-    # Tiempos de caminata
-    time_walking_origin_seconds = min_dist_origen / WALKING_SPEED_MPS if WALKING_SPEED_MPS > 0 else 0
-    time_walking_destination_seconds = min_dist_destino / WALKING_SPEED_MPS if WALKING_SPEED_MPS > 0 else 0
-
-    total_estimated_time_seconds = total_bus_and_transfer_time_seconds + time_walking_origin_seconds + time_walking_destination_seconds
-    tiempo_estimado_minutos = round(total_estimated_time_seconds / 60, 2)
 
+def construir_tramo_bus(snapshot: NetworkSnapshot, dijkstra_result: Dict) -> Dict:
+    """
+    Convierte el resultado de la búsqueda en el tramo en bus de la respuesta:
+    tiempo de bus + transbordos y la lista de paradas del trayecto.
+    Solo depende del par de paradas y de la versión de la red, por eso es lo que se guarda en caché.
+    """
     # Lista de paradas del trayecto
     path_segments = dijkstra_result["path_segments"]
     
-    # Necesitamos cargar los nombres de las rutas y paradas
-    rutas_map = {r.id: r.nombre for r in db.query(Ruta).all()}
-    paradas_map = {p.id: p for p in db.query(Parada).all()} # Mapear por ID para acceso rápido
+    # Los nombres de rutas y paradas vienen del snapshot, sin consultas adicionales
+    rutas_map = snapshot.rutas
+    paradas_map = snapshot.paradas
     
     paradas_trayecto_data: List[SimplifiedParadaResponse] = []
     
@@ -319,10 +395,10 @@ async def calcular_trayecto_usuario( # Hacemos la función asíncrona
         if first_parada_obj:
             paradas_trayecto_data.append(
                 SimplifiedParadaResponse(
-                    nombre=first_parada_obj.nombre,
-                    ruta_nombre=rutas_map.get(first_bus_ruta_id, "N/A"), # La ruta asociada a esta parada en el trayecto
-                    longitude=to_shape(first_parada_obj.ubicacion).x,
-                    latitude=to_shape(first_parada_obj.ubicacion).y
+                    nombre=first_parada_obj["nombre"],
+                    ruta_nombre=_nombre_ruta(rutas_map, first_bus_ruta_id), # La ruta asociada a esta parada en el trayecto
+                    longitude=first_parada_obj["longitude"],
+                    latitude=first_parada_obj["latitude"]
                 )
             )
 
@@ -337,10 +413,10 @@ async def calcular_trayecto_usuario( # Hacemos la función asíncrona
             if current_parada_obj:
                 paradas_trayecto_data.append(
                     SimplifiedParadaResponse(
-                        nombre=current_parada_obj.nombre,
-                        ruta_nombre=rutas_map.get(current_ruta_id, "N/A"),
-                        longitude=to_shape(current_parada_obj.ubicacion).x,
-                        latitude=to_shape(current_parada_obj.ubicacion).y
+                        nombre=current_parada_obj["nombre"],
+                        ruta_nombre=_nombre_ruta(rutas_map, current_ruta_id),
+                        longitude=current_parada_obj["longitude"],
+                        latitude=current_parada_obj["latitude"]
                     )
                 )
 
@@ -353,13 +429,198 @@ async def calcular_trayecto_usuario( # Hacemos la función asíncrona
         if coords_tuple not in seen_coords:
             unique_paradas_tuples.append(parada)
             seen_coords.add(coords_tuple)
-    paradas_trayecto_data = unique_paradas_tuples
 
+    return {
+        "total_time_seconds": dijkstra_result["total_time_seconds"],
+        "paradas_trayecto": unique_paradas_tuples,
+        "edge_ids": _aristas_camino(snapshot.graph, path_segments), # Para saber si el camino toca aristas penalizadas
+    }
+
+
+def _aristas_camino(graph: Dict[int, List[Dict]], path_segments: List[Dict]) -> List[int]:
+    edge_ids = []
+    for segment in path_segments:
+        for edge in graph.get(segment["from_parada_id"], []):
+            if edge["neighbor"] == segment["to_parada_id"] and edge["ruta_id"] == segment["ruta_id"]:
+                edge_ids.append(edge["edge_id"])
+                break
+    return edge_ids
+
+
+def costos_modo(snapshot: NetworkSnapshot) -> Tuple[Optional[Sequence[float]], object]:
+    """
+    Arreglo de costos por edge_id según ROUTING_COSTS y su versión (para la clave de caché).
+    Con costos estáticos retorna (None, 0): las búsquedas usan edge["cost"].
+    """
+    if ROUTING_COSTS == "trafico":
+        return traffic_cost_service.costos(snapshot)
+    if ROUTING_COSTS == "historico":
+        return segment_stats_service.costos(snapshot)
+    return None, 0
+
+
+def _costos_vigentes(snapshot: NetworkSnapshot) -> Tuple[Optional[Sequence[float]], object]:
+    """
+    Costos del modo vigente más las penalizaciones por irregularidades reportadas. Sin aristas
+    penalizadas son los de costos_modo (con costos estáticos, (None, 0)).
+    """
+    costos, version_costos = costos_modo(snapshot)
+    return irregularity_penalty_service.aplicar(snapshot, costos, version_costos)
+
+
+def _buscar_tramo_bus(snapshot: NetworkSnapshot, parada_origen_id: int, parada_destino_id: int) -> Optional[Dict]:
+    """
+    Retorna el tramo en bus entre dos paradas, consultando primero la caché de resultados.
+    Se busca con los costos del modo (matriz o contracción si son estáticos); solo si ese camino
+    pasa por aristas penalizadas por irregularidades se repite la búsqueda con las penalizaciones.
+    Si no las toca sigue siendo el óptimo: las penalizaciones solo encarecen otros caminos.
+    """
+    costos, version_costos = costos_modo(snapshot)
+    tramo_bus = tramo_con_costos(snapshot, parada_origen_id, parada_destino_id, costos, version_costos)
+    if tramo_bus is not None and irregularity_penalty_service.toca(snapshot, tramo_bus["edge_ids"]):
+        costos, version_costos = irregularity_penalty_service.aplicar(snapshot, costos, version_costos)
+        tramo_bus = tramo_con_costos(snapshot, parada_origen_id, parada_destino_id, costos, version_costos)
+    return tramo_bus
+
+
+def tramo_con_costos(
+    snapshot: NetworkSnapshot,
+    parada_origen_id: int,
+    parada_destino_id: int,
+    costos: Optional[Sequence[float]],
+    version_costos
+) -> Optional[Dict]:
+    """
+    Tramo en bus con unos costos dados, desde la caché si ya se calculó. Con costos por arista
+    (tráfico, histórico o penalizaciones) se usa Dijkstra: la matriz y la contracción están
+    precalculadas con costos estáticos.
+    """
+    clave = (parada_origen_id, parada_destino_id, snapshot.version, version_costos)
+    tramo_bus = route_result_cache.get(clave)
+    if tramo_bus is not None:
+        return tramo_bus
+
+    if costos is not None:
+        if parada_origen_id not in snapshot.graph or parada_destino_id not in snapshot.graph:
+            return None
+        dijkstra_result = _dijkstra(snapshot.graph, parada_origen_id, parada_destino_id, costos)
+    elif snapshot.route_matrix is not None:
+        dijkstra_result = snapshot.route_matrix.camino(snapshot.graph, parada_origen_id, parada_destino_id)
+    elif snapshot.contraccion is not None:
+        dijkstra_result = snapshot.contraccion.buscar(parada_origen_id, parada_destino_id)
+    else:
+        # Asegurarse de que las paradas de origen y destino existan en el grafo
+        if parada_origen_id not in snapshot.graph or parada_destino_id not in snapshot.graph:
+            # Esto indica un problema de datos o que las paradas no son parte de rutas conectadas
+            return None 
+        dijkstra_result = _dijkstra(snapshot.graph, parada_origen_id, parada_destino_id)
+
+    if not dijkstra_result:
+        return None # No se encontró un camino viable en bus
+
+    tramo_bus = construir_tramo_bus(snapshot, dijkstra_result)
+    route_result_cache.put(clave, tramo_bus)
+    return tramo_bus
+
+
+def respuesta_trayecto(tramo_bus: Dict, min_dist_origen: float, min_dist_destino: float) -> SimplifiedCalculatedRouteResponse:
+    """
+    Completa el tramo en bus con las caminatas propias de cada petición.
+    """
+    # Tiempo estimado total
+    total_bus_and_transfer_time_seconds = tramo_bus["total_time_seconds"]
+
+    # Tiempos de caminata
+    time_walking_origin_seconds = min_dist_origen / WALKING_SPEED_MPS if WALKING_SPEED_MPS > 0 else 0
+    time_walking_destination_seconds = min_dist_destino / WALKING_SPEED_MPS if WALKING_SPEED_MPS > 0 else 0
+
+    total_estimated_time_seconds = total_bus_and_transfer_time_seconds + time_walking_origin_seconds + time_walking_destination_seconds
+    tiempo_estimado_minutos = round(total_estimated_time_seconds / 60, 2)
 
     # Retornar el resultado en el formato Pydantic simplificado
     return SimplifiedCalculatedRouteResponse(
         tiempo_estimado_minutos=tiempo_estimado_minutos,
         distancia_origen_primera_parada_metros=round(min_dist_origen, 2),
         distancia_ultima_parada_destino_metros=round(min_dist_destino, 2),
-        paradas_trayecto=paradas_trayecto_data
-    )
\ No newline at end of file
+        paradas_trayecto=tramo_bus["paradas_trayecto"]
+    )
+
+
+def limite_paradas_candidatas(snapshot: NetworkSnapshot) -> int:
+    """Paradas candidatas por extremo: varias con la matriz (cada par cuesta una lectura), si no la más cercana."""
+    return MATRIX_CANDIDATE_STOPS if snapshot.route_matrix is not None else 1
+
+
+def elegir_paradas(
+    snapshot: NetworkSnapshot,
+    candidatas_origen: List[Tuple[int, float]],
+    candidatas_destino: List[Tuple[int, float]]
+) -> Optional[Tuple[int, float, int, float]]:
+    """
+    Par de paradas (origen_id, distancia_origen, destino_id, distancia_destino) entre las candidatas
+    (ordenadas por distancia): con la matriz, el que minimiza caminata + bus; si no, las más cercanas.
+    """
+    if snapshot.route_matrix is not None:
+        return snapshot.route_matrix.mejor_par(candidatas_origen, candidatas_destino, WALKING_SPEED_MPS)
+    parada_origen_id, dist_origen = candidatas_origen[0]
+    parada_destino_id, dist_destino = candidatas_destino[0]
+    return parada_origen_id, dist_origen, parada_destino_id, dist_destino
+
+
+# --- Función Principal de Cálculo de Trayecto ---
+
+async def calcular_trayecto_usuario( # Hacemos la función asíncrona
+    db: Session,
+    origen_lat: float,
+    origen_lon: float,
+    destino_lat: float,
+    destino_lon: float,
+    alternativas: int = 1
+) -> Optional[SimplifiedCalculatedRouteResponse]: # Modificamos el tipo de retorno
+    """
+    Calcula el trayecto más eficiente (en tiempo) para el usuario
+    desde una ubicación de origen a una ubicación de destino,
+    priorizando rutas directas con penalización por transbordo,
+    y retorna la información en un formato simplificado.
+    Con alternativas > 1 se agregan hasta alternativas - 1 itinerarios distintos al principal.
+    """
+    # 1. Obtener el snapshot de la red (grafo, paradas y rutas ya cargados en memoria)
+    snapshot = network_snapshot_service.get(db)
+
+    # 2. Identificar las paradas de origen y destino más cercanas.
+    #    Con la matriz precalculada evaluamos varias candidatas por extremo, ya que cada par cuesta una lectura.
+    limite_candidatas = limite_paradas_candidatas(snapshot)
+
+    candidatas_origen = _paradas_cercanas(db, origen_lat, origen_lon, limite_candidatas)
+    if not candidatas_origen:
+        # Retorna None, el endpoint manejara la HTTPException
+        return None 
+
+    candidatas_destino = _paradas_cercanas(db, destino_lat, destino_lon, limite_candidatas)
+    if not candidatas_destino:
+        # Retorna None, el endpoint manejara la HTTPException
+        return None 
+
+    seleccion = elegir_paradas(snapshot, candidatas_origen, candidatas_destino)
+    if seleccion is None:
+        return None # No se encontró un camino viable en bus
+    parada_origen_id, min_dist_origen, parada_destino_id, min_dist_destino = seleccion
+
+    # 3. Buscar el tramo en bus (desde la caché si el par de paradas ya se calculó en esta versión de la red)
+    tramo_bus = _buscar_tramo_bus(snapshot, parada_origen_id, parada_destino_id)
+    if not tramo_bus:
+        return None # No se encontró un camino viable en bus
+
+    # 4. Añadir las caminatas de esta petición y armar la respuesta simplificada
+    respuesta = respuesta_trayecto(tramo_bus, min_dist_origen, min_dist_destino)
+
+    # 5. Itinerarios alternativos entre el mismo par de paradas (mismo snapshot y arreglos de costos)
+    if alternativas > 1:
+        # Import local para evitar el ciclo route_calculation -> route_alternatives
+        from app.services.route_alternatives import itinerarios_alternativos
+        costos, _ = _costos_vigentes(snapshot)
+        respuesta.alternativas = itinerarios_alternativos(
+            snapshot, parada_origen_id, parada_destino_id, min_dist_origen, min_dist_destino,
+            snapshot.costos_estaticos if costos is None else costos, alternativas - 1, tramo_bus["edge_ids"]
+        )
+    return respuesta
@@ -0,0 +1,88 @@
+# app/services/route_catalog.py
+
+import gzip
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+from fastapi import Request, Response, status
+from pydantic import TypeAdapter
+
+from app.models.models import RutaDetalleResponse
+from app.services.network_snapshot import NetworkSnapshot
+
+
+class CuerpoPrecomprimido:
+    """
+    Respuesta JSON serializada una sola vez, en claro y comprimida con gzip,
+    con un ETag fuerte por representación.
+    """
+    def __init__(self, cuerpo: bytes):
+        self.cuerpo = cuerpo
+        self.cuerpo_gzip = gzip.compress(cuerpo, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(cuerpo).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.etag_gzip = f'"{digest}-gzip"' # Otra codificación, otro ETag fuerte
+
+
+def etags_peticion(request: Request) -> List[str]:
+    """ETags de If-None-Match de la petición (lista vacía si no viene el encabezado)."""
+    valor = request.headers.get("if-none-match")
+    if not valor:
+        return []
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    return [etag.strip().removeprefix("W/") for etag in valor.split(",")]
+
+
+def respuesta_precomprimida(request: Request, entrada: CuerpoPrecomprimido) -> Response:
+    """
+    304 si el cliente ya tiene la versión vigente; si no, el cuerpo ya serializado
+    (gzip si el cliente lo acepta). El caso común es solo una comparación de hashes.
+    """
+    usar_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag = entrada.etag_gzip if usar_gzip else entrada.etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+    etags = etags_peticion(request)
+    if "*" in etags or entrada.etag in etags or entrada.etag_gzip in etags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if usar_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=entrada.cuerpo_gzip, media_type="application/json", headers=headers)
+    return Response(content=entrada.cuerpo, media_type="application/json", headers=headers)
+
+
+class RouteCatalog:
+    """Catálogo de rutas de una versión de la red, ya serializado (completo y por ruta)."""
+    def __init__(self, version: int, rutas: List[Dict]):
+        self.version = version
+        rutas_validadas = TypeAdapter(List[RutaDetalleResponse]).validate_python(rutas)
+        self.catalogo = CuerpoPrecomprimido(TypeAdapter(List[RutaDetalleResponse]).dump_json(rutas_validadas))
+        self.por_ruta: Dict[int, CuerpoPrecomprimido] = {
+            ruta.id: CuerpoPrecomprimido(ruta.model_dump_json().encode("utf-8")) for ruta in rutas_validadas
+        }
+
+
+class RouteCatalogService:
+    """
+    Construye el catálogo la primera vez que se pide para cada versión del snapshot.
+    Mientras la red no cambie, servir /rutas no consulta la base de datos ni serializa.
+    """
+    def __init__(self):
+        self._catalogo: Optional[RouteCatalog] = None
+        self._lock = threading.Lock()
+
+    def get(self, snapshot: NetworkSnapshot) -> RouteCatalog:
+        catalogo = self._catalogo
+        if catalogo is not None and catalogo.version == snapshot.version:
+            return catalogo
+        with self._lock:
+            if self._catalogo is None or self._catalogo.version != snapshot.version:
+                self._catalogo = RouteCatalog(snapshot.version, snapshot.catalogo_rutas)
+                print(f"Catálogo de rutas v{snapshot.version} serializado: {len(self._catalogo.por_ruta)} rutas, {len(self._catalogo.catalogo.cuerpo_gzip)} bytes comprimidos.")
+            return self._catalogo
+
+
+# Instancia global del servicio
+route_catalog_service = RouteCatalogService()
@@ -0,0 +1,246 @@
+# app/services/route_contraction.py
+
+import heapq
+import itertools
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.services.route_calculation import TRANSFER_PENALTY_SECONDS
+
+
+# Marca la "ruta de salida" del destino en la búsqueda hacia atrás (no hay arista siguiente)
+_FIN = "__fin__"
+
+
+def _penalizacion(ruta_llegada: Optional[int], ruta_salida) -> float:
+    """Misma regla que _dijkstra: hay transbordo si se venía en una ruta y se sale por otra distinta."""
+    if ruta_salida is _FIN or ruta_llegada is None or ruta_salida == ruta_llegada:
+        return 0
+    return TRANSFER_PENALTY_SECONDS
+
+
+class RouteContraction:
+    """
+    Grafo de paradas con las cadenas de grado 2 contraídas en atajos.
+    Una parada se contrae solo si tiene exactamente una arista de entrada y una de salida,
+    ambas de la misma ruta de bus: ahí no hay decisión posible ni transbordo, así que
+    reemplazar la cadena por un atajo conserva los costos y las penalizaciones.
+    Cada atajo guarda sus paradas intermedias para reconstruir el trayecto completo.
+    La búsqueda es exacta sobre estados (parada, ruta); _dijkstra guarda una etiqueta por parada,
+    así que con transbordos esta búsqueda puede dar tiempos menores, nunca mayores.
+    """
+    def __init__(self, graph: Dict[int, List[Dict]]):
+        self.graph = graph
+        self.atajos: List[Dict] = [] # {"nodos": [a, ..., z], "costos": [c1, ...], "ruta_id": r}
+        self.posicion: Dict[int, Tuple[int, int]] = {} # parada contraída -> (atajo_id, índice en "nodos")
+        self.adelante: Dict[int, List[Dict]] = {}
+        self.atras: Dict[int, List[Dict]] = {}
+        self._construir()
+
+    # --- Preprocesamiento ---
+
+    def _construir(self):
+        entradas: Dict[int, List[Tuple[int, Dict]]] = {node: [] for node in self.graph}
+        for origen, aristas in self.graph.items():
+            for arista in aristas:
+                entradas.setdefault(arista["neighbor"], []).append((origen, arista))
+
+        contraibles: Set[int] = set()
+        for node, aristas in self.graph.items():
+            llegadas = entradas.get(node, [])
+            if len(aristas) != 1 or len(llegadas) != 1:
+                continue
+            (previo, arista_in), arista_out = llegadas[0], aristas[0]
+            if arista_in["ruta_id"] is None or arista_in["ruta_id"] != arista_out["ruta_id"]:
+                continue
+            if previo == node or arista_out["neighbor"] == node or previo == arista_out["neighbor"]:
+                continue
+            contraibles.add(node)
+
+        cubiertos = self._cadenas(contraibles)
+        # Ciclos formados solo por paradas contraíbles no tienen extremo: se dejan sin contraer
+        sin_cubrir = contraibles - cubiertos
+        if sin_cubrir:
+            self._cadenas(contraibles - sin_cubrir)
+
+        for node in self.graph:
+            self.adelante.setdefault(node, [])
+            self.atras.setdefault(node, [])
+
+    def _cadenas(self, contraibles: Set[int]) -> Set[int]:
+        self.atajos, self.posicion = [], {}
+        self.adelante, self.atras = {}, {}
+        cubiertos: Set[int] = set()
+
+        for origen, aristas in self.graph.items():
+            if origen in contraibles:
+                continue
+            for arista in aristas:
+                nodos, costos = [origen, arista["neighbor"]], [arista["cost"]]
+                while nodos[-1] in contraibles:
+                    siguiente = self.graph[nodos[-1]][0]
+                    nodos.append(siguiente["neighbor"])
+                    costos.append(siguiente["cost"])
+
+                atajo_id = None
+                if len(nodos) > 2:
+                    atajo_id = len(self.atajos)
+                    self.atajos.append({"nodos": nodos, "costos": costos, "ruta_id": arista["ruta_id"]})
+                    for i, node in enumerate(nodos[1:-1], start=1):
+                        self.posicion[node] = (atajo_id, i)
+                        cubiertos.add(node)
+
+                destino = nodos[-1]
+                costo = sum(costos)
+                self.adelante.setdefault(origen, []).append(
+                    {"neighbor": destino, "cost": costo, "ruta_id": arista["ruta_id"], "atajo": atajo_id})
+                self.atras.setdefault(destino, []).append(
+                    {"neighbor": origen, "cost": costo, "ruta_id": arista["ruta_id"], "atajo": atajo_id})
+        return cubiertos
+
+    @property
+    def nodos_contraidos(self) -> int:
+        return len(self.posicion)
+
+    # --- Búsqueda bidireccional ---
+
+    def buscar(self, start_node: int, end_node: int) -> Optional[Dict]:
+        """
+        Búsqueda bidireccional sobre el grafo contraído. Los estados son (parada, ruta) para
+        respetar la penalización de transbordo: hacia adelante la ruta con la que se llega,
+        hacia atrás la ruta con la que se sale. Retorna el mismo formato que _dijkstra.
+        """
+        if start_node not in self.graph or end_node not in self.graph:
+            return None
+        if start_node == end_node:
+            return {"path_segments": [], "total_time_seconds": 0}
+
+        # Semillas: si el origen/destino está dentro de un atajo, se parte desde el extremo del atajo
+        # con el tramo parcial ya recorrido (prefijo/sufijo en paradas originales).
+        semillas_adelante: Dict[Tuple, Tuple[float, List]] = {(start_node, None): (0, [])}
+        semillas_atras: Dict[Tuple, Tuple[float, List]] = {(end_node, _FIN): (0, [])}
+
+        directo = None # Origen y destino dentro del mismo atajo, destino después del origen
+        if start_node in self.posicion:
+            atajo_id, i = self.posicion[start_node]
+            atajo = self.atajos[atajo_id]
+            tramo = self._tramo(atajo, i, len(atajo["nodos"]) - 1)
+            semillas_adelante = {(atajo["nodos"][-1], atajo["ruta_id"]): (sum(t[3] for t in tramo), tramo)}
+            if end_node in self.posicion and self.posicion[end_node][0] == atajo_id and self.posicion[end_node][1] > i:
+                directo = self._tramo(atajo, i, self.posicion[end_node][1])
+        if end_node in self.posicion:
+            atajo_id, j = self.posicion[end_node]
+            atajo = self.atajos[atajo_id]
+            tramo = self._tramo(atajo, 0, j)
+            semillas_atras = {(atajo["nodos"][0], atajo["ruta_id"]): (sum(t[3] for t in tramo), tramo)}
+
+        if directo is not None:
+            return self._resultado(directo, sum(t[3] for t in directo))
+
+        contador = itertools.count() # Desempate estable en los heaps
+        dist = [{}, {}] # 0: adelante, 1: atrás -> {(parada, ruta): costo}
+        pred = [{}, {}] # {(parada, ruta): (estado_previo, arista)}
+        por_parada = [{}, {}] # parada -> {ruta: costo}, para detectar encuentros
+        heaps = [[], []]
+        cerrados = [set(), set()]
+        mejor = [float('inf'), None, None] # costo, estado adelante, estado atrás
+
+        def _encuentro(lado: int, estado: Tuple, costo: float):
+            parada, ruta = estado
+            for ruta_otro, costo_otro in por_parada[1 - lado].get(parada, {}).items():
+                if lado == 0:
+                    total = costo + _penalizacion(ruta, ruta_otro) + costo_otro
+                    estados = (estado, (parada, ruta_otro))
+                else:
+                    total = costo_otro + _penalizacion(ruta_otro, ruta) + costo
+                    estados = ((parada, ruta_otro), estado)
+                if total < mejor[0]:
+                    mejor[:] = [total, estados[0], estados[1]]
+
+        def _etiquetar(lado: int, estado: Tuple, costo: float, previo, arista):
+            if costo >= dist[lado].get(estado, float('inf')):
+                return
+            dist[lado][estado] = costo
+            pred[lado][estado] = (previo, arista)
+            por_parada[lado].setdefault(estado[0], {})[estado[1]] = costo
+            heapq.heappush(heaps[lado], (costo, next(contador), estado))
+            _encuentro(lado, estado, costo)
+
+        for lado, semillas in ((0, semillas_adelante), (1, semillas_atras)):
+            for estado, (costo, tramo) in semillas.items():
+                _etiquetar(lado, estado, costo, None, tramo)
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= mejor[0]:
+                break
+            lado = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            costo, _, estado = heapq.heappop(heaps[lado])
+            if estado in cerrados[lado] or costo > dist[lado][estado]:
+                continue
+            cerrados[lado].add(estado)
+            parada, ruta = estado
+
+            if lado == 0:
+                for arista in self.adelante[parada]:
+                    nuevo = costo + arista["cost"] + _penalizacion(ruta, arista["ruta_id"])
+                    _etiquetar(0, (arista["neighbor"], arista["ruta_id"]), nuevo, estado, arista)
+            else:
+                for arista in self.atras[parada]:
+                    # Se llega a 'parada' por esta arista y se sale con 'ruta'
+                    nuevo = costo + arista["cost"] + _penalizacion(arista["ruta_id"], ruta)
+                    _etiquetar(1, (arista["neighbor"], arista["ruta_id"]), nuevo, estado, arista)
+
+        if mejor[1] is None:
+            return None
+
+        tramos = self._desenrollar(pred[0], mejor[1], adelante=True) + self._desenrollar(pred[1], mejor[2], adelante=False)
+        return self._resultado(tramos, mejor[0])
+
+    # --- Reconstrucción del trayecto en paradas originales ---
+
+    @staticmethod
+    def _tramo(atajo: Dict, desde: int, hasta: int) -> List[Tuple[int, int, Optional[int], float]]:
+        nodos, costos = atajo["nodos"], atajo["costos"]
+        return [(nodos[k], nodos[k + 1], atajo["ruta_id"], costos[k]) for k in range(desde, hasta)]
+
+    def _tramos_arista(self, origen: int, arista: Dict, destino: int) -> List[Tuple[int, int, Optional[int], float]]:
+        if arista["atajo"] is None:
+            return [(origen, destino, arista["ruta_id"], arista["cost"])]
+        atajo = self.atajos[arista["atajo"]]
+        return self._tramo(atajo, 0, len(atajo["nodos"]) - 1)
+
+    def _desenrollar(self, pred: Dict, estado: Tuple, adelante: bool) -> List[Tuple[int, int, Optional[int], float]]:
+        bloques = []
+        while estado is not None:
+            previo, arista = pred[estado]
+            if previo is None:
+                bloques.append(arista) # Tramo parcial de la semilla (puede estar vacío)
+                break
+            if adelante:
+                bloques.append(self._tramos_arista(previo[0], arista, estado[0]))
+            else:
+                bloques.append(self._tramos_arista(estado[0], arista, previo[0]))
+            estado = previo
+        if adelante:
+            bloques.reverse()
+        return [tramo for bloque in bloques for tramo in bloque]
+
+    @staticmethod
+    def _resultado(tramos: List[Tuple[int, int, Optional[int], float]], total: float) -> Dict:
+        path_segments = []
+        ruta_previa = None
+        for desde, hasta, ruta_id, costo in tramos:
+            path_segments.append({
+                "from_parada_id": desde,
+                "to_parada_id": hasta,
+                "ruta_id": ruta_id,
+                "is_transfer_point": ruta_previa is not None and ruta_id != ruta_previa,
+                "cost_seconds": costo
+            })
+            ruta_previa = ruta_id
+        return {"path_segments": path_segments, "total_time_seconds": total}
+
+
+def build_route_contraction(graph: Dict[int, List[Dict]]) -> RouteContraction:
+    contraccion = RouteContraction(graph)
+    print(f"Contracción de la red: {contraccion.nodos_contraidos} de {len(graph)} paradas contraídas en {len(contraccion.atajos)} atajos.")
+    return contraccion
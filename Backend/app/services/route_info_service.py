@@ -1,91 +1,59 @@
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session
 from typing import List, Dict, Optional
 
 from app.models.entities import Ruta, RutaParada, Parada
-from geoalchemy2.shape import to_shape 
+from app.services.coordenadas import columnas_lat_lon, ubicacion_dict
 
 
-def get_all_routes(db: Session) -> List[Dict]:
+def _rutas_con_paradas(db: Session, route_id: Optional[int] = None) -> List[Dict]:
     """
-    Obtiene todas las rutas de Transcaribe con sus detalles, incluyendo las paradas asociadas,
-    utilizando carga ansiosa para optimizar el rendimiento.
+    Rutas con sus paradas en orden, en una sola consulta plana.
+    Las coordenadas salen de PostGIS con ST_Y/ST_X, sin cargar ni decodificar la geometría.
     """
-    routes_data = []
-
-    # Elimina el .join(Ruta.paradas) porque joinedload ya se encarga de la unión
-    # y el ordenamiento de la tabla intermedia será en Python.
-    rutas = db.query(Ruta).options(
-        joinedload(Ruta.paradas).joinedload(RutaParada.parada)
-    ).order_by(Ruta.id).all() # <-- CAMBIO AQUI: Solo ordena por Ruta.id
-
-    for ruta in rutas:
-        paradas_en_ruta = []
-        # Aquí, las `ruta.paradas` ya están cargadas por `joinedload`.
-        # Las ordenamos en Python usando el atributo 'orden' de cada objeto RutaParada.
-        for rp in sorted(ruta.paradas, key=lambda x: x.orden):
-            parada = rp.parada # La parada ya está precargada a través de la relación.
-            if parada:
-                ubicacion_coords = None
-                if parada.ubicacion:
-                    point = to_shape(parada.ubicacion)
-                    ubicacion_coords = {"latitude": point.y, "longitude": point.x}
-
-                paradas_en_ruta.append({
-                    "id": parada.id,
-                    "nombre": parada.nombre,
-                    "codigo": str(parada.id),
-                    "ubicacion": ubicacion_coords,
-                    "orden_en_ruta": rp.orden
-                })
-        
-        routes_data.append({
-            "id": ruta.id,
-            "nombre": ruta.nombre,
-            "paradas": paradas_en_ruta
+    query = db.query(
+        Ruta.id.label("ruta_id"),
+        Ruta.nombre.label("ruta_nombre"),
+        RutaParada.orden,
+        Parada.id.label("parada_id"),
+        Parada.nombre.label("parada_nombre"),
+        *columnas_lat_lon(Parada.ubicacion),
+    ).outerjoin(
+        RutaParada, RutaParada.ruta_id == Ruta.id
+    ).outerjoin(
+        Parada, Parada.id == RutaParada.parada_id
+    )
+    if route_id is not None:
+        query = query.filter(Ruta.id == route_id)
+
+    routes_data: Dict[int, Dict] = {}
+    for fila in query.order_by(Ruta.id, RutaParada.orden).all():
+        ruta = routes_data.setdefault(fila.ruta_id, {
+            "id": fila.ruta_id,
+            "nombre": fila.ruta_nombre,
+            "paradas": []
+        })
+        if fila.parada_id is None: # Ruta sin paradas (outer join)
+            continue
+        ruta["paradas"].append({
+            "id": fila.parada_id,
+            "nombre": fila.parada_nombre,
+            "codigo": str(fila.parada_id),
+            "ubicacion": ubicacion_dict(fila.latitude, fila.longitude),
+            "orden_en_ruta": fila.orden
         })
-            
-    return routes_data
+    return list(routes_data.values())
 
 
-def get_route_by_id(db: Session, route_id: int) -> Optional[Dict]:
+def get_all_routes(db: Session) -> List[Dict]:
     """
-    Busca una ruta específica de Transcaribe por su ID y retorna sus detalles, incluyendo las paradas,
-    utilizando carga ansiosa para optimizar el rendimiento.
+    Obtiene todas las rutas de Transcaribe con sus detalles, incluyendo las paradas asociadas.
     """
-    ruta = (
-        db.query(Ruta)
-        .filter(Ruta.id == route_id)
-        .options(
-            joinedload(Ruta.paradas).joinedload(RutaParada.parada)
-        )
-        .first()
-    )
-
-    if not ruta:
-        return None
+    return _rutas_con_paradas(db)
 
-    paradas_en_ruta = []
-    # Aquí también ordenamos en Python.
-    for rp in sorted(ruta.paradas, key=lambda x: x.orden):
-        parada = rp.parada 
-        if parada:
-            ubicacion_coords = None
-            if parada.ubicacion:
-                point = to_shape(parada.ubicacion)
-                ubicacion_coords = {"latitude": point.y, "longitude": point.x}
 
-            paradas_en_ruta.append({
-                "id": parada.id,
-                "nombre": parada.nombre,
-                "codigo": str(parada.id),
-                "ubicacion": ubicacion_coords,
-                "orden_en_ruta": rp.orden
-            })
-    
-    route_data = {
-        "id": ruta.id,
-        "nombre": ruta.nombre,
-        "paradas": paradas_en_ruta
-    }
-        
-    return route_data
\ No newline at end of file
+def get_route_by_id(db: Session, route_id: int) -> Optional[Dict]:
+    """
+    Busca una ruta específica de Transcaribe por su ID y retorna sus detalles, incluyendo las paradas.
+    """
+    rutas = _rutas_con_paradas(db, route_id)
+    return rutas[0] if rutas else None
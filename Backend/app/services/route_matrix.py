@@ -0,0 +1,182 @@
+# app/services/route_matrix.py
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.route_calculation import dijkstra_arbol, reconstruir_camino
+
+
+# Procesos usados para construir la matriz (1 = construir en el proceso actual)
+ROUTE_MATRIX_WORKERS = int(os.getenv("ROUTE_MATRIX_WORKERS", str(os.cpu_count() or 1)))
+
+SIN_NODO = -1 # Marca de "sin predecesor" / "sin ruta" en los arreglos enteros
+
+
+class RouteMatrix:
+    """
+    Matriz precalculada parada-a-parada para la red completa.
+    - tiempos[i, j]: mejor tiempo en segundos (bus + penalizaciones), inf si no hay camino.
+    - transbordos[i, j]: número de transbordos del mejor camino, -1 si no hay camino.
+    - predecesor[i, j] / ruta_predecesor[i, j]: árbol de Dijkstra con origen i, usado para
+      desenrollar el camino. Se guarda el árbol por origen (y no un "siguiente salto" global)
+      porque la penalización de transbordo hace que los subcaminos óptimos dependan de la ruta
+      con la que se llega a cada parada.
+    """
+    def __init__(
+        self,
+        node_ids: List[int],
+        tiempos: np.ndarray,
+        transbordos: np.ndarray,
+        predecesor: np.ndarray,
+        ruta_predecesor: np.ndarray,
+    ):
+        self.node_ids = node_ids
+        self.node_index: Dict[int, int] = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.tiempos = tiempos
+        self.transbordos = transbordos
+        self.predecesor = predecesor
+        self.ruta_predecesor = ruta_predecesor
+
+    def tiempo(self, origen_id: int, destino_id: int) -> float:
+        i = self.node_index.get(origen_id)
+        j = self.node_index.get(destino_id)
+        if i is None or j is None:
+            return float('inf')
+        return float(self.tiempos[i, j])
+
+    def mejor_par(
+        self,
+        candidatas_origen: List[Tuple[int, float]],
+        candidatas_destino: List[Tuple[int, float]],
+        velocidad_caminata_mps: float,
+    ) -> Optional[Tuple[int, float, int, float]]:
+        """
+        Elige el par (parada origen, parada destino) que minimiza caminata + bus con
+        k_origen x k_destino lecturas de la matriz.
+        Retorna (origen_id, distancia_origen, destino_id, distancia_destino) o None.
+        """
+        origenes = [(self.node_index[p_id], dist) for p_id, dist in candidatas_origen if p_id in self.node_index]
+        destinos = [(self.node_index[p_id], dist) for p_id, dist in candidatas_destino if p_id in self.node_index]
+        if not origenes or not destinos:
+            return None
+
+        idx_o = np.array([i for i, _ in origenes])
+        idx_d = np.array([j for j, _ in destinos])
+        caminata_o = np.array([dist for _, dist in origenes]) / velocidad_caminata_mps
+        caminata_d = np.array([dist for _, dist in destinos]) / velocidad_caminata_mps
+
+        totales = self.tiempos[np.ix_(idx_o, idx_d)] + caminata_o[:, None] + caminata_d[None, :]
+        mejor = np.unravel_index(np.argmin(totales), totales.shape)
+        if not np.isfinite(totales[mejor]):
+            return None
+
+        (i, dist_o), (j, dist_d) = origenes[mejor[0]], destinos[mejor[1]]
+        return self.node_ids[i], dist_o, self.node_ids[j], dist_d
+
+    def camino(self, graph: Dict[int, List[Dict]], origen_id: int, destino_id: int) -> Optional[Dict]:
+        """
+        Desenrolla el camino origen -> destino desde el árbol precalculado.
+        Retorna el mismo formato que _dijkstra, o None si no hay camino.
+        """
+        i = self.node_index.get(origen_id)
+        j = self.node_index.get(destino_id)
+        if i is None or j is None or not np.isfinite(self.tiempos[i, j]):
+            return None
+
+        predecessors: Dict[int, Tuple[Optional[int], Optional[int]]] = {}
+        actual = j
+        while actual != i:
+            previo = int(self.predecesor[i, actual])
+            if previo == SIN_NODO:
+                break
+            ruta_id = int(self.ruta_predecesor[i, actual])
+            predecessors[self.node_ids[actual]] = (self.node_ids[previo], None if ruta_id == SIN_NODO else ruta_id)
+            actual = previo
+
+        return {
+            "path_segments": reconstruir_camino(graph, predecessors, origen_id, destino_id),
+            "total_time_seconds": float(self.tiempos[i, j]),
+        }
+
+
+# --- Construcción en paralelo ---
+# Cada proceso recibe el grafo una sola vez (initializer) y calcula filas completas de la matriz.
+
+_worker_graph: Optional[Dict[int, List[Dict]]] = None
+_worker_node_index: Optional[Dict[int, int]] = None
+
+
+def _init_worker(graph: Dict[int, List[Dict]], node_index: Dict[int, int]):
+    global _worker_graph, _worker_node_index
+    _worker_graph = graph
+    _worker_node_index = node_index
+
+
+def _fila_matriz(origen_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Ejecuta un Dijkstra uno-a-todos y lo empaqueta como una fila de la matriz."""
+    n = len(_worker_node_index)
+    tiempos = np.full(n, np.inf, dtype=np.float64)
+    transbordos = np.full(n, SIN_NODO, dtype=np.int16)
+    predecesor = np.full(n, SIN_NODO, dtype=np.int32)
+    ruta_predecesor = np.full(n, SIN_NODO, dtype=np.int32)
+
+    distances, predecessors = dijkstra_arbol(_worker_graph, origen_id)
+
+    # Recorrer los nodos alcanzados en orden de distancia garantiza que el predecesor
+    # ya tiene su número de transbordos calculado (todos los costos son > 0).
+    alcanzados = sorted((d, node) for node, d in distances.items() if d != float('inf'))
+    rutas_llegada: Dict[int, Optional[int]] = {origen_id: None}
+    for distancia, node in alcanzados:
+        j = _worker_node_index[node]
+        tiempos[j] = distancia
+        previo, ruta_id = predecessors[node]
+        if previo is None:
+            transbordos[j] = 0
+            continue
+        ruta_previa = rutas_llegada.get(previo)
+        cambio = 1 if ruta_previa is not None and ruta_id != ruta_previa else 0
+        transbordos[j] = transbordos[_worker_node_index[previo]] + cambio
+        rutas_llegada[node] = ruta_id
+        predecesor[j] = _worker_node_index[previo]
+        ruta_predecesor[j] = SIN_NODO if ruta_id is None else ruta_id
+
+    return tiempos, transbordos, predecesor, ruta_predecesor
+
+
+def build_route_matrix(graph: Dict[int, List[Dict]], node_ids: List[int]) -> RouteMatrix:
+    """
+    Construye la matriz completa ejecutando un Dijkstra uno-a-todos por parada,
+    repartido en un pool de procesos.
+    """
+    node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+    if ROUTE_MATRIX_WORKERS > 1 and len(node_ids) > 1:
+        chunksize = max(1, len(node_ids) // (ROUTE_MATRIX_WORKERS * 4))
+        # "spawn": el snapshot se reconstruye en un hilo de fondo mientras corren el loop de eventos
+        # y otros hilos; un fork podría heredar un lock tomado por alguno de ellos
+        with ProcessPoolExecutor(
+            max_workers=ROUTE_MATRIX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(graph, node_index),
+        ) as executor:
+            filas = list(executor.map(_fila_matriz, node_ids, chunksize=chunksize))
+    else:
+        _init_worker(graph, node_index)
+        filas = [_fila_matriz(node_id) for node_id in node_ids]
+
+    n = len(node_ids)
+    if filas:
+        tiempos, transbordos, predecesor, ruta_predecesor = (np.vstack(columna) for columna in zip(*filas))
+    else:
+        tiempos = np.empty((0, 0), dtype=np.float64)
+        transbordos = np.empty((0, 0), dtype=np.int16)
+        predecesor = np.empty((0, 0), dtype=np.int32)
+        ruta_predecesor = np.empty((0, 0), dtype=np.int32)
+
+    print(f"Matriz de rutas construida: {n}x{n} paradas con {ROUTE_MATRIX_WORKERS} procesos.")
+    return RouteMatrix(node_ids, tiempos, transbordos, predecesor, ruta_predecesor)
@@ -0,0 +1,337 @@
+# app/services/segment_stats.py
+
+import asyncio
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from shapely.geometry import Point
+from sqlalchemy import text, tuple_
+from sqlalchemy.orm import Session
+
+from app.models.entities import AggregationWatermark, SegmentTravelTimeStat
+from app.services.network_snapshot import NetworkSnapshot, network_snapshot_service
+from app.services.traffic_costs import _GeometriaRuta, _geometria_rutas
+
+
+# --- Configuración del trabajo de agregación ---
+SEGMENT_STATS_INTERVAL_SECONDS = float(os.getenv("SEGMENT_STATS_INTERVAL_SECONDS", "300"))
+SEGMENT_STATS_BATCH_SIZE = int(os.getenv("SEGMENT_STATS_BATCH_SIZE", "5000"))
+# Los ids se asignan al insertar pero se confirman después: la marca de agua no pasa de filas más
+# recientes que este margen, para no saltarse ids menores que aún no se habían confirmado
+SEGMENT_STATS_SAFETY_LAG_SECONDS = float(os.getenv("SEGMENT_STATS_SAFETY_LAG_SECONDS", "60"))
+SEGMENT_STATS_TZ = ZoneInfo(os.getenv("SEGMENT_STATS_TZ", "America/Bogota")) # Para la hora de la semana
+
+WATERMARK_NOMBRE = "segment_travel_times"
+HORAS_SEMANA = 7 * 24
+
+# Histograma de tiempos de viaje: intervalos de 30 s; el último acumula todo lo que pase de 30 min
+HISTOGRAMA_PASO_SEGUNDOS = 30
+HISTOGRAMA_INTERVALOS = 60
+
+RADIO_PASO_PARADA_METROS = 40 # Distancia a la que se considera que el usuario "pasó" por una parada
+MAX_TIEMPO_TRAYECTO_SEGUNDOS = 3600 # Entre dos pasos por parada; más que eso no es un viaje continuo
+
+ClaveSegmento = Tuple[int, int, int, int] # (ruta_id, from_parada_id, to_parada_id, hora_semana)
+
+
+def hora_semana(instante: datetime) -> int:
+    """0 = lunes 00h ... 167 = domingo 23h, en la zona horaria de la ciudad."""
+    if instante.tzinfo is None:
+        instante = instante.replace(tzinfo=timezone.utc)
+    local = instante.astimezone(SEGMENT_STATS_TZ)
+    return local.weekday() * 24 + local.hour
+
+
+def _percentil(histograma: np.ndarray, q: float) -> Optional[float]:
+    """Percentil interpolado linealmente dentro del intervalo del histograma."""
+    total = histograma.sum()
+    if total == 0:
+        return None
+    objetivo = q * total
+    acumulado = np.cumsum(histograma)
+    intervalo = int(np.searchsorted(acumulado, objetivo))
+    previo = acumulado[intervalo - 1] if intervalo > 0 else 0
+    fraccion = (objetivo - previo) / histograma[intervalo] if histograma[intervalo] else 0
+    return float((intervalo + fraccion) * HISTOGRAMA_PASO_SEGUNDOS)
+
+
+class SegmentStatsService:
+    """
+    Agrega incrementalmente user_location_history en tiempos de viaje por segmento y hora de la semana.
+    Los usuarios con sesión de seguimiento en una ruta son las trazas de los buses virtuales:
+    cada vez que un usuario pasa por dos paradas de su ruta se registra el tiempo entre ellas.
+    El trabajo solo lee filas con id mayor a su marca de agua y guarda los histogramas y la marca
+    en la misma transacción; la marca se detiene antes de la primera fila con menos de
+    SEGMENT_STATS_SAFETY_LAG_SECONDS de antigüedad. Los percentiles se mantienen también en arreglos (aristas x 168)
+    alineados con los edge_id del snapshot, para usarlos como costos de ruteo.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.is_running = False
+        self.processing_task: Optional[asyncio.Task] = None
+        self.db_provider: Optional[Callable[[], Session]] = None
+
+        self._version_red: Optional[int] = None
+        self.version = 0 # Cambia con cada lote que actualiza percentiles
+        self._geometria: Dict[int, _GeometriaRuta] = {}
+        self._cos_ref = 1.0
+        self._indice_aristas: Dict[Tuple[int, int, int], int] = {} # (ruta, desde, hasta) -> edge_id
+        self._costos_estaticos = np.zeros(0)
+        self.p50 = np.zeros((0, HORAS_SEMANA)) # NaN: sin datos para esa arista y hora
+        self.p90 = np.zeros((0, HORAS_SEMANA))
+        self._costos_hora: Tuple[Optional[Tuple], Optional[np.ndarray]] = (None, None)
+
+        # Último paso por parada de cada usuario: user_id -> (ruta_id, índice de parada en la ruta, instante)
+        self._pasos: Dict[int, Tuple[int, int, datetime]] = {}
+
+    # --- Ciclo de vida ---
+
+    def start(self, db_provider: Callable[[], Session]):
+        self.db_provider = db_provider
+        self.is_running = True
+        self.processing_task = asyncio.create_task(self._procesar_periodicamente())
+        print("SegmentStatsService iniciado.")
+
+    def stop(self):
+        self.is_running = False
+        if self.processing_task:
+            self.processing_task.cancel()
+        print("SegmentStatsService detenido.")
+
+    async def _procesar_periodicamente(self):
+        while self.is_running:
+            try:
+                procesadas = await asyncio.to_thread(self.procesar_pendientes)
+            except asyncio.CancelledError:
+                print("SegmentStatsService task cancelled.")
+                break
+            except Exception as e:
+                print(f"Error en el trabajo de estadísticas de segmentos: {e}")
+                import traceback
+                traceback.print_exc()
+                procesadas = 0
+            # Si el lote vino lleno todavía hay historial atrasado: se sigue sin esperar
+            if procesadas < SEGMENT_STATS_BATCH_SIZE:
+                await asyncio.sleep(SEGMENT_STATS_INTERVAL_SECONDS)
+
+    # --- Agregación ---
+
+    def procesar_pendientes(self) -> int:
+        """Procesa un lote de historial nuevo. Retorna cuántas filas de historial se leyeron."""
+        db: Session = next(self.db_provider())
+        try:
+            with self._lock:
+                return self._procesar_lote(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _procesar_lote(self, db: Session) -> int:
+        snapshot = network_snapshot_service.get(db)
+        self._preparar(db, snapshot)
+
+        marca = db.query(AggregationWatermark).filter_by(nombre=WATERMARK_NOMBRE).with_for_update().first()
+        if marca is None:
+            marca = AggregationWatermark(nombre=WATERMARK_NOMBRE, ultimo_id=0)
+            db.add(marca)
+        desde = marca.ultimo_id
+
+        # Rango del lote sobre la clave primaria: nunca se recorre la tabla completa.
+        # Termina antes de la primera fila reciente: transacciones más lentas aún pueden confirmar ids menores
+        rango = db.execute(
+            text("""
+                WITH t AS (
+                    SELECT id, timestamp FROM user_location_history WHERE id > :desde ORDER BY id LIMIT :lote
+                )
+                SELECT max(id) AS hasta, count(*) AS filas
+                FROM t
+                WHERE id < COALESCE(
+                    (SELECT min(id) FROM t WHERE timestamp >= now() - make_interval(secs => :retraso)),
+                    2147483647
+                )
+            """),
+            {"desde": desde, "lote": SEGMENT_STATS_BATCH_SIZE, "retraso": SEGMENT_STATS_SAFETY_LAG_SECONDS},
+        ).one()
+        if not rango.filas:
+            db.commit()
+            return 0
+
+        # Puntos del lote con la ruta de la sesión de seguimiento vigente en ese momento
+        filas = db.execute(
+            text("""
+                SELECT DISTINCT ON (h.id)
+                       h.id, h.user_id, h.timestamp, s.selected_route_id AS ruta_id,
+                       ST_Y(h.ubicacion) AS lat, ST_X(h.ubicacion) AS lon
+                FROM user_location_history AS h
+                JOIN user_tracking_sessions AS s
+                  ON s.user_id = h.user_id
+                 AND s.selected_route_id IS NOT NULL
+                 AND h.timestamp >= s.start_time
+                 AND (s.end_time IS NULL OR h.timestamp <= s.end_time)
+                WHERE h.id > :desde AND h.id <= :hasta
+                ORDER BY h.id, s.start_time DESC
+            """),
+            {"desde": desde, "hasta": rango.hasta},
+        ).all()
+        filas.sort(key=lambda f: (f.timestamp, f.id))
+
+        muestras = self._muestras(filas)
+        actualizadas = self._guardar(db, muestras)
+
+        marca.ultimo_id = rango.hasta
+        db.commit()
+
+        self._publicar(actualizadas)
+        print(f"Estadísticas de segmentos: {rango.filas} puntos procesados (hasta id {rango.hasta}), {len(actualizadas)} segmentos/hora actualizados.")
+        return rango.filas
+
+    def _muestras(self, filas: List) -> Dict[ClaveSegmento, List[float]]:
+        """Convierte los puntos en tiempos de viaje entre paradas consecutivas de cada ruta."""
+        muestras: Dict[ClaveSegmento, List[float]] = defaultdict(list)
+        for fila in filas:
+            geometria = self._geometria.get(fila.ruta_id)
+            if geometria is None or fila.timestamp is None:
+                continue
+            punto = Point(fila.lon * 111320 * self._cos_ref, fila.lat * 111320)
+            if geometria.linea.distance(punto) > RADIO_PASO_PARADA_METROS:
+                continue
+
+            # Parada de la ruta más cercana sobre la línea
+            recorrido = geometria.linea.project(punto)
+            j = int(np.searchsorted(geometria.acumulada, recorrido))
+            candidatas = [k for k in (j - 1, j) if 0 <= k < len(geometria.paradas)]
+            k = min(candidatas, key=lambda c: abs(geometria.acumulada[c] - recorrido))
+            if abs(geometria.acumulada[k] - recorrido) > RADIO_PASO_PARADA_METROS:
+                continue
+
+            previo = self._pasos.get(fila.user_id)
+            # Mientras siga en la misma parada se actualiza el instante: el viaje cuenta desde que sale
+            self._pasos[fila.user_id] = (fila.ruta_id, k, fila.timestamp)
+            if previo is None or previo[0] != fila.ruta_id or k <= previo[1]:
+                continue
+
+            i, instante_salida = previo[1], previo[2]
+            segundos = (fila.timestamp - instante_salida).total_seconds()
+            if segundos <= 0 or segundos > MAX_TIEMPO_TRAYECTO_SEGUNDOS:
+                continue
+
+            # Si entre dos puntos pasó por varias paradas, el tiempo se reparte según la longitud de cada segmento
+            longitudes = np.diff(geometria.acumulada[i:k + 1])
+            total = longitudes.sum()
+            hora = hora_semana(instante_salida)
+            for s, longitud in zip(range(i, k), longitudes.tolist()):
+                fraccion = longitud / total if total > 0 else 1 / (k - i)
+                clave = (fila.ruta_id, geometria.paradas[s], geometria.paradas[s + 1], hora)
+                muestras[clave].append(segundos * fraccion)
+        return muestras
+
+    def _guardar(self, db: Session, muestras: Dict[ClaveSegmento, List[float]]) -> List[Tuple[ClaveSegmento, Optional[float], Optional[float]]]:
+        """Suma las muestras a los histogramas guardados y recalcula sus percentiles."""
+        if not muestras:
+            return []
+
+        claves = list(muestras.keys())
+        existentes = {
+            (e.ruta_id, e.from_parada_id, e.to_parada_id, e.hora_semana): e
+            for e in db.query(SegmentTravelTimeStat).filter(
+                tuple_(
+                    SegmentTravelTimeStat.ruta_id,
+                    SegmentTravelTimeStat.from_parada_id,
+                    SegmentTravelTimeStat.to_parada_id,
+                    SegmentTravelTimeStat.hora_semana,
+                ).in_(claves)
+            ).with_for_update().all()
+        }
+
+        actualizadas = []
+        for clave, tiempos in muestras.items():
+            estadistica = existentes.get(clave)
+            if estadistica is None:
+                ruta_id, desde, hasta, hora = clave
+                estadistica = SegmentTravelTimeStat(ruta_id=ruta_id, from_parada_id=desde, to_parada_id=hasta, hora_semana=hora)
+                histograma = np.zeros(HISTOGRAMA_INTERVALOS, dtype=np.int64)
+            else:
+                histograma = np.array(estadistica.histograma, dtype=np.int64)
+
+            intervalos = np.minimum((np.array(tiempos) // HISTOGRAMA_PASO_SEGUNDOS).astype(np.int64), HISTOGRAMA_INTERVALOS - 1)
+            histograma += np.bincount(intervalos, minlength=HISTOGRAMA_INTERVALOS)
+
+            estadistica.histograma = histograma.tolist()
+            estadistica.muestras = int(histograma.sum())
+            estadistica.p50_segundos = _percentil(histograma, 0.5)
+            estadistica.p90_segundos = _percentil(histograma, 0.9)
+            db.add(estadistica)
+            actualizadas.append((clave, estadistica.p50_segundos, estadistica.p90_segundos))
+        return actualizadas
+
+    # --- Arreglos en memoria ---
+
+    def _preparar(self, db: Session, snapshot: NetworkSnapshot):
+        """Al cambiar la versión de la red se reindexan los arreglos y se cargan desde la tabla."""
+        if self._version_red == snapshot.version:
+            return
+        self._geometria, self._cos_ref = _geometria_rutas(snapshot)
+        self._indice_aristas = {
+            (edge["ruta_id"], node_id, edge["neighbor"]): edge["edge_id"]
+            for node_id, aristas in snapshot.graph.items()
+            for edge in aristas
+            if edge["ruta_id"] is not None
+        }
+        self._costos_estaticos = snapshot.costos_estaticos
+        p50 = np.full((len(snapshot.costos_estaticos), HORAS_SEMANA), np.nan)
+        p90 = np.full((len(snapshot.costos_estaticos), HORAS_SEMANA), np.nan)
+        for e in db.query(
+            SegmentTravelTimeStat.ruta_id,
+            SegmentTravelTimeStat.from_parada_id,
+            SegmentTravelTimeStat.to_parada_id,
+            SegmentTravelTimeStat.hora_semana,
+            SegmentTravelTimeStat.p50_segundos,
+            SegmentTravelTimeStat.p90_segundos,
+        ).all():
+            edge_id = self._indice_aristas.get((e.ruta_id, e.from_parada_id, e.to_parada_id))
+            if edge_id is not None and e.p50_segundos is not None:
+                p50[edge_id, e.hora_semana] = e.p50_segundos
+                p90[edge_id, e.hora_semana] = e.p90_segundos
+        self.p50, self.p90 = p50, p90
+        self._pasos = {}
+        self._version_red = snapshot.version
+        self.version += 1
+
+    def _publicar(self, actualizadas: List[Tuple[ClaveSegmento, Optional[float], Optional[float]]]):
+        if not actualizadas:
+            return
+        for (ruta_id, desde, hasta, hora), p50, p90 in actualizadas:
+            edge_id = self._indice_aristas.get((ruta_id, desde, hasta))
+            if edge_id is not None and p50 is not None:
+                self.p50[edge_id, hora] = p50
+                self.p90[edge_id, hora] = p90
+        self.version += 1
+
+    def costos(self, snapshot: NetworkSnapshot, instante: Optional[datetime] = None) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        Arreglo de costos por edge_id para la hora de la semana de 'instante' (ahora por defecto):
+        la mediana histórica donde hay datos y el costo estático en el resto.
+        Retorna (costos, versión) con la versión apta para claves de caché.
+        """
+        if self._version_red != snapshot.version:
+            return snapshot.costos_estaticos, (0, 0) # Aún no cargado para esta versión de la red
+        hora = hora_semana(instante or datetime.now(timezone.utc))
+        clave = (self.version, hora)
+        cache_clave, cache_costos = self._costos_hora
+        if cache_clave == clave:
+            return cache_costos, clave
+        columna = self.p50[:, hora]
+        costos = np.where(np.isnan(columna), self._costos_estaticos, np.maximum(columna, 1))
+        self._costos_hora = (clave, costos)
+        return costos, clave
+
+
+# Instancia global del servicio
+segment_stats_service = SegmentStatsService()
@@ -0,0 +1,69 @@
+# app/services/stop_index.py
+
+import math
+from typing import Dict, List
+
+from shapely import STRtree
+from shapely.geometry import Point
+
+from app.models.models import ParadaDetalleResponse, RutaEnParadaResponse
+from app.services.coordenadas import distancia_metros
+
+
+class StopIndex:
+    """
+    Índice espacial en memoria de las paradas que tienen al menos una ruta.
+    Cada parada guarda su respuesta ya armada (ParadaDetalleResponse con sus rutas), de modo que
+    /paradas/cercanas-con-rutas no consulta la base de datos: el STRtree (en metros, proyección
+    local) da los candidatos y la distancia haversine decide el radio exacto.
+    """
+    def __init__(self, paradas: Dict[int, Dict], catalogo_rutas: List[Dict]):
+        rutas_por_parada: Dict[int, List[RutaEnParadaResponse]] = {}
+        for ruta in catalogo_rutas:
+            for parada in ruta["paradas"]:
+                rutas = rutas_por_parada.setdefault(parada["id"], [])
+                if all(r.id != ruta["id"] for r in rutas): # Una ruta puede pasar dos veces por la parada
+                    rutas.append(RutaEnParadaResponse(id=ruta["id"], nombre=ruta["nombre"]))
+
+        self.ids: List[int] = [
+            p_id for p_id in rutas_por_parada
+            if p_id in paradas and paradas[p_id].get("latitude") is not None
+        ]
+        latitudes = [paradas[p_id]["latitude"] for p_id in self.ids]
+        self._cos_ref = math.cos(math.radians(sum(latitudes) / len(latitudes))) if latitudes else 1.0
+
+        self.respuestas: List[ParadaDetalleResponse] = [
+            ParadaDetalleResponse(
+                id=p_id,
+                nombre=paradas[p_id]["nombre"],
+                latitude=paradas[p_id]["latitude"],
+                longitude=paradas[p_id]["longitude"],
+                rutas=rutas_por_parada[p_id]
+            )
+            for p_id in self.ids
+        ]
+        self._tree = STRtree([self._proyectar(r.latitude, r.longitude) for r in self.respuestas])
+
+    def _proyectar(self, lat: float, lon: float) -> Point:
+        return Point(lon * 111320 * self._cos_ref, lat * 111320)
+
+    def cercanas(self, lat: float, lon: float, radio_metros: float) -> List[ParadaDetalleResponse]:
+        """Paradas (con sus rutas) a menos de 'radio_metros' del punto, de la más cercana a la más lejana."""
+        if not self.respuestas:
+            return []
+        # Margen del 1%: la proyección local no es exacta lejos de la latitud de referencia
+        candidatos = self._tree.query(self._proyectar(lat, lon), predicate="dwithin", distance=radio_metros * 1.01)
+        resultado = []
+        for i in candidatos.tolist():
+            respuesta = self.respuestas[i]
+            distancia = distancia_metros(lat, lon, respuesta.latitude, respuesta.longitude)
+            if distancia <= radio_metros:
+                resultado.append((distancia, respuesta))
+        resultado.sort(key=lambda par: par[0])
+        return [respuesta for _, respuesta in resultado]
+
+
+def build_stop_index(paradas: Dict[int, Dict], catalogo_rutas: List[Dict]) -> StopIndex:
+    stop_index = StopIndex(paradas, catalogo_rutas)
+    print(f"Índice de paradas construido: {len(stop_index.ids)} paradas con rutas.")
+    return stop_index
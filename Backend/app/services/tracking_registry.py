@@ -0,0 +1,84 @@
+# app/services/tracking_registry.py
+
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models.entities import UserTrackingSession
+
+
+@dataclass
+class SesionSeguimiento:
+    """Copia en memoria de una UserTrackingSession activa."""
+    session_id: int
+    user_id: int
+    selected_route_id: Optional[int]
+    reported_route_id: Optional[int]
+    is_on_bus: bool
+    assigned_bus_id: Optional[uuid.UUID]
+
+    @classmethod
+    def desde_entidad(cls, sesion: UserTrackingSession) -> "SesionSeguimiento":
+        return cls(
+            session_id=sesion.id,
+            user_id=sesion.user_id,
+            selected_route_id=sesion.selected_route_id,
+            reported_route_id=sesion.reported_route_id,
+            is_on_bus=bool(sesion.is_on_bus),
+            assigned_bus_id=sesion.assigned_bus_id,
+        )
+
+
+class TrackingRegistry:
+    """
+    Registro en memoria de las sesiones de seguimiento activas (usuario -> sesión, ruta, a bordo,
+    bus asignado). Se carga al iniciar y lo mantienen al día los endpoints de /api/tracking y el
+    clustering, así el WebSocket de ubicación y el clustering no consultan 'user_tracking_sessions'.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sesiones: Dict[int, SesionSeguimiento] = {}
+
+    def cargar(self, db: Session) -> int:
+        sesiones = db.query(UserTrackingSession).filter(UserTrackingSession.status == 'active').all()
+        with self._lock:
+            self._sesiones = {s.user_id: SesionSeguimiento.desde_entidad(s) for s in sesiones}
+            return len(self._sesiones)
+
+    def get(self, user_id: int) -> Optional[SesionSeguimiento]:
+        return self._sesiones.get(user_id)
+
+    def registrar(self, sesion: UserTrackingSession):
+        """Alta o actualización a partir de la entidad recién confirmada (commit)."""
+        with self._lock:
+            self._sesiones[sesion.user_id] = SesionSeguimiento.desde_entidad(sesion)
+
+    def quitar(self, user_id: int):
+        with self._lock:
+            self._sesiones.pop(user_id, None)
+
+    def asignar_bus(self, user_id: int, bus_id: Optional[uuid.UUID]):
+        with self._lock:
+            sesion = self._sesiones.get(user_id)
+            if sesion is not None:
+                sesion.assigned_bus_id = bus_id
+
+    def bajar_del_bus(self, user_id: int):
+        with self._lock:
+            sesion = self._sesiones.get(user_id)
+            if sesion is not None:
+                sesion.is_on_bus = False
+                sesion.assigned_bus_id = None
+
+    def tiene_pasajeros(self, bus_id: uuid.UUID) -> bool:
+        return any(s.is_on_bus and s.assigned_bus_id == bus_id for s in list(self._sesiones.values()))
+
+    def a_bordo(self) -> List[SesionSeguimiento]:
+        return [s for s in list(self._sesiones.values()) if s.is_on_bus]
+
+
+# Instancia global del registro
+tracking_registry = TrackingRegistry()
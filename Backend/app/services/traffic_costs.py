@@ -0,0 +1,187 @@
+# app/services/traffic_costs.py
+
+import math
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from shapely.geometry import LineString, Point
+
+from app.services.network_snapshot import NetworkSnapshot
+
+
+# Costos de las aristas en calculate_route: "estaticos" (velocidad fija), "trafico" (velocidades observadas)
+# o "historico" (mediana por hora de la semana, ver segment_stats)
+ROUTING_COSTS = os.getenv("ROUTING_COSTS", "estaticos")
+
+TRAFFIC_EWMA_ALPHA = float(os.getenv("TRAFFIC_EWMA_ALPHA", "0.3")) # Peso de la observación más reciente
+TRAFFIC_STALE_SECONDS = float(os.getenv("TRAFFIC_STALE_SECONDS", "900")) # Sin observaciones: vuelve al costo estático
+
+# Límites para descartar observaciones poco confiables
+MIN_INTERVALO_SEGUNDOS = 2
+MAX_INTERVALO_SEGUNDOS = 120
+MIN_VELOCIDAD_MPS = 1.0 # Un bus detenido encarece el tramo, pero sin costos infinitos
+MAX_VELOCIDAD_MPS = 25.0 # ~90 km/h: por encima es ruido del GPS
+
+# Posición de un bus en un tick: (ruta_id, lat, lon, instante en segundos)
+PosicionBus = Tuple[int, float, float, float]
+
+
+class _GeometriaRuta:
+    """
+    Línea de la ruta (en metros) con sus paradas en orden y la distancia acumulada hasta cada una.
+    El segmento i va de paradas[i] a paradas[i + 1] y corresponde a la arista edge_ids[i].
+    """
+    def __init__(self, linea: LineString, acumulada: np.ndarray, edge_ids: np.ndarray, paradas: List[int]):
+        self.linea = linea
+        self.acumulada = acumulada
+        self.edge_ids = edge_ids
+        self.paradas = paradas
+
+    def segmento(self, recorrido: float) -> int:
+        indice = int(np.searchsorted(self.acumulada, recorrido, side="right")) - 1
+        return min(max(indice, 0), len(self.edge_ids) - 1)
+
+
+def _geometria_rutas(snapshot: NetworkSnapshot) -> Tuple[Dict[int, _GeometriaRuta], float]:
+    """Arma la línea de cada ruta a partir de sus segmentos parada -> parada, en orden."""
+    segmentos: Dict[int, List[Tuple[int, int, int, int]]] = defaultdict(list)
+    for node_id, aristas in snapshot.graph.items():
+        for edge in aristas:
+            if edge["ruta_id"] is not None:
+                segmentos[edge["ruta_id"]].append((edge.get("orden", 0), node_id, edge["neighbor"], edge["edge_id"]))
+
+    latitudes = [p["latitude"] for p in snapshot.paradas.values() if p.get("latitude") is not None]
+    cos_ref = math.cos(math.radians(sum(latitudes) / len(latitudes))) if latitudes else 1.0
+
+    def _metros(parada_id: int) -> Optional[Tuple[float, float]]:
+        parada = snapshot.paradas.get(parada_id)
+        if not parada or parada.get("latitude") is None:
+            return None
+        return parada["longitude"] * 111320 * cos_ref, parada["latitude"] * 111320
+
+    geometria: Dict[int, _GeometriaRuta] = {}
+    for ruta_id, tramos in segmentos.items():
+        tramos.sort()
+        puntos, acumulada, edge_ids, paradas = [], [0.0], [], []
+        for _, desde, hasta, edge_id in tramos:
+            p_desde, p_hasta = _metros(desde), _metros(hasta)
+            if p_desde is None or p_hasta is None:
+                break
+            if not puntos:
+                puntos.append(p_desde)
+                paradas.append(desde)
+            puntos.append(p_hasta)
+            paradas.append(hasta)
+            acumulada.append(acumulada[-1] + math.dist(p_desde, p_hasta))
+            edge_ids.append(edge_id)
+        if len(puntos) >= 2:
+            geometria[ruta_id] = _GeometriaRuta(LineString(puntos), np.array(acumulada), np.array(edge_ids), paradas)
+    return geometria, cos_ref
+
+
+class TrafficCostService:
+    """
+    Costos de las aristas a partir de las velocidades observadas de los buses virtuales.
+    Mantiene, alineados con los edge_id del snapshot, un promedio móvil exponencial de la
+    velocidad por segmento y el arreglo de costos resultante. Cada tick del clustering solo
+    recalcula las aristas observadas (o vencidas) y publica un arreglo nuevo, así las búsquedas
+    en curso siguen leyendo el anterior sin bloqueos.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version_red: Optional[int] = None
+        self.version = 0 # Cambia cada vez que se publica un arreglo de costos distinto
+
+        self._costos_estaticos = np.zeros(0)
+        self._longitudes = np.zeros(0)
+        self._costos = np.zeros(0)
+        self._velocidades = np.zeros(0) # NaN: sin observaciones recientes
+        self._observado_en = np.zeros(0)
+
+        self._geometria: Dict[int, _GeometriaRuta] = {}
+        self._cos_ref = 1.0
+        self._buses: Dict[uuid.UUID, Tuple[int, float, float]] = {} # bus_id -> (ruta_id, recorrido_m, instante)
+
+    def _preparar(self, snapshot: NetworkSnapshot):
+        """Reinicia el estado cuando cambia la versión de la red (los edge_id ya no coinciden)."""
+        if self._version_red == snapshot.version:
+            return
+        self._costos_estaticos = snapshot.costos_estaticos
+        self._longitudes = snapshot.longitudes
+        self._costos = snapshot.costos_estaticos.copy()
+        self._velocidades = np.full(len(self._costos), np.nan)
+        self._observado_en = np.zeros(len(self._costos))
+        self._geometria, self._cos_ref = _geometria_rutas(snapshot)
+        self._buses = {}
+        self._version_red = snapshot.version
+        self.version += 1
+
+    def costos(self, snapshot: NetworkSnapshot) -> Tuple[np.ndarray, int]:
+        """Retorna (arreglo de costos por edge_id, versión) vigente para el snapshot."""
+        with self._lock:
+            self._preparar(snapshot)
+            return self._costos, self.version
+
+    def registrar_tick(self, snapshot: NetworkSnapshot, posiciones: Dict[uuid.UUID, PosicionBus]) -> int:
+        """
+        Incorpora las posiciones de los buses de un tick. El avance de cada bus sobre su ruta
+        desde el tick anterior da una velocidad que se atribuye a los segmentos recorridos.
+        Retorna el número de aristas cuyo costo cambió.
+        """
+        with self._lock:
+            self._preparar(snapshot)
+            ahora = time.time()
+            observaciones: Dict[int, List[float]] = defaultdict(list)
+
+            for bus_id, (ruta_id, lat, lon, instante) in posiciones.items():
+                geometria = self._geometria.get(ruta_id)
+                if geometria is None:
+                    continue
+                recorrido = geometria.linea.project(Point(lon * 111320 * self._cos_ref, lat * 111320))
+                previo = self._buses.get(bus_id)
+                self._buses[bus_id] = (ruta_id, recorrido, instante)
+                if previo is None or previo[0] != ruta_id:
+                    continue
+
+                intervalo = instante - previo[2]
+                avance = recorrido - previo[1]
+                if not (MIN_INTERVALO_SEGUNDOS <= intervalo <= MAX_INTERVALO_SEGUNDOS) or avance < 0:
+                    continue # Tick muy corto/largo o bus "retrocediendo" (ruido del GPS)
+                velocidad = min(max(avance / intervalo, MIN_VELOCIDAD_MPS), MAX_VELOCIDAD_MPS)
+                desde, hasta = geometria.segmento(previo[1]), geometria.segmento(recorrido)
+                for edge_id in geometria.edge_ids[desde:hasta + 1].tolist():
+                    observaciones[edge_id].append(velocidad)
+
+            # Buses que dejaron de reportar
+            self._buses = {b: e for b, e in self._buses.items() if ahora - e[2] <= TRAFFIC_STALE_SECONDS}
+
+            tocadas = np.fromiter(observaciones.keys(), dtype=np.int64, count=len(observaciones))
+            if tocadas.size:
+                medias = np.array([sum(v) / len(v) for v in observaciones.values()])
+                previas = self._velocidades[tocadas]
+                self._velocidades[tocadas] = np.where(
+                    np.isnan(previas), medias, TRAFFIC_EWMA_ALPHA * medias + (1 - TRAFFIC_EWMA_ALPHA) * previas
+                )
+                self._observado_en[tocadas] = ahora
+
+            vencidas = np.flatnonzero(~np.isnan(self._velocidades) & (self._observado_en < ahora - TRAFFIC_STALE_SECONDS))
+            self._velocidades[vencidas] = np.nan
+
+            if not tocadas.size and not vencidas.size:
+                return 0
+
+            costos = self._costos.copy()
+            costos[tocadas] = np.maximum(self._longitudes[tocadas] / self._velocidades[tocadas], 1)
+            costos[vencidas] = self._costos_estaticos[vencidas]
+            self._costos = costos
+            self.version += 1
+            return int(tocadas.size + vencidas.size)
+
+
+# Instancia global del servicio
+traffic_cost_service = TrafficCostService()
@@ -0,0 +1,163 @@
+# app/services/vector_tiles.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+MVT_EXTENT = 4096 # Resolución interna de la tesela (estándar de Mapbox Vector Tiles)
+MVT_BUFFER = 64 # Margen para que los símbolos en el borde no se corten entre teselas
+MAX_ZOOM = 22
+ZOOM_MIN_PARADAS = int(os.getenv("VECTOR_TILE_MIN_ZOOM_PARADAS", "12")) # Por debajo solo se dibujan las rutas
+
+VECTOR_TILE_CACHE_SIZE = int(os.getenv("VECTOR_TILE_CACHE_SIZE", "4096")) # Teselas estáticas en memoria
+VECTOR_TILE_DYNAMIC_TTL = float(os.getenv("VECTOR_TILE_DYNAMIC_TTL", "5")) # Segundos, igual al ciclo del clustering
+
+METROS_POR_PIXEL_Z0 = 40075016.68 / 256 # Ancho del mundo en EPSG:3857 / tamaño de tesela
+
+# Capas estáticas: paradas y trazado de las rutas (la línea une las paradas en su orden).
+# Cada capa es un ST_AsMVT independiente; concatenar los bytes de varias capas da una tesela válida.
+SQL_CAPAS_ESTATICAS = text("""
+    WITH limites AS (
+        SELECT ST_TileEnvelope(:z, :x, :y) AS env,
+               ST_Transform(ST_TileEnvelope(:z, :x, :y, margin => :margen), 4326) AS env_4326
+    )
+    SELECT
+        COALESCE((
+            SELECT ST_AsMVT(t, 'ruta', :extent, 'geom')
+            FROM (
+                SELECT r.id, r.nombre,
+                       ST_AsMVTGeom(ST_Simplify(ST_Transform(r.linea, 3857), :tolerancia), l.env, :extent, :buffer, true) AS geom
+                FROM (
+                    SELECT ruta.id, ruta.nombre, ST_MakeLine(parada.ubicacion ORDER BY ruta_parada.orden) AS linea
+                    FROM ruta
+                    JOIN ruta_parada ON ruta_parada.ruta_id = ruta.id
+                    JOIN parada ON parada.id = ruta_parada.parada_id
+                    GROUP BY ruta.id, ruta.nombre
+                ) AS r, limites AS l
+                WHERE r.linea && l.env_4326
+            ) AS t
+            WHERE t.geom IS NOT NULL
+        ), ''::bytea)
+        ||
+        COALESCE((
+            SELECT ST_AsMVT(t, 'parada', :extent, 'geom')
+            FROM (
+                SELECT parada.id, parada.nombre,
+                       ST_AsMVTGeom(ST_Transform(parada.ubicacion, 3857), l.env, :extent, :buffer, true) AS geom
+                FROM parada, limites AS l
+                WHERE :z >= :zoom_min_paradas AND parada.ubicacion && l.env_4326
+            ) AS t
+            WHERE t.geom IS NOT NULL
+        ), ''::bytea)
+        AS tesela
+""")
+
+# Capas dinámicas: buses virtuales activos e irregularidades activas
+SQL_CAPAS_DINAMICAS = text("""
+    WITH limites AS (
+        SELECT ST_TileEnvelope(:z, :x, :y) AS env,
+               ST_Transform(ST_TileEnvelope(:z, :x, :y, margin => :margen), 4326) AS env_4326
+    )
+    SELECT
+        COALESCE((
+            SELECT ST_AsMVT(t, 'bus', :extent, 'geom')
+            FROM (
+                SELECT CAST(virtual_buses.id AS text) AS id, virtual_buses.route_id,
+                       virtual_buses.current_speed, virtual_buses.current_heading,
+                       ST_AsMVTGeom(ST_Transform(virtual_buses.ubicacion, 3857), l.env, :extent, :buffer, true) AS geom
+                FROM virtual_buses, limites AS l
+                WHERE virtual_buses.status = 'active' AND virtual_buses.ubicacion && l.env_4326
+            ) AS t
+            WHERE t.geom IS NOT NULL
+        ), ''::bytea)
+        ||
+        COALESCE((
+            SELECT ST_AsMVT(t, 'irregularidad', :extent, 'geom')
+            FROM (
+                SELECT reported_irregularities.id, reported_irregularities.titulo,
+                       reported_irregularities.likes, reported_irregularities.dislikes,
+                       ST_AsMVTGeom(ST_Transform(reported_irregularities.ubicacion, 3857), l.env, :extent, :buffer, true) AS geom
+                FROM reported_irregularities, limites AS l
+                WHERE reported_irregularities.activa AND reported_irregularities.ubicacion && l.env_4326
+            ) AS t
+            WHERE t.geom IS NOT NULL
+        ), ''::bytea)
+        AS tesela
+""")
+
+Tesela = Tuple[int, int, int] # (z, x, y)
+
+
+def tesela_valida(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _parametros(z: int, x: int, y: int) -> Dict:
+    return {
+        "z": z, "x": x, "y": y,
+        "extent": MVT_EXTENT,
+        "buffer": MVT_BUFFER,
+        "margen": MVT_BUFFER / MVT_EXTENT,
+        "tolerancia": METROS_POR_PIXEL_Z0 / 2 ** z, # Un píxel del zoom: lo menor se simplifica
+        "zoom_min_paradas": ZOOM_MIN_PARADAS,
+    }
+
+
+class VectorTileService:
+    """
+    Teselas vectoriales (MVT) generadas por PostGIS. Las capas estáticas (rutas y paradas) se
+    generan una vez por tesela y versión de la red, en una caché LRU; las dinámicas (buses e
+    irregularidades) se regeneran como mucho una vez por tick del clustering y tesela.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._estaticas: "OrderedDict[Tuple[int, Tesela], bytes]" = OrderedDict() # (versión red, tesela) -> bytes
+        self._dinamicas: Dict[Tesela, Tuple[int, float, bytes]] = {} # tesela -> (tick, generada_en, bytes)
+
+    def _capas_estaticas(self, db: Session, version_red: int, tesela: Tesela) -> bytes:
+        clave = (version_red, tesela)
+        with self._lock:
+            cuerpo = self._estaticas.get(clave)
+            if cuerpo is not None:
+                self._estaticas.move_to_end(clave)
+                return cuerpo
+
+        cuerpo = bytes(db.execute(SQL_CAPAS_ESTATICAS, _parametros(*tesela)).scalar() or b"")
+        with self._lock:
+            self._estaticas[clave] = cuerpo
+            while len(self._estaticas) > VECTOR_TILE_CACHE_SIZE:
+                self._estaticas.popitem(last=False)
+        return cuerpo
+
+    def _capas_dinamicas(self, db: Session, tick: int, tesela: Tesela) -> bytes:
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._dinamicas.get(tesela)
+            if entrada is not None and entrada[0] == tick and ahora - entrada[1] < VECTOR_TILE_DYNAMIC_TTL:
+                return entrada[2]
+
+        cuerpo = bytes(db.execute(SQL_CAPAS_DINAMICAS, _parametros(*tesela)).scalar() or b"")
+        with self._lock:
+            # Las teselas de ticks anteriores o vencidas ya no se van a servir
+            if len(self._dinamicas) >= VECTOR_TILE_CACHE_SIZE or any(t != tick for t, _, _ in self._dinamicas.values()):
+                self._dinamicas = {
+                    k: v for k, v in self._dinamicas.items()
+                    if v[0] == tick and ahora - v[1] < VECTOR_TILE_DYNAMIC_TTL
+                }
+            self._dinamicas[tesela] = (tick, ahora, cuerpo)
+        return cuerpo
+
+    def tesela(self, db: Session, version_red: int, tick: int, z: int, x: int, y: int) -> bytes:
+        """Tesela completa: capas estáticas + dinámicas (los mensajes MVT se pueden concatenar)."""
+        tesela = (z, x, y)
+        return self._capas_estaticas(db, version_red, tesela) + self._capas_dinamicas(db, tick, tesela)
+
+
+# Instancia global del servicio
+vector_tile_service = VectorTileService()
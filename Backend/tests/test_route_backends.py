@@ -0,0 +1,118 @@
+# tests/test_route_backends.py
+"""
+Compara los motores de búsqueda de calculate_route ("dijkstra", "matriz" y "contraccion")
+sobre redes sintéticas. La contracción es exacta sobre estados (parada, ruta); Dijkstra y la
+matriz guardan una etiqueta por parada y, con transbordos, pueden dar tiempos mayores.
+"""
+import heapq
+import itertools
+import random
+
+import pytest
+
+from app.services.route_calculation import TRANSFER_PENALTY_SECONDS, _dijkstra
+from app.services.route_contraction import RouteContraction
+from app.services.route_matrix import build_route_matrix
+
+
+def _arista(graph, desde, hasta, costo, ruta_id):
+    graph.setdefault(desde, []).append({"neighbor": hasta, "cost": costo, "ruta_id": ruta_id})
+    graph.setdefault(hasta, [])
+
+
+def _red_aleatoria(semilla: int, paradas: int = 30, rutas: int = 5, caminatas: int = 10):
+    """Rutas como secuencias de paradas (con tramos compartidos) más caminatas entre paradas."""
+    rnd = random.Random(semilla)
+    graph = {}
+    for ruta_id in range(1, rutas + 1):
+        recorrido = rnd.sample(range(paradas), rnd.randint(4, 10))
+        for desde, hasta in zip(recorrido, recorrido[1:]):
+            _arista(graph, desde, hasta, rnd.randint(30, 300), ruta_id)
+    for _ in range(caminatas):
+        desde, hasta = rnd.sample(range(paradas), 2)
+        _arista(graph, desde, hasta, rnd.randint(60, 600), None)
+    return graph
+
+
+def _costo_exacto(graph, inicio, fin):
+    """Dijkstra de referencia sobre estados (parada, ruta con la que se llegó)."""
+    contador = itertools.count()
+    dist = {(inicio, None): 0}
+    heap = [(0, next(contador), inicio, None)]
+    while heap:
+        costo, _, parada, ruta = heapq.heappop(heap)
+        if costo > dist[(parada, ruta)]:
+            continue
+        if parada == fin:
+            return costo
+        for edge in graph[parada]:
+            nuevo = costo + edge["cost"]
+            if ruta is not None and edge["ruta_id"] != ruta:
+                nuevo += TRANSFER_PENALTY_SECONDS
+            estado = (edge["neighbor"], edge["ruta_id"])
+            if nuevo < dist.get(estado, float('inf')):
+                dist[estado] = nuevo
+                heapq.heappush(heap, (nuevo, next(contador), *estado))
+    return None
+
+
+def _costo_camino(path_segments):
+    """Tiempo de un camino devuelto por cualquier motor, con la misma regla de transbordo."""
+    total, ruta = 0, None
+    for segmento in path_segments:
+        total += segmento["cost_seconds"]
+        if ruta is not None and segmento["ruta_id"] != ruta:
+            total += TRANSFER_PENALTY_SECONDS
+        ruta = segmento["ruta_id"]
+    return total
+
+
+def _pares(graph):
+    nodos = sorted(graph)
+    return [(o, d) for o in nodos for d in nodos if o != d]
+
+
+@pytest.mark.parametrize("semilla", range(10))
+def test_contraccion_es_exacta_y_nunca_peor_que_dijkstra(semilla):
+    graph = _red_aleatoria(semilla)
+    contraccion = RouteContraction(graph)
+    for origen, destino in _pares(graph):
+        exacto = _costo_exacto(graph, origen, destino)
+        por_dijkstra = _dijkstra(graph, origen, destino)
+        por_contraccion = contraccion.buscar(origen, destino)
+
+        assert (por_dijkstra is None) == (exacto is None) == (por_contraccion is None)
+        if exacto is None:
+            continue
+        assert por_contraccion["total_time_seconds"] == pytest.approx(exacto)
+        assert _costo_camino(por_contraccion["path_segments"]) == pytest.approx(exacto)
+        # Una etiqueta por parada: el tiempo es el de un camino real, pero puede no ser el óptimo
+        assert por_dijkstra["total_time_seconds"] >= exacto - 1e-6
+        assert _costo_camino(por_dijkstra["path_segments"]) == pytest.approx(por_dijkstra["total_time_seconds"])
+
+
+@pytest.mark.parametrize("semilla", range(3))
+def test_matriz_coincide_con_dijkstra(semilla):
+    graph = _red_aleatoria(semilla)
+    matriz = build_route_matrix(graph, sorted(graph))
+    for origen, destino in _pares(graph):
+        por_dijkstra = _dijkstra(graph, origen, destino)
+        por_matriz = matriz.camino(graph, origen, destino)
+        if por_dijkstra is None:
+            assert por_matriz is None
+            continue
+        assert por_matriz["total_time_seconds"] == pytest.approx(por_dijkstra["total_time_seconds"])
+
+
+def test_diferencia_documentada_entre_dijkstra_y_contraccion():
+    """
+    A llega a B por la ruta 1 (más barata) o por la ruta 2, que es la que sigue hasta C.
+    Dijkstra conserva solo la llegada por la ruta 1 y paga el transbordo; la contracción no.
+    """
+    graph = {}
+    _arista(graph, "A", "B", 100, 1)
+    _arista(graph, "A", "B", 110, 2)
+    _arista(graph, "B", "C", 100, 2)
+
+    assert _dijkstra(graph, "A", "C")["total_time_seconds"] == 200 + TRANSFER_PENALTY_SECONDS
+    assert RouteContraction(graph).buscar("A", "C")["total_time_seconds"] == 210
@@ -1,4 +1,9 @@
+import 'dart:convert';
+
 import 'package:flutter/material.dart';
+import 'package:http/http.dart' as http;
+
+import '../main.dart';
 
 class User {
   final int id;
@@ -25,19 +30,88 @@ class User {
 
 class AuthProvider with ChangeNotifier {
   String? _token;
+  String? _refreshToken;
+  DateTime? _expiresAt;
   User? _user;
+  Future<String?>? _refreshing;
 
   String? get token => _token;
   User? get user => _user;
 
-  void setAuth(String? token, User? user) {
+  void setAuth(
+    String? token,
+    User? user, {
+    String? refreshToken,
+    int? expiresIn,
+  }) {
     _token = token;
     _user = user;
+    _refreshToken = refreshToken;
+    _expiresAt = expiresIn != null
+        ? DateTime.now().add(Duration(seconds: expiresIn))
+        : null;
     notifyListeners();
   }
 
+  /// Access token valid for at least another minute, renewed with the
+  /// refresh token when needed (no password involved).
+  Future<String?> freshToken() async {
+    final expiresAt = _expiresAt;
+    if (_token == null ||
+        _refreshToken == null ||
+        expiresAt == null ||
+        DateTime.now().isBefore(
+          expiresAt.subtract(const Duration(minutes: 1)),
+        )) {
+      return _token;
+    }
+    // Concurrent callers share a single refresh: the refresh token is single-use
+    _refreshing ??= _refresh().whenComplete(() => _refreshing = null);
+    return _refreshing;
+  }
+
+  Future<String?> _refresh() async {
+    try {
+      final response = await http.post(
+        Uri.parse('$apiBaseUrl/api/auth/refresh'),
+        headers: {'Content-Type': 'application/json'},
+        body: jsonEncode({'refresh_token': _refreshToken}),
+      );
+      if (response.statusCode == 200) {
+        final body = jsonDecode(utf8.decode(response.bodyBytes));
+        setAuth(
+          body['access_token'],
+          _user,
+          refreshToken: body['refresh_token'],
+          expiresIn: body['expires_in'],
+        );
+        return _token;
+      }
+      if (response.statusCode == 401) {
+        clearAuth();
+        return null;
+      }
+    } catch (_) {
+      // Network error: keep the current token, the next call retries
+    }
+    return _token;
+  }
+
   void clearAuth() {
+    final refreshToken = _refreshToken;
+    if (refreshToken != null) {
+      // Revokes the refresh token family on the server; no need to wait
+      http
+          .post(
+            Uri.parse('$apiBaseUrl/api/auth/logout'),
+            headers: {'Content-Type': 'application/json'},
+            body: jsonEncode({'refresh_token': refreshToken}),
+          )
+          .catchError((_) => http.Response('', 0));
+    }
     _token = null;
+    _refreshToken = null;
+    _expiresAt = null;
     _user = null;
     notifyListeners();
   }
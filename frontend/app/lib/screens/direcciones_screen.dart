@@ -300,7 +300,7 @@ class _DireccionesScreenState extends State<DireccionesScreen> {
                                   listen: false,
                                 );
                                 final user = auth.user;
-                                final token = auth.token;
+                                final token = await auth.freshToken();
 
                                 if (user == null || token == null) {
                                   navigator
@@ -691,7 +691,7 @@ class _DireccionesScreenState extends State<DireccionesScreen> {
 
     final auth = Provider.of<AuthProvider>(context, listen: false);
     final user = auth.user;
-    final token = auth.token;
+    final token = await auth.freshToken();
 
     if (user == null || token == null) {
       print("startTrackingSession: El usuario no está autenticado. Abortando.");
@@ -779,7 +779,7 @@ class _DireccionesScreenState extends State<DireccionesScreen> {
   Future<void> _setUserOnBus() async {
     final auth = Provider.of<AuthProvider>(context, listen: false);
     final user = auth.user;
-    final token = auth.token;
+    final token = await auth.freshToken();
     final firstRouteName =
         routeResult?['paradas_trayecto']?.first?['ruta_nombre'] as String?;
 
@@ -10,6 +10,7 @@ import 'dart:convert';
 import 'package:app/providers/auth_provider.dart';
 import 'package:http/http.dart' as http;
 import 'package:provider/provider.dart';
+import 'package:web_socket_channel/web_socket_channel.dart';
 import '../main.dart';
 import 'estaciones_screen.dart';
 
@@ -47,17 +48,29 @@ class _IrregularidadesScreenState extends State<IrregularidadesScreen> {
 
   // State for active irregularities
   List<dynamic> _irregularities = [];
+  // /active is paginated: follow X-Siguiente-Cursor up to this many pages per visible area
+  static const int _irregularitiesPageSize = 500;
+  static const int _irregularitiesMaxPages = 10;
+  int _fetchGeneration = 0; // Drops results of fetches superseded by a newer map position
+
+  // Push channel: new or updated irregularities inside the visible area
+  WebSocketChannel? _pushChannel;
+  StreamSubscription? _pushSubscription;
 
   @override
   void initState() {
     super.initState();
-    _fetchIrregularities();
 
     // Listener to reposition the info window when the map moves
-    _mapEventSubscription = _mapController.mapEventStream.listen((_) {
+    _mapEventSubscription = _mapController.mapEventStream.listen((event) {
       if (_infoWindowOverlay != null) {
         _removeInfoWindow();
       }
+      // Only the irregularities of the visible area are requested
+      if (event is MapEventMoveEnd) {
+        _fetchIrregularities();
+        _subscribeVisibleArea();
+      }
     });
 
     _locationFocusNode.addListener(() {
@@ -73,6 +86,8 @@ class _IrregularidadesScreenState extends State<IrregularidadesScreen> {
   @override
   void dispose() {
     _mapEventSubscription?.cancel();
+    _pushSubscription?.cancel();
+    _pushChannel?.sink.close();
     _locationController.dispose();
     _titleController.dispose();
     _descriptionController.dispose();
@@ -91,21 +106,81 @@ class _IrregularidadesScreenState extends State<IrregularidadesScreen> {
     }
   }
 
-  Future<void> _fetchIrregularities() async {
+  String _visibleBbox() {
+    final bounds = _mapController.camera.visibleBounds;
+    return [bounds.west, bounds.south, bounds.east, bounds.north].join(',');
+  }
+
+  void _onMapReady() {
+    _fetchIrregularities();
+    _connectPushChannel();
+  }
+
+  void _connectPushChannel() {
     try {
-      final response = await http.get(
-        Uri.parse('$apiBaseUrl/api/irregularities/active'),
+      _pushChannel = WebSocketChannel.connect(
+        Uri.parse('$wsApiBaseUrl/api/irregularities/ws'),
       );
+      _pushSubscription = _pushChannel!.stream.listen(
+        _handlePushMessage,
+        // Without the channel the screen still refreshes on every map move
+        onError: (_) => _pushChannel = null,
+        onDone: () => _pushChannel = null,
+      );
+      _subscribeVisibleArea();
+    } catch (_) {
+      _pushChannel = null;
+    }
+  }
 
-      if (response.statusCode == 200) {
-        if (mounted) {
-          final List<dynamic> data = jsonDecode(
-            utf8.decode(response.bodyBytes),
-          );
-          setState(() {
-            _irregularities = data;
-          });
-        }
+  void _subscribeVisibleArea() {
+    _pushChannel?.sink.add(jsonEncode({'bbox': _visibleBbox()}));
+  }
+
+  void _handlePushMessage(dynamic message) {
+    final data = jsonDecode(message as String);
+    if (data['tipo'] != 'irregularidad' || !mounted) return;
+    final irregularity = data['irregularidad'];
+    setState(() {
+      final index = _irregularities.indexWhere(
+        (ir) => ir['id'] == irregularity['id'],
+      );
+      if (irregularity['activa'] != true) {
+        if (index != -1) _irregularities.removeAt(index);
+      } else if (index != -1) {
+        _irregularities[index] = irregularity;
+      } else {
+        _irregularities.add(irregularity);
+      }
+    });
+  }
+
+  Future<void> _fetchIrregularities() async {
+    final generation = ++_fetchGeneration;
+    try {
+      final bbox = _visibleBbox();
+      final List<dynamic> data = [];
+      String? cursor;
+      for (var page = 0; page < _irregularitiesMaxPages; page++) {
+        final query = {
+          'bbox': bbox,
+          'limite': '$_irregularitiesPageSize',
+          if (cursor != null) 'cursor': cursor,
+        };
+        final response = await http.get(
+          Uri.parse('$apiBaseUrl/api/irregularities/active')
+              .replace(queryParameters: query),
+        );
+        if (response.statusCode != 200) return;
+        data.addAll(jsonDecode(utf8.decode(response.bodyBytes)));
+        cursor = response.headers['x-siguiente-cursor'];
+        if (cursor == null || generation != _fetchGeneration) break;
+      }
+
+      if (mounted && generation == _fetchGeneration) {
+        setState(() {
+          _irregularities = data;
+        });
       }
     } catch (e) {
       if (mounted) {
@@ -461,7 +536,10 @@ class _IrregularidadesScreenState extends State<IrregularidadesScreen> {
 
     if (_titleErrorText != null || _locationErrorText != null) return;
 
-    final authToken = Provider.of<AuthProvider>(context, listen: false).token;
+    final authToken = await Provider.of<AuthProvider>(
+      context,
+      listen: false,
+    ).freshToken();
 
     if (authToken == null) {
       ScaffoldMessenger.of(context).showSnackBar(
@@ -497,10 +575,15 @@ class _IrregularidadesScreenState extends State<IrregularidadesScreen> {
       );
 
       if (mounted) {
-        if (response.statusCode == 201) {
+        // 200: ya había un reporte cercano y reciente; el nuevo cuenta como confirmación
+        if (response.statusCode == 201 || response.statusCode == 200) {
           ScaffoldMessenger.of(context).showSnackBar(
-            const SnackBar(
-              content: Text('Irregularidad reportada con éxito.'),
+            SnackBar(
+              content: Text(
+                response.statusCode == 201
+                    ? 'Irregularidad reportada con éxito.'
+                    : 'Ya estaba reportada cerca: se sumó tu confirmación.',
+              ),
               backgroundColor: Colors.green,
             ),
           );
@@ -545,7 +628,10 @@ class _IrregularidadesScreenState extends State<IrregularidadesScreen> {
   }
 
   Future<void> _voteForIrregularity(int irregularityId, bool isLike) async {
-    final authToken = Provider.of<AuthProvider>(context, listen: false).token;
+    final authToken = await Provider.of<AuthProvider>(
+      context,
+      listen: false,
+    ).freshToken();
     if (authToken == null) {
       ScaffoldMessenger.of(context).showSnackBar(
         const SnackBar(
@@ -601,7 +687,10 @@ class _IrregularidadesScreenState extends State<IrregularidadesScreen> {
   }
 
   Future<dynamic> _updateIrregularityData(int irregularityId) async {
-    final authToken = Provider.of<AuthProvider>(context, listen: false).token;
+    final authToken = await Provider.of<AuthProvider>(
+      context,
+      listen: false,
+    ).freshToken();
     if (authToken == null) {
       if (mounted) {
         ScaffoldMessenger.of(context).showSnackBar(
@@ -652,9 +741,10 @@ class _IrregularidadesScreenState extends State<IrregularidadesScreen> {
           FlutterMap(
             key: _mapContainerKey,
             mapController: _mapController,
-            options: const MapOptions(
-              initialCenter: LatLng(10.3910, -75.4794), // Cartagena
+            options: MapOptions(
+              initialCenter: const LatLng(10.3910, -75.4794), // Cartagena
               initialZoom: 14.5,
+              onMapReady: _onMapReady,
             ),
             children: [
               TileLayer(
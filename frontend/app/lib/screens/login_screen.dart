@@ -89,7 +89,12 @@ class _LoginScreenState extends State<LoginScreen> {
             Provider.of<AuthProvider>(
               context,
               listen: false,
-            ).setAuth(token, user);
+            ).setAuth(
+              token,
+              user,
+              refreshToken: responseBody['refresh_token'],
+              expiresIn: responseBody['expires_in'],
+            );
 
             // Usar navegación por nombre para ir a la pantalla principal
             Navigator.pushNamedAndRemoveUntil(
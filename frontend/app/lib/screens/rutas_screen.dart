@@ -7,6 +7,10 @@ import 'package:app/screens/irregularidades_screen.dart';
 import 'package:app/screens/estaciones_screen.dart';
 import '../main.dart';
 
+// Catálogo de rutas guardado entre aperturas de la pantalla; se revalida con su ETag.
+String? _rutasEtag;
+List<int>? _rutasBody;
+
 class RutasScreen extends StatefulWidget {
   const RutasScreen({super.key});
 
@@ -29,9 +33,18 @@ class _RutasScreenState extends State<RutasScreen> {
 
   Future<void> _fetchRutas() async {
     try {
-      final response = await http.get(Uri.parse('$apiBaseUrl/api/ruta/rutas'));
+      final response = await http.get(
+        Uri.parse('$apiBaseUrl/api/ruta/rutas'),
+        headers: {if (_rutasEtag != null) 'If-None-Match': _rutasEtag!},
+      );
       if (response.statusCode == 200) {
-        final List<dynamic> data = jsonDecode(utf8.decode(response.bodyBytes));
+        _rutasEtag = response.headers['etag'];
+        _rutasBody = response.bodyBytes;
+      }
+      // 304: el catálogo no cambió, se reutiliza el cuerpo guardado
+      if (response.statusCode == 200 ||
+          (response.statusCode == 304 && _rutasBody != null)) {
+        final List<dynamic> data = jsonDecode(utf8.decode(_rutasBody!));
 
         // Lógica de ordenamiento personalizado
         data.sort((a, b) {